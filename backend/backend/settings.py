@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
 from pathlib import Path
+from celery.schedules import crontab
 from dotenv import load_dotenv, find_dotenv
 
 if not find_dotenv():
@@ -34,9 +35,11 @@ ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS').split(',')
 TELEGRAM_LOG_BOT_TOKEN = str(os.environ.get('TELEGRAM_LOG_BOT_TOKEN'))
 TELEGRAM_LOG_CHAT_ID = int(os.environ.get('TELEGRAM_LOG_CHAT_ID'))
 NGROK_URL = os.environ.get('NGROK_URL')
+# Бот, от имени которого отправляются рассылки пользователям (notifications.py)
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
 
 # Application definition
-print(ALLOWED_HOSTS)
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -53,6 +56,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'move_on.middleware.MetricsMiddleware',
+    'move_on.middleware.ReplicaPinMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -98,6 +103,21 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения: через запятую host или host:port, база и учётные данные как у default.
+# Добавляются как replica_1, replica_2, ...; какие запросы читают с реплик — см. move_on/db_router.py
+DATABASE_REPLICAS = []
+for _index, _replica in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    _host, _, _port = _replica.strip().partition(':')
+    DATABASES[f'replica_{_index}'] = {
+        **DATABASES['default'],
+        'HOST': _host,
+        'PORT': _port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{_index}')
+
+DATABASE_ROUTERS = ['move_on.db_router.ReplicaRouter']
+
 SWAGGER_SETTINGS = {
     'DEFAULT_AUTO_SCHEMA_CLASS': 'drf_yasg.inspectors.SwaggerAutoSchema',
     'USE_SESSION_AUTH': False,
@@ -146,11 +166,14 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
-# STATIC_URL = 'static/'
-# STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
-# STATICFILES_DIRS = [
-#     os.path.join(BASE_DIR, 'move_on/static'),
-# ]
+# Статику собирает manage.py build_assets (move_on/assets.py), отдаёт nginx
+STATIC_URL = 'static/'
+STATIC_ROOT = os.environ.get('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'move_on.assets.AssetStorage'},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -182,8 +205,29 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
+    # Лимиты запросов на запись на один telegram_id (см. move_on/throttling.py)
+    'DEFAULT_THROTTLE_RATES': {
+        'walk_update': os.environ.get('THROTTLE_WALK_UPDATE', '5/s'),
+        'daily_bonus': os.environ.get('THROTTLE_DAILY_BONUS', '10/min'),
+        'lucky_throw': os.environ.get('THROTTLE_LUCKY_THROW', '10/min'),
+        'task_complete': os.environ.get('THROTTLE_TASK_COMPLETE', '30/min'),
+        'offline_walk': os.environ.get('THROTTLE_OFFLINE_WALK', '10/h'),
+    },
 }
 
+# Сколько корзин ограничения частоты держать в памяти процесса, пока Redis недоступен
+THROTTLE_LOCAL_MAX_KEYS = int(os.environ.get('THROTTLE_LOCAL_MAX_KEYS', 100000))
+
+LOG_DIR = os.environ.get('LOG_DIR', os.path.join(BASE_DIR, 'logs'))
+os.makedirs(LOG_DIR, exist_ok=True)
+
+# Приём логов фронтенда (LogView)
+FRONTEND_LOG_MAX_BYTES = int(os.environ.get('FRONTEND_LOG_MAX_BYTES', 64 * 1024))
+FRONTEND_LOG_MAX_BATCH = int(os.environ.get('FRONTEND_LOG_MAX_BATCH', 100))
+FRONTEND_LOG_MAX_MESSAGE = int(os.environ.get('FRONTEND_LOG_MAX_MESSAGE', 2000))
+FRONTEND_LOG_USER_LIMIT = int(os.environ.get('FRONTEND_LOG_USER_LIMIT', 600))
+FRONTEND_LOG_SAMPLE_RATE = float(os.environ.get('FRONTEND_LOG_SAMPLE_RATE', 1.0))
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -192,6 +236,10 @@ LOGGING = {
             "format": "{levelname} {asctime} {module} {message} {args}",
             "style": "{",
         },
+        "frontend": {
+            "format": "{asctime} {levelname} {message}",
+            "style": "{",
+        },
     },
 
     "handlers": {
@@ -205,6 +253,15 @@ LOGGING = {
             "class": "logging.StreamHandler",
             "formatter": "verbose",
         },
+        "frontend_file": {
+            "level": "DEBUG",
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": os.path.join(LOG_DIR, 'frontend.log'),
+            "maxBytes": 50 * 1024 * 1024,
+            "backupCount": 5,
+            "delay": True,
+            "formatter": "frontend",
+        },
     },
 
     "loggers": {
@@ -228,10 +285,26 @@ LOGGING = {
             "level": "INFO",
             "propagate": False,
         },
+        "move_on.frontend": {
+            "handlers": ["frontend_file"],
+            "level": "DEBUG",
+            "propagate": False,
+        },
     },
 
 }
 
+if os.environ.get('TELEGRAM_LOG_BOT_TOKEN'):
+    LOGGING['handlers']['telegram'] = {
+        'level': 'ERROR',
+        'class': 'move_on.telegram_logger.TelegramHandler',
+        'formatter': 'verbose',
+        'bot_token': TELEGRAM_LOG_BOT_TOKEN,
+        'chat_id': TELEGRAM_LOG_CHAT_ID,
+    }
+    LOGGING['loggers']['django.request']['handlers'].append('telegram')
+    LOGGING['loggers']['move_on']['handlers'].append('telegram')
+
 
 
 
@@ -242,8 +315,177 @@ LOGGING = {
 #     f'{NGROK_URL}',
 # ]
 
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/1')
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 0.1))
+REDIS_RETRY_INTERVAL = float(os.environ.get('REDIS_RETRY_INTERVAL', 30))
+
+# Пороги проверки готовности /health/ready/ (в миллисекундах)
+READINESS_MAX_DB_MS = float(os.environ.get('READINESS_MAX_DB_MS', 500))
+READINESS_MAX_REDIS_MS = float(os.environ.get('READINESS_MAX_REDIS_MS', 200))
+READINESS_REQUIRE_REDIS = os.environ.get('READINESS_REQUIRE_REDIS', '1') == '1'
+
+# Бюджет холодного старта веб-процесса (manage.py profile_startup --check, тесты)
+STARTUP_BUDGET_MS = int(os.environ.get('STARTUP_BUDGET_MS', 1500))
+
+# Кэш telegram_id → пользователь: размер и TTL кэша процесса (в секундах), TTL записей в Redis
+IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 60))
+IDENTITY_CACHE_REDIS_TTL = int(os.environ.get('IDENTITY_CACHE_REDIS_TTL', 3600))
+
+# Буфер счётчиков пользователя (points, energy): 'redis', 'memory' (только один процесс) или 'off'
+COUNTER_BUFFER = os.environ.get('COUNTER_BUFFER', 'redis')
+COUNTER_FLUSH_INTERVAL = float(os.environ.get('COUNTER_FLUSH_INTERVAL', 5))
+COUNTER_FLUSH_BATCH = int(os.environ.get('COUNTER_FLUSH_BATCH', 500))
+COUNTER_BUFFER_MAX_USERS = int(os.environ.get('COUNTER_BUFFER_MAX_USERS', 20000))
+
+# Офлайн-прогулки: лимит тела запроса (как пришло, обычно gzip), после распаковки и число замеров
+OFFLINE_WALK_MAX_BYTES = int(os.environ.get('OFFLINE_WALK_MAX_BYTES', 2 * 1024 * 1024))
+OFFLINE_WALK_MAX_UNPACKED_BYTES = int(os.environ.get('OFFLINE_WALK_MAX_UNPACKED_BYTES', 20 * 1024 * 1024))
+OFFLINE_WALK_MAX_SAMPLES = int(os.environ.get('OFFLINE_WALK_MAX_SAMPLES', 100000))
+# Насколько часы устройства могут спешить: прогулка, закончившаяся позже now() + этот запас, отклоняется
+OFFLINE_WALK_CLOCK_SKEW_SECONDS = int(os.environ.get('OFFLINE_WALK_CLOCK_SKEW_SECONDS', 300))
+
+# Завершение прогулок в фоне (walk_pipeline): через сколько секунд перезапускать застрявшие,
+# пороги антифрода для отметки прогулки недостоверной
+WALK_FINALIZE_RESUME_AFTER = int(os.environ.get('WALK_FINALIZE_RESUME_AFTER', 600))
+ANTICHEAT_MAX_SPEED_KMH = float(os.environ.get('ANTICHEAT_MAX_SPEED_KMH', 25))
+ANTICHEAT_MAX_STEP_LENGTH_M = float(os.environ.get('ANTICHEAT_MAX_STEP_LENGTH_M', 2.5))
+
+# Помесячные секции прогулок и аномалий (PostgreSQL): сколько месяцев создавать заранее,
+# сколько хранить в базе (0 — не архивировать) и куда выгружать отсоединённые секции
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+WALK_PARTITION_RETAIN_MONTHS = int(os.environ.get('WALK_PARTITION_RETAIN_MONTHS', 24))
+ANOMALY_PARTITION_RETAIN_MONTHS = int(os.environ.get('ANOMALY_PARTITION_RETAIN_MONTHS', 12))
+PARTITION_ARCHIVE_DIR = os.environ.get('PARTITION_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+
+# Директивы частоты телеметрии (backpressure): базовые и максимальные интервалы замеров и отправки (мс),
+# бюджет обновлений прогулки на процесс (в секунду и запас на всплеск), сколько одновременно обрабатываемых
+# обновлений считается полной нагрузкой процесса, во сколько раз растёт интервал
+# отправки при полной нагрузке, пороги «стоит на месте» (м/с) и «ровный темп» (доля от средней скорости)
+TELEMETRY_SAMPLE_INTERVAL_MS = int(os.environ.get('TELEMETRY_SAMPLE_INTERVAL_MS', 1000))
+TELEMETRY_FLUSH_INTERVAL_MS = int(os.environ.get('TELEMETRY_FLUSH_INTERVAL_MS', 1000))
+TELEMETRY_MAX_SAMPLE_INTERVAL_MS = int(os.environ.get('TELEMETRY_MAX_SAMPLE_INTERVAL_MS', 5000))
+TELEMETRY_MAX_FLUSH_INTERVAL_MS = int(os.environ.get('TELEMETRY_MAX_FLUSH_INTERVAL_MS', 30000))
+TELEMETRY_NODE_RATE = float(os.environ.get('TELEMETRY_NODE_RATE', 200))
+TELEMETRY_NODE_BURST = float(os.environ.get('TELEMETRY_NODE_BURST', 400))
+TELEMETRY_NODE_MAX_IN_FLIGHT = int(os.environ.get('TELEMETRY_NODE_MAX_IN_FLIGHT', 32))
+TELEMETRY_MAX_SLOWDOWN = float(os.environ.get('TELEMETRY_MAX_SLOWDOWN', 8))
+TELEMETRY_STATIONARY_SPEED = float(os.environ.get('TELEMETRY_STATIONARY_SPEED', 0.3))
+TELEMETRY_STEADY_TOLERANCE = float(os.environ.get('TELEMETRY_STEADY_TOLERANCE', 0.2))
+
+# Живые обновления прогулки (SSE): пинг при простое и максимальная длительность потока (в секундах),
+# сколько непрочитанных обновлений держать на один поток (старые отбрасываются)
+WALK_STREAM_HEARTBEAT = float(os.environ.get('WALK_STREAM_HEARTBEAT', 15))
+WALK_STREAM_MAX_SECONDS = int(os.environ.get('WALK_STREAM_MAX_SECONDS', 3 * 60 * 60))
+WALK_STREAM_QUEUE_SIZE = int(os.environ.get('WALK_STREAM_QUEUE_SIZE', 8))
+
+# Чтение с реплик: допустимое отставание и как часто его проверять (в секундах),
+# сколько секунд после записи клиент читает только из основной базы
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', 5))
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+
+# Выгрузка данных для аналитики: сколько строк читать из базы и отправлять клиенту за раз
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
+# Админка: до скольки строк (по оценке планировщика) список считается точным COUNT(*),
+# за сколько последних дней задача refresh_daily_rollups пересчитывает суточные сводки
+ADMIN_EXACT_COUNT_LIMIT = int(os.environ.get('ADMIN_EXACT_COUNT_LIMIT', 10000))
+ROLLUP_REFRESH_DAYS = int(os.environ.get('ROLLUP_REFRESH_DAYS', 2))
+
+# Массовая модерация (moderation.py): пользователей в одной транзакции, наибольший размер задания
+# и через сколько секунд без продвижения задание считается зависшим и перезапускается
+MODERATION_CHUNK_SIZE = int(os.environ.get('MODERATION_CHUNK_SIZE', 500))
+MODERATION_MAX_USERS = int(os.environ.get('MODERATION_MAX_USERS', 100000))
+MODERATION_STALE_SECONDS = int(os.environ.get('MODERATION_STALE_SECONDS', 600))
+
+# Реферальный граф (referral_graph.py): до какой глубины хранится таблица замыкания;
+# подозрительный кластер — от MIN_SIZE аккаунтов, кто-то пригласил не меньше MIN_FANOUT,
+# а доля аккаунтов меньше чем с REFERRAL_LOW_ACTIVITY_STEPS шагами не меньше LOW_ACTIVITY_SHARE
+REFERRAL_CLOSURE_MAX_DEPTH = int(os.environ.get('REFERRAL_CLOSURE_MAX_DEPTH', 30))
+REFERRAL_CLUSTER_MIN_SIZE = int(os.environ.get('REFERRAL_CLUSTER_MIN_SIZE', 50))
+REFERRAL_CLUSTER_MIN_FANOUT = int(os.environ.get('REFERRAL_CLUSTER_MIN_FANOUT', 20))
+REFERRAL_CLUSTER_LOW_ACTIVITY_SHARE = float(os.environ.get('REFERRAL_CLUSTER_LOW_ACTIVITY_SHARE', 0.8))
+REFERRAL_LOW_ACTIVITY_STEPS = int(os.environ.get('REFERRAL_LOW_ACTIVITY_STEPS', 1000))
+
+# Рассылки (notifications.py): сообщений в секунду на бота и секунд между сообщениями в один чат
+# (лимиты Telegram), одновременных запросов, получателей в пачке, повторов при ошибках и базовая
+# задержка повтора, таймаут запроса и через сколько секунд без продвижения рассылка считается зависшей
+NOTIFY_RATE_PER_SECOND = float(os.environ.get('NOTIFY_RATE_PER_SECOND', 25))
+NOTIFY_CHAT_INTERVAL = float(os.environ.get('NOTIFY_CHAT_INTERVAL', 1))
+NOTIFY_CONCURRENCY = int(os.environ.get('NOTIFY_CONCURRENCY', 20))
+NOTIFY_CHUNK_SIZE = int(os.environ.get('NOTIFY_CHUNK_SIZE', 1000))
+NOTIFY_MAX_RETRIES = int(os.environ.get('NOTIFY_MAX_RETRIES', 5))
+NOTIFY_RETRY_BACKOFF = float(os.environ.get('NOTIFY_RETRY_BACKOFF', 1))
+NOTIFY_TIMEOUT = float(os.environ.get('NOTIFY_TIMEOUT', 10))
+NOTIFY_STALE_SECONDS = int(os.environ.get('NOTIFY_STALE_SECONDS', 600))
+
+# Как часто (в секундах) процесс перечитывает активные задания для учёта прогулок (task_progress.py)
+TASK_INDEX_TTL = float(os.environ.get('TASK_INDEX_TTL', 60))
+
+# Сколько секунд живут версии данных пользователя для ETag (conditional.py); после истечения клиент один раз получит ответ целиком
+USER_VERSION_TTL = int(os.environ.get('USER_VERSION_TTL', 7 * 24 * 60 * 60))
+
+# Сколько секунд список заданий можно отдавать из кэша (в том числе из кэша nginx) без проверки
+TASKS_CACHE_SECONDS = int(os.environ.get('TASKS_CACHE_SECONDS', 60))
+
+# Сколько секунд клиент может показывать топ рефералов без запроса: очки рефералов меняются с каждой их прогулкой
+REFERRALS_CACHE_SECONDS = int(os.environ.get('REFERRALS_CACHE_SECONDS', 60))
+
+# Уровень сжатия brotli при сборке статики (manage.py build_assets): 11 — лучшее сжатие, но самое медленное
+ASSET_BROTLI_QUALITY = int(os.environ.get('ASSET_BROTLI_QUALITY', 11))
+
+# Метрики процесса отправляются в Redis не чаще одного раза за интервал (в секундах)
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+# Постановка задач из веб-запросов не должна ждать недоступный брокер секундами:
+# такие задачи подбирают периодические задачи (resume_walk_finalization, retry_pending_offline_walks,
+# resume_moderation_jobs, resume_notification_campaigns)
+CELERY_BROKER_TRANSPORT_OPTIONS = {'max_retries': 1, 'interval_start': 0, 'interval_step': 0.2, 'interval_max': 0.2}
+CELERY_BEAT_SCHEDULE = {
+    'flush-user-counters': {
+        'task': 'move_on.tasks.flush_user_counters',
+        'schedule': COUNTER_FLUSH_INTERVAL,
+    },
+    'resume-walk-finalization': {
+        'task': 'move_on.tasks.resume_walk_finalization',
+        'schedule': 300,
+    },
+    'retry-pending-offline-walks': {
+        'task': 'move_on.tasks.retry_pending_offline_walks',
+        'schedule': 300,
+    },
+    'maintain-partitions': {
+        'task': 'move_on.tasks.maintain_partitions',
+        'schedule': 24 * 60 * 60,
+    },
+    'refresh-daily-rollups': {
+        'task': 'move_on.tasks.refresh_daily_rollups',
+        'schedule': 60 * 60,
+    },
+    'resume-moderation-jobs': {
+        'task': 'move_on.tasks.resume_moderation_jobs',
+        'schedule': 300,
+    },
+    'find-referral-clusters': {
+        'task': 'move_on.tasks.find_referral_clusters',
+        'schedule': 24 * 60 * 60,
+    },
+    'maintain-challenge-leaderboards': {
+        'task': 'move_on.tasks.maintain_challenge_leaderboards',
+        'schedule': 300,
+    },
+    'resume-notification-campaigns': {
+        'task': 'move_on.tasks.resume_notification_campaigns',
+        'schedule': 300,
+    },
+    'start-streak-reminders': {
+        'task': 'move_on.tasks.start_streak_reminders',
+        'schedule': crontab(hour=18, minute=0),
+    },
+}
 USE_X_FORWARDED_HOST = True
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
\ No newline at end of file
@@ -21,7 +21,9 @@ from backend import settings
 from django.conf.urls.static import static
 from move_on.views import get_energy, tasks_complete, WalkViewSet, get_statistics, check_unfinished, \
     main_page, get_tasks, stepometer, claim_daily_bonus, streak_history, global_statistics, user_top_referrals, LogView, \
-    home
+    home, metrics, health_live, health_ready, offline_walk, user_tasks, \
+    challenge_leaderboard
+from move_on import async_views
 from rest_framework.routers import DefaultRouter
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
@@ -50,6 +52,7 @@ urlpatterns = [
     path('energy/<int:telegram_id>/', get_energy, name='get_energy'),
     path('tasks/', get_tasks, name='get_tasks'),
     path('tasks/<int:task_id>/complete/', tasks_complete, name='tasks_complete'),
+    path('tasks/user/<int:telegram_id>/', user_tasks, name='user_tasks'),
     path('streak/history/<int:telegram_id>/', streak_history, name='streak_history'),
     path('bonus/claim/<int:telegram_id>/', claim_daily_bonus, name='claim_daily_bonus'),
     # path('stepometer/', stepometer, name='stepometer'),
@@ -60,10 +63,21 @@ urlpatterns = [
     path('t/', TemplateView.as_view(template_name='webapp_test.html')),
     path('api/walk/check_unfinished/', check_unfinished, name='check_unfinished'),
     path('api/top-referrals/<int:telegram_id>/', user_top_referrals, name='user-top-referrals'),
+    path('api/challenges/<int:task_id>/leaderboard/', challenge_leaderboard, name='challenge_leaderboard'),
+    path('api/walks/offline/', offline_walk, name='offline_walk'),
     path('logs/', LogView.as_view(), name='log-view'),
+    path('metrics', metrics, name='metrics'),
+    path('health/live/', health_live, name='health_live'),
+    path('health/ready/', health_ready, name='health_ready'),
+    # Асинхронные варианты частых запросов, обслуживаются ASGI-сервисом (см. nginx.conf)
+    path('api/async/walks/<int:pk>/update/', async_views.walk_update, name='async_walk_update'),
+    path('api/async/walks/<int:pk>/finish/', async_views.walk_finish, name='async_walk_finish'),
+    path('api/async/walks/<int:pk>/stream/', async_views.walk_stream, name='async_walk_stream'),
+    path('api/async/stepometer/', async_views.stepometer, name='async_stepometer'),
+    path('api/async/energy/<int:telegram_id>/', async_views.get_energy, name='async_get_energy'),
+    path('api/async/exports/<str:dataset>/', async_views.export, name='async_export'),
 ]
 
 urlpatterns += router.urls
-print(f'URLS: {urlpatterns}')
 # if settings.DEBUG:
 #     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
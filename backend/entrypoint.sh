@@ -0,0 +1,9 @@
+#!/bin/sh
+set -e
+
+# Статику для nginx собирает один сервис (см. move_on/assets.py)
+if [ "${BUILD_ASSETS:-0}" = "1" ]; then
+    python manage.py build_assets --verbosity 0
+fi
+
+exec "$@"
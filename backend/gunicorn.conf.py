@@ -0,0 +1,47 @@
+"""
+Конфигурация gunicorn для production-режима (см. docker-compose.prod.yml).
+
+Приложение загружается в мастер-процессе до fork (preload_app), поэтому Django, numpy и scipy
+импортируются один раз и разделяются воркерами через copy-on-write.
+Перезапуск воркеров без простоя: kill -HUP <pid мастера>. При preload_app HUP не перечитывает
+код приложения — после обновления кода контейнер нужно перезапустить.
+"""
+import os
+
+cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND') or '0.0.0.0:8000'
+workers = int(os.environ.get('GUNICORN_WORKERS') or cpu_count * 2 + 1)
+threads = int(os.environ.get('GUNICORN_THREADS') or 4)
+worker_class = 'gthread' if threads > 1 else 'sync'
+preload_app = True
+
+# Перезапуск воркера после max_requests запросов ограничивает рост памяти;
+# jitter разносит перезапуски воркеров во времени
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS') or 2000)
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER') or 200)
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT') or 30)
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT') or 30)
+keepalive = 5
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    """
+    Импортирует URLconf, представления и numpy/scipy в мастере, чтобы воркеры получили их готовыми после fork.
+    """
+    from django.db import connections
+    from django.urls import get_resolver
+    from move_on.motion import preload
+
+    get_resolver().url_patterns
+    preload()
+    connections.close_all()
+
+
+def post_fork(server, worker):
+    from django.db import connections
+
+    connections.close_all()
@@ -1,80 +1,281 @@
-from django.contrib import admin
-from .models import User, Walk, Task, Statistics, DailyBonus, Referral, WalkSession, AnomalyLog, Donation
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .models import User, Walk, Task, Statistics, DailyBonus, Referral, WalkSession, AnomalyLog, Donation, \
+    OfflineWalkSubmission, ModerationJob, NotificationCampaign
 from django.contrib.auth.models import Group, User as US
 from django_celery_beat.models import (
     ClockedSchedule, CrontabSchedule, IntervalSchedule, PeriodicTask, SolarSchedule
 )
+from . import moderation, notifications, query_plans
+from .db_router import read_replica
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор без точного COUNT(*) на больших выборках: если планировщик оценивает выборку
+    больше чем в ADMIN_EXACT_COUNT_LIMIT строк, число строк и страниц берётся из оценки.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = query_plans.estimated_rows(self.object_list)
+        if estimate is None or estimate < settings.ADMIN_EXACT_COUNT_LIMIT:
+            return super().count
+        return estimate
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Основа админки для больших таблиц:
+    - списки читаются с реплики; шаблон отрисовывается внутри блока read_replica(),
+      потому что queryset страницы выполняется только при отрисовке;
+    - число строк оценивается (EstimatedCountPaginator), полный COUNT(*) без фильтров не считается;
+    - число в поиске ищется точным совпадением по полям telegram_id_search (по индексу), а не icontains
+      по приведённому к тексту значению.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    telegram_id_search = ()
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with read_replica():
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if self.telegram_id_search and term:
+            if term.isdigit():
+                lookups = (Q(**{field: int(term)}) for field in self.telegram_id_search)
+                return queryset.filter(reduce(or_, lookups)), False
+            if set(self.get_search_fields(request)) <= set(self.telegram_id_search):
+                return queryset.none(), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+class RollupDateAdmin(LargeTableAdmin):
+    """
+    Навигация по датам created_at строится по суточным сводкам (см. rollups.py).
+    """
+    date_hierarchy = 'created_at'
+    change_list_template = 'admin/move_on/rollup_change_list.html'
+
+
+def _moderation_action(action, description):
+    """
+    Действие списка пользователей, которое запускает задание массовой модерации (см. moderation.py)
+    для выбранных пользователей, в том числе для всей отфильтрованной выборки.
+    """
+
+    def run(modeladmin, request, queryset):
+        user_ids = list(queryset.order_by('id').values_list('id', flat=True)[:settings.MODERATION_MAX_USERS + 1])
+        if len(user_ids) > settings.MODERATION_MAX_USERS:
+            modeladmin.message_user(
+                request, f"Выбрано больше {settings.MODERATION_MAX_USERS} пользователей, уточните фильтр.",
+                messages.ERROR,
+            )
+            return
+        job = moderation.create_job(action, user_ids, created_by=request.user)
+        url = reverse('admin:move_on_moderationjob_change', args=[job.pk])
+        modeladmin.message_user(
+            request, format_html('Задание модерации <a href="{}">{}</a> поставлено в очередь: {} польз.',
+                                 url, job.pk, job.total),
+            messages.SUCCESS,
+        )
+
+    run.__name__ = f"moderate_{action}"
+    return admin.action(description=description, permissions=['change'])(run)
+
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(RollupDateAdmin):
     """
     Администрирование модели пользователя.
     """
     list_display = ('telegram_id', 'username', 'energy', 'points',
                     'daily_streak', 'is_active', 'is_scam', 'is_fake', 'created_at')
-    search_fields = ('telegram_id', 'username', 'first_name', 'last_name')
+    # username, first_name и last_name ищутся по триграммным индексам (миграция 0004)
+    search_fields = ('username', 'first_name', 'last_name')
+    telegram_id_search = ('telegram_id',)
     list_filter = ('is_active', 'is_scam', 'is_fake', 'created_at')
     ordering = ('-created_at',)
     readonly_fields = ('created_at', 'updated_at')
+    actions = [_moderation_action(action, description) for action, description in ModerationJob.ACTION_CHOICES]
 
 
 @admin.register(Walk)
-class WalkAdmin(admin.ModelAdmin):
+class WalkAdmin(RollupDateAdmin):
     """
     Администрирование модели прогулок.
     """
     list_display = ('id', 'user', 'start_time', 'end_time', 'steps',
                     'distance', 'avg_speed', 'reward', 'is_valid', 'is_lucky_walk')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
     search_fields = ('user__telegram_id',)
+    telegram_id_search = ('user__telegram_id',)
     list_filter = ('is_valid', 'is_lucky_walk', 'start_time')
-    ordering = ('-start_time',)
+    # По created_at секционирована таблица и построен индекс walk_created_idx
+    ordering = ('-created_at',)
 
 @admin.register(Task)
-class TaskAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'task_type', 'is_active', 'start_date', 'end_date')
-    list_filter = ('task_type', 'is_active')
+class TaskAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'task_type', 'metric', 'target', 'is_active', 'start_date', 'end_date',
+                    'leaderboard_frozen_at')
+    list_filter = ('task_type', 'metric', 'is_active')
+    readonly_fields = ('leaderboard_frozen_at',)
 
 
 @admin.register(Statistics)
-class StatisticsAdmin(admin.ModelAdmin):
+class StatisticsAdmin(LargeTableAdmin):
     """
     Администрирование модели статистики.
     """
     list_display = ('user', 'total_steps', 'total_distance', 'total_rewards')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
     search_fields = ('user__telegram_id',)
+    telegram_id_search = ('user__telegram_id',)
     ordering = ('user__telegram_id',)
 
 
 @admin.register(DailyBonus)
-class DailyBonusAdmin(admin.ModelAdmin):
+class DailyBonusAdmin(LargeTableAdmin):
     """
     Администрирование модели ежедневного бонуса.
     """
     list_display = ('user', 'streak', 'max_streak', 'last_claim_date')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
     search_fields = ('user__telegram_id',)
+    telegram_id_search = ('user__telegram_id',)
     ordering = ('-streak',)
 
 
 @admin.register(Referral)
-class ReferralAdmin(admin.ModelAdmin):
+class ReferralAdmin(LargeTableAdmin):
     """
     Администрирование модели рефералов.
     """
-    list_display = ('user', 'invited_by', 'reward_percentage', 'total_rewards', 'total_invited')
+    list_display = ('user', 'invited_by', 'reward_percentage', 'total_rewards', 'total_invited', 'is_revoked')
+    list_select_related = ('user', 'invited_by')
+    list_filter = ('is_revoked',)
+    raw_id_fields = ('user', 'invited_by')
     search_fields = ('user__telegram_id', 'invited_by__telegram_id')
+    telegram_id_search = ('user__telegram_id', 'invited_by__telegram_id')
     ordering = ('-total_rewards',)
 
 
 @admin.register(WalkSession)
-class WalkSessionAdmin(admin.ModelAdmin):
+class WalkSessionAdmin(LargeTableAdmin):
     """
     Администрирование модели активных сессий прогулок.
     """
     list_display = ('user', 'start_time', 'steps', 'distance', 'avg_speed', 'pattern')
+    list_select_related = ('user',)
+    raw_id_fields = ('user', 'walk')
     search_fields = ('user__telegram_id',)
+    telegram_id_search = ('user__telegram_id',)
     ordering = ('-start_time',)
 
 
+@admin.register(OfflineWalkSubmission)
+class OfflineWalkSubmissionAdmin(LargeTableAdmin):
+    """
+    Администрирование прогулок, отправленных целиком после записи без связи.
+    """
+    list_display = ('user', 'idempotency_key', 'status', 'walk', 'created_at', 'processed_at')
+    list_select_related = ('user', 'walk__user')
+    search_fields = ('user__telegram_id', 'idempotency_key')
+    telegram_id_search = ('user__telegram_id',)
+    list_filter = ('status',)
+    ordering = ('-created_at',)
+    exclude = ('payload',)
+    readonly_fields = ('user', 'idempotency_key', 'walk', 'error', 'created_at', 'processed_at')
+
+
+@admin.register(ModerationJob)
+class ModerationJobAdmin(admin.ModelAdmin):
+    """
+    Задания массовой модерации: ход выполнения и повторный запуск.
+    Задания создаются действиями в списке пользователей и здесь не редактируются.
+    """
+    list_display = ('id', 'action', 'status', 'progress', 'walks_voided', 'points_revoked', 'referrals_revoked',
+                    'created_by', 'created_at', 'finished_at')
+    list_select_related = ('created_by',)
+    list_filter = ('status', 'action')
+    ordering = ('-created_at',)
+    exclude = ('user_ids',)
+    actions = ['rerun']
+
+    @admin.display(description='Обработано')
+    def progress(self, obj):
+        return f"{obj.processed} / {obj.total}"
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('user_ids')
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields if field.name != 'user_ids'] + ['progress']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Запустить повторно', permissions=['change'])
+    def rerun(self, request, queryset):
+        jobs = list(queryset.exclude(status=ModerationJob.STATUS_RUNNING))
+        for job in jobs:
+            moderation.rerun(job)
+        self.message_user(request, f"Повторно поставлено в очередь заданий: {len(jobs)}.", messages.SUCCESS)
+
+
+@admin.register(NotificationCampaign)
+class NotificationCampaignAdmin(admin.ModelAdmin):
+    """
+    Рассылки: создание черновика, запуск, приостановка и ход отправки (см. notifications.py).
+    """
+    list_display = ('id', 'name', 'segment', 'status', 'sent', 'blocked', 'failed', 'rate_limited', 'throughput',
+                    'created_at', 'finished_at')
+    list_filter = ('status', 'segment')
+    ordering = ('-created_at',)
+    fields = ('name', 'segment', 'text', 'status', 'cursor', 'sent', 'blocked', 'failed', 'rate_limited',
+              'throughput', 'started_at', 'finished_at')
+    actions = ['start', 'pause']
+
+    @admin.display(description='Сообщ./с')
+    def throughput(self, obj):
+        return obj.throughput
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly = ['status', 'cursor', 'sent', 'blocked', 'failed', 'rate_limited', 'throughput', 'started_at',
+                    'finished_at']
+        if obj is not None and obj.status != NotificationCampaign.STATUS_DRAFT:
+            readonly += ['name', 'segment', 'text']
+        return readonly
+
+    @admin.action(description='Запустить или продолжить', permissions=['change'])
+    def start(self, request, queryset):
+        started = notifications.start(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f"Поставлено в очередь рассылок: {started}.", messages.SUCCESS)
+
+    @admin.action(description='Приостановить', permissions=['change'])
+    def pause(self, request, queryset):
+        paused = notifications.pause(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f"Приостановлено рассылок: {paused}.", messages.SUCCESS)
+
+
 # @admin.register(AnomalyLog)
 # class AnomalyLogAdmin(admin.ModelAdmin):
 #     """
@@ -86,12 +287,15 @@ class WalkSessionAdmin(admin.ModelAdmin):
 
 
 @admin.register(Donation)
-class DonationAdmin(admin.ModelAdmin):
+class DonationAdmin(LargeTableAdmin):
     """
     Администрирование модели пожертвований.
     """
     list_display = ('user', 'stars_bought', 'amount_paid', 'created_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
     search_fields = ('user__telegram_id',)
+    telegram_id_search = ('user__telegram_id',)
     ordering = ('-created_at',)
 
 
@@ -6,4 +6,7 @@ class MoveOnConfig(AppConfig):
     name = 'move_on'
 
     def ready(self):
-        import move_on.signals
\ No newline at end of file
+        import move_on.signals
+        from django.db.backends.signals import connection_created
+        from .middleware import install_query_counter
+        connection_created.connect(install_query_counter)
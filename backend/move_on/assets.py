@@ -0,0 +1,99 @@
+"""
+Сборка статики для nginx: имена с хэшем содержимого и заранее сжатые копии.
+
+manage.py build_assets собирает статику в STATIC_ROOT через AssetStorage: рядом с каждым файлом
+кладётся копия с хэшем содержимого в имени, соответствие имён записывается в манифест
+staticfiles.json, а {% static %} отдаёт ссылки на копии с хэшем. Такие файлы никогда не меняются,
+и nginx отдаёт их с Cache-Control: immutable на год, а остальные файлы статики — с no-cache: имена
+различает то же регулярное выражение, что HASHED_NAME (см. nginx.conf). Файлы фронтенда уже собраны
+Vite с хэшем в имени (index-DXif8KBr.js, в корне статики) и второй раз не переименовываются.
+
+Затем compress() кладёт рядом с файлами из манифеста сжатые копии (.gz и .br), и nginx отдаёт их
+без сжатия на лету. Исходные имена без хэша после сборки не используются и не сжимаются, как и
+карты исходников (.map): их загружают только инструменты разработчика. Копия записывается, только
+если она меньше исходного файла, и пересобирается, только если исходный файл новее. Уровень brotli —
+ASSET_BROTLI_QUALITY: 11 сжимает лучше всего, но в десятки раз медленнее 9.
+brotli импортируется внутри compress, как numpy в motion.py.
+"""
+import gzip
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+# Хэш, который Vite добавляет к имени файла: index-DXif8KBr.js. Сборка Vite лежит в корне статики;
+# в подкаталогах похожие имена бывают и без хэша (admin/img/icon-calendar.svg)
+VITE_HASHED = re.compile(r"^[^/]+-[A-Za-z0-9_-]{8}\.[a-z0-9]+$")
+# Имена с хэшем после сборки: ManifestStaticFilesStorage (base.1a2b3c4d5e6f.css) или Vite.
+# То же выражение — в location статики в nginx.conf
+HASHED_NAME = re.compile(r"^(.+\.[0-9a-f]{12}(\.[^/.]+)?|[^/]+-[A-Za-z0-9_-]{8}\.[a-z0-9]+)$")
+COMPRESSIBLE = ('.js', '.mjs', '.css', '.html', '.svg', '.json', '.txt', '.xml', '.ico')
+# Файлы меньше этого размера (в байтах) не сжимаются: заголовки ответа больше выигрыша
+MIN_SIZE = 512
+
+
+class AssetStorage(ManifestStaticFilesStorage):
+    """
+    Статика с манифестом имён с хэшем содержимого.
+    До сборки (в разработке и тестах) ссылки ведут на исходные имена, а не падают с ошибкой.
+    """
+    manifest_strict = False
+
+    def hashed_name(self, name, content=None, filename=None):
+        if VITE_HASHED.search(name):
+            return name
+        return super().hashed_name(name, content, filename)
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+def _compress_file(path):
+    """
+    Записывает .gz и .br рядом с файлом.
+    :return: Какие копии записаны.
+    """
+    import brotli
+
+    quality = settings.ASSET_BROTLI_QUALITY
+    with open(path, 'rb') as source:
+        data = source.read()
+    written = []
+    for suffix, compress in (('.gz', lambda raw: gzip.compress(raw, compresslevel=9, mtime=0)),
+                             ('.br', lambda raw: brotli.compress(raw, quality=quality))):
+        target = path + suffix
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+            continue
+        packed = compress(data)
+        if len(packed) >= len(data):
+            continue
+        with open(target, 'wb') as out:
+            out.write(packed)
+        written.append(suffix)
+    return written
+
+
+def compress(root, workers=None):
+    """
+    Кладёт сжатые копии рядом с файлами из манифеста сборки в каталоге root.
+    Файлы сжимаются параллельно: gzip и brotli отпускают GIL.
+    :return: {'.gz': сколько записано, '.br': сколько записано}.
+    """
+    with open(os.path.join(root, AssetStorage.manifest_name)) as manifest:
+        names = set(json.load(manifest)['paths'].values())
+    paths = [
+        path for path in (os.path.join(root, name) for name in sorted(names))
+        if path.endswith(COMPRESSIBLE) and os.path.getsize(path) >= MIN_SIZE
+    ]
+    counts = {'.gz': 0, '.br': 0}
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for written in pool.map(_compress_file, paths):
+            for suffix in written:
+                counts[suffix] += 1
+    return counts
@@ -0,0 +1,246 @@
+"""
+Асинхронные варианты самых частых запросов (обновление и завершение прогулки, шагомер, энергия),
+поток живых обновлений прогулки (walk_stream) и выгрузка данных для аналитики (export).
+
+Используют асинхронный ORM Django и рассчитаны на запуск под ASGI-сервером (uvicorn, сервис
+django_asgi в docker-compose): пока запрос ждёт базу данных, воркер обслуживает другие запросы.
+Форматы запросов и ответов совпадают с синхронными представлениями из views.py.
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.timezone import now
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+
+from . import backpressure, counters, db_router, exports, live_stream, throttling, walk_pipeline
+from .models import User, WalkSession, DailyBonus
+from .walk_service import apply_sample, asave_sample, claim_session
+
+logger = logging.getLogger("move_on")
+
+ACCEPTS_GZIP = re.compile(r"\bgzip\b")
+
+
+def _parse_json(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except json.JSONDecodeError:
+        return None
+
+
+@csrf_exempt
+@require_http_methods(["POST", "PUT"])
+@backpressure.ingestion
+async def walk_update(request, pk):
+    """
+    Обновление данных прогулки (асинхронный вариант WalkViewSet.update).
+    """
+    data = _parse_json(request)
+    if data is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    acc_x = data.get("accX")
+    acc_y = data.get("accY")
+    acc_z = data.get("accZ")
+    latitude = data.get("latitude")
+    longitude = data.get("longitude")
+    if any(param is None for param in [acc_x, acc_y, acc_z, latitude, longitude]):
+        return JsonResponse({"error": "Incomplete data provided"}, status=400)
+
+    wait = await sync_to_async(throttling.check)('walk_update', throttling.request_ident(data, {'pk': pk}))
+    if wait is not None:
+        return throttling.throttled_response(wait)
+
+    try:
+        walk_session = await WalkSession.objects.select_related('user').aget(id=pk)
+    except WalkSession.DoesNotExist:
+        return JsonResponse({"error": "Walk session not found"}, status=404)
+    if walk_session.finished_at is not None:
+        return JsonResponse({"error": "Walk already finished"}, status=409)
+
+    try:
+        user = walk_session.user
+        await user.aupdate_energy()
+        if user.energy <= 0:
+            return await _finish_session(walk_session.id, interrupted=True)
+
+        steps_before = walk_session.steps
+        current_speed = apply_sample(
+            walk_session, acc_x, acc_y, acc_z, latitude, longitude, data.get("speed", 0)
+        )
+        if not await asave_sample(walk_session):
+            return JsonResponse({"error": "Walk already finished"}, status=409)
+        await sync_to_async(live_stream.publish)(walk_session.id, live_stream.session_state(
+            walk_session, energy=user.energy, current_speed=current_speed))
+
+        return JsonResponse({
+            "steps": walk_session.steps,
+            "distance": round(walk_session.distance, 2),
+            "current_speed": round(current_speed, 2),
+            "average_speed": round(walk_session.avg_speed, 2),
+            "telemetry": backpressure.directive(
+                walk_session.steps - steps_before, current_speed, walk_session.avg_speed),
+        })
+    except Exception as e:
+        logger.error(f"Error updating walk session: {str(e)}", exc_info=True)
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@require_POST
+async def walk_finish(request, pk):
+    """
+    Завершение прогулки (асинхронный вариант WalkViewSet.finish).
+    """
+    try:
+        return await _finish_session(pk)
+    except WalkSession.DoesNotExist:
+        return JsonResponse({"error": "Walk session not found"}, status=404)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+async def _finish_session(session_id, interrupted=False):
+    walk_session, claimed = await sync_to_async(claim_session)(session_id, interrupted=interrupted)
+    if claimed:
+        await sync_to_async(walk_pipeline.start)(walk_session.id)
+        await sync_to_async(live_stream.publish)(walk_session.id, live_stream.session_state(walk_session))
+    return JsonResponse({
+        "message": "Прогулка завершена",
+        "reward": walk_session.reward,
+        "duplicate": not claimed,
+    })
+
+
+@require_GET
+async def walk_stream(request, pk):
+    """
+    Поток Server-Sent Events с состоянием прогулки вместо опроса.
+
+    Сразу отправляет текущее состояние, затем событие на каждое обновление сессии
+    (шаги, дистанция, скорость, энергия) и комментарий-пинг при простое.
+    Поток закрывается после события с "finished": true.
+    """
+    # Подписываемся до чтения состояния, чтобы не потерять обновление между ними
+    queue = await live_stream.hub.subscribe(pk)
+    try:
+        walk_session = await WalkSession.objects.select_related('user').aget(id=pk)
+    except WalkSession.DoesNotExist:
+        await live_stream.hub.unsubscribe(pk, queue)
+        return JsonResponse({"error": "Walk session not found"}, status=404)
+
+    await sync_to_async(counters.overlay)(walk_session.user)
+    state = live_stream.session_state(walk_session, energy=walk_session.user.energy)
+    response = StreamingHttpResponse(_stream_events(pk, queue, state), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # nginx не должен буферизовать поток
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _sse(state):
+    return f"event: state\ndata: {json.dumps(state)}\n\n"
+
+
+async def _stream_events(session_id, queue, state):
+    deadline = time.monotonic() + settings.WALK_STREAM_MAX_SECONDS
+    try:
+        yield _sse(state)
+        while not state["finished"] and time.monotonic() < deadline:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=settings.WALK_STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            state = json.loads(message)
+            yield _sse(state)
+    finally:
+        # Срабатывает и при отключении клиента: ASGI-обработчик отменяет генератор
+        await live_stream.hub.unsubscribe(session_id, queue)
+
+
+@require_GET
+async def stepometer(request):
+    """
+    Текущие данные шагомера пользователя (асинхронный вариант views.stepometer).
+    """
+    telegram_id = request.GET.get('telegram_id')
+    if not telegram_id:
+        return JsonResponse({"error": "telegram_id is required"}, status=400)
+
+    try:
+        user = await User.objects.aget(telegram_id=telegram_id)
+    except (User.DoesNotExist, ValueError):
+        return JsonResponse({"error": "User not found"}, status=404)
+    await sync_to_async(counters.overlay)(user)
+    await user.aupdate_energy()
+
+    walk_session = await WalkSession.objects.filter(user=user, finished_at__isnull=True).only('start_time').afirst()
+    walk_duration = (now() - walk_session.start_time).total_seconds() if walk_session else None
+
+    daily_bonus = await DailyBonus.objects.filter(user=user).only('claimed_days').afirst()
+    has_unclaimed_bonus = bool(daily_bonus) and str(now().date()) not in daily_bonus.claimed_days
+
+    return JsonResponse({
+        "coins": user.points,
+        "max_energy": 100,
+        "current_energy": user.energy,
+        "is_walk_running": walk_session is not None,
+        "walk_duration": int(walk_duration) if walk_duration else None,
+        "has_unclaimed_bonus": has_unclaimed_bonus
+    })
+
+
+@require_GET
+async def get_energy(request, telegram_id):
+    """
+    Текущая энергия пользователя (асинхронный вариант views.get_energy).
+    """
+    try:
+        user = await User.objects.only('points', 'energy', 'max_energy', 'last_energy_update').aget(telegram_id=telegram_id)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'User not found'}, status=404)
+    await sync_to_async(counters.overlay)(user)
+    return JsonResponse({'energy': user.energy}, status=200)
+
+
+@require_GET
+async def export(request, dataset):
+    """
+    Потоковая выгрузка набора данных для аналитики (см. exports). Только для персонала.
+    Параметры: format — csv (по умолчанию) или ndjson; from и to — даты YYYY-MM-DD включительно.
+    """
+    user = await request.auser()
+    if not (user.is_active and user.is_staff):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    if dataset not in exports.DATASETS:
+        return JsonResponse({"error": "Unknown dataset"}, status=404)
+    fmt = request.GET.get("format", "csv")
+    if fmt not in exports.FORMATS:
+        return JsonResponse({"error": "Unknown format"}, status=400)
+    try:
+        start, end = exports.parse_range(request.GET.get("from"), request.GET.get("to"))
+    except ValueError:
+        return JsonResponse({"error": "Dates must be YYYY-MM-DD"}, status=400)
+
+    rows = exports.queryset(dataset, start, end)
+    alias = await sync_to_async(db_router.replica_alias)(rows.model)
+    compress = bool(ACCEPTS_GZIP.search(request.headers.get("Accept-Encoding", "")))
+    response = StreamingHttpResponse(
+        exports.stream(rows.using(alias), dataset, fmt, compress, settings.EXPORT_CHUNK_SIZE),
+        content_type=exports.FORMATS[fmt],
+    )
+    name = exports.filename(dataset, fmt, request.GET.get("from"), request.GET.get("to"))
+    response["Content-Disposition"] = f'attachment; filename="{name}"'
+    if compress:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
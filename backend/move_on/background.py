@@ -0,0 +1,101 @@
+import os
+import queue
+import sys
+import threading
+import time
+
+
+class BackgroundBatcher:
+    """
+    Ограниченная очередь с фоновым потоком, который передаёт элементы пачками в handle_batch.
+
+    - put() никогда не блокирует: при переполнении элемент отбрасывается и увеличивается счётчик dropped.
+    - Пачка отправляется, когда набралось batch_size элементов или прошло flush_interval секунд.
+    - flush() ждёт, пока очередь будет обработана; close() дополнительно останавливает поток.
+    Поток запускается при первом put(), в том числе заново после fork() воркера.
+    """
+
+    def __init__(self, handle_batch, name, maxsize=1000, batch_size=50, flush_interval=1.0):
+        self.handle_batch = handle_batch
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._flush_requested = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def put(self, item):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self, timeout=5.0):
+        """
+        Ждёт обработки всех элементов очереди. Возвращает False, если не уложились в timeout.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return self.queue.unfinished_tasks == 0
+        deadline = time.monotonic() + timeout
+        self._flush_requested.set()
+        try:
+            with self.queue.all_tasks_done:
+                while self.queue.unfinished_tasks:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self.queue.all_tasks_done.wait(remaining)
+            return True
+        finally:
+            self._flush_requested.clear()
+
+    def close(self, timeout=5.0):
+        self.flush(timeout)
+        self._stopping = True
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    # Короткий таймаут, чтобы flush() не ждал окончания сбора пачки
+                    batch.append(self.queue.get(timeout=min(remaining, 0.05)))
+                except queue.Empty:
+                    if self._flush_requested.is_set():
+                        break
+            try:
+                self.handle_batch(batch)
+            except Exception as e:
+                # Логирование здесь может привести к рекурсии, если handle_batch сам является обработчиком логов
+                print(f"Ошибка фоновой обработки {self.name}: {e}", file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
@@ -0,0 +1,197 @@
+"""
+Управление частотой телеметрии клиентов (обратное давление).
+
+Ответ на обновление прогулки содержит директиву "telemetry":
+
+    {"sample_interval_ms": 2000, "flush_interval_ms": 4000, "motion": "steady"}
+
+sample_interval_ms — как часто клиенту снимать замеры, flush_interval_ms — как часто отправлять их.
+Интервалы растут, когда пользователь стоит на месте или идёт ровным темпом (новые замеры почти ничего
+не меняют), и возвращаются к базовым на неоднозначных участках (смена темпа, начало движения).
+Интервал отправки дополнительно растёт с нагрузкой узла: расходом token bucket процесса
+и числом обновлений прогулки, которые процесс обрабатывает прямо сейчас (представления
+с декоратором @ingestion). Одновременные обновления конкурируют за базу и процессор, поэтому
+при высокой конкурентности каждое списывает из token bucket больше токенов.
+"""
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+from .metrics import registry
+
+MOTION_STATIONARY = 'stationary'
+MOTION_STEADY = 'steady'
+MOTION_AMBIGUOUS = 'ambiguous'
+# Во сколько раз увеличить базовые интервалы для каждого состояния движения
+MOTION_FACTORS = {
+    MOTION_STATIONARY: 4,
+    MOTION_STEADY: 2,
+    MOTION_AMBIGUOUS: 1,
+}
+
+registry.describe("move_on_telemetry_throttled_total", "counter",
+                  "Обновления прогулки, пришедшие сверх бюджета token bucket процесса.")
+registry.describe("move_on_telemetry_in_flight", "gauge",
+                  "Обновления прогулки, которые обрабатываются прямо сейчас (сумма по процессам).")
+
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket: пополняется на rate токенов в секунду, хранит не больше capacity.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        current = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (current - self._updated) * self.rate)
+        self._updated = current
+
+    def take(self, tokens=1):
+        """
+        Списывает токены, если их хватает.
+        :return: True, если токены списаны.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def wait_time(self, tokens=1):
+        """
+        Через сколько секунд хватит токенов (0, если уже хватает).
+        """
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def level(self):
+        """
+        Доля оставшихся токенов: 1 — бюджет не тронут, 0 — исчерпан.
+        """
+        with self._lock:
+            self._refill()
+            return self._tokens / self.capacity
+
+
+_node_bucket = None
+_node_bucket_lock = threading.Lock()
+
+
+def node_bucket():
+    """
+    Token bucket обновлений телеметрии этого процесса (пересоздаётся при смене настроек).
+    """
+    global _node_bucket
+    rate, capacity = settings.TELEMETRY_NODE_RATE, settings.TELEMETRY_NODE_BURST
+    with _node_bucket_lock:
+        if _node_bucket is None or (_node_bucket.rate, _node_bucket.capacity) != (rate, capacity):
+            _node_bucket = TokenBucket(rate, capacity)
+        return _node_bucket
+
+
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+def _track(delta):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += delta
+    registry.inc("move_on_telemetry_in_flight", delta)
+
+
+def in_flight():
+    """
+    Сколько обновлений прогулки процесс обрабатывает прямо сейчас (вместе с текущим).
+    """
+    return _in_flight
+
+
+def ingestion(view):
+    """
+    Декоратор представления, принимающего телеметрию: пока оно выполняется, обновление
+    учитывается в in_flight().
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            _track(1)
+            try:
+                return await view(*args, **kwargs)
+            finally:
+                _track(-1)
+    else:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            _track(1)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                _track(-1)
+    return wrapper
+
+
+def motion_state(new_steps, current_speed, avg_speed):
+    """
+    Грубая классификация движения по последнему замеру.
+    """
+    if new_steps == 0 and current_speed < settings.TELEMETRY_STATIONARY_SPEED:
+        return MOTION_STATIONARY
+    if avg_speed > 0 and abs(current_speed - avg_speed) <= settings.TELEMETRY_STEADY_TOLERANCE * avg_speed:
+        return MOTION_STEADY
+    return MOTION_AMBIGUOUS
+
+
+def in_flight_load():
+    """
+    Доля одновременно обрабатываемых обновлений от TELEMETRY_NODE_MAX_IN_FLIGHT (не больше 1).
+    """
+    return min(1.0, in_flight() / settings.TELEMETRY_NODE_MAX_IN_FLIGHT)
+
+
+def node_load():
+    """
+    Нагрузка узла от 0 до 1: большее из расхода token bucket и числа обрабатываемых обновлений.
+    """
+    bucket_load = 1 - node_bucket().level()
+    return min(1.0, max(bucket_load, in_flight_load()))
+
+
+def directive(new_steps, current_speed, avg_speed):
+    """
+    Учитывает принятое обновление в token bucket процесса и возвращает директиву для клиента.
+    Обновление стоит один токен и до одного дополнительного при полной конкурентности (in_flight_load).
+
+    :param new_steps: Сколько шагов добавил последний замер.
+    :param current_speed: Текущая скорость (в м/с).
+    :param avg_speed: Средняя скорость прогулки (в м/с).
+    """
+    admitted = node_bucket().take(1 + in_flight_load())
+    if not admitted:
+        registry.inc("move_on_telemetry_throttled_total")
+    load = node_load() if admitted else 1.0
+
+    state = motion_state(new_steps, current_speed, avg_speed)
+    factor = MOTION_FACTORS[state]
+    sample_interval = min(settings.TELEMETRY_SAMPLE_INTERVAL_MS * factor, settings.TELEMETRY_MAX_SAMPLE_INTERVAL_MS)
+    # До половины бюджета нагрузку не учитываем, дальше интервал отправки растёт линейно
+    # и при полной нагрузке становится в TELEMETRY_MAX_SLOWDOWN раз больше
+    slowdown = 1 + max(0.0, load - 0.5) * 2 * (settings.TELEMETRY_MAX_SLOWDOWN - 1)
+    flush_interval = min(settings.TELEMETRY_FLUSH_INTERVAL_MS * factor * slowdown,
+                         settings.TELEMETRY_MAX_FLUSH_INTERVAL_MS)
+    return {
+        "sample_interval_ms": int(sample_interval),
+        "flush_interval_ms": int(max(flush_interval, sample_interval)),
+        "motion": state,
+    }
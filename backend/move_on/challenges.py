@@ -0,0 +1,264 @@
+"""
+Рейтинги челленджей: задания task_type='challenge' с показателем (Task.metric).
+
+Очки участника — его прогресс по челленджу (TaskProgress.value): task_progress учитывает только
+прогулки в пределах start_date..end_date, так что рейтинг ограничен сроком челленджа.
+
+Пока челлендж идёт, рейтинг хранится в сортированном множестве Redis на челлендж (key): после шага
+tasks завершения прогулки в него записывается новое значение прогресса пользователя (update_scores).
+Запись идёт с ZADD GT: значения показателей только растут, поэтому повторная или запоздавшая запись
+не уменьшит очки. Топ — ZREVRANGE, место пользователя — ZCOUNT очков выше его, обе операции
+логарифмические. Множество читается, только когда оно заполнено целиком (есть ready_key): его ставит
+rebuild, вызываемый из maintain для каждого идущего челленджа. После перезапуска Redis ключ пропадает
+вместе с множеством, и до следующего maintain, как и без Redis вообще, рейтинг читается из
+TaskProgress по индексу task_progress_rank_idx.
+
+В рейтинге участвуют только активные пользователи без отметок is_scam и is_fake (_eligible): модерация
+убирает отмеченных и заблокированных из множеств идущих челленджей (remove_users), а после
+разблокировки возвращает их текущий прогресс (restore_users).
+
+После end_date maintain фиксирует итоговые места в ChallengeResult (снимок больше не меняется)
+и удаляет множество; дальше рейтинг читается из снимка.
+"""
+import logging
+
+import redis
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import Rank
+from django.utils.timezone import localdate, now
+
+from .models import ChallengeResult, Task, TaskProgress
+from .redis_client import get_redis, mark_redis_down
+from .task_progress import period
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 5000
+
+
+def key(task_id):
+    return f"leaderboard:v1:challenge:{task_id}"
+
+
+def ready_key(task_id):
+    return f"{key(task_id)}:ready"
+
+
+def is_ranked(task):
+    return task.task_type == 'challenge' and bool(task.metric)
+
+
+def _eligible(progress):
+    return progress.filter(user__is_active=True, user__is_scam=False, user__is_fake=False)
+
+
+def _unfrozen():
+    return Task.objects.filter(task_type='challenge', leaderboard_frozen_at__isnull=True).exclude(metric='')
+
+
+def update_scores(user_id, touched):
+    """
+    Записывает в рейтинги челленджей прогресс пользователя после его обновления.
+    :param touched: [(задание, период), ...] из task_progress.apply_walk.
+    """
+    periods = {task.pk: progress_period for task, progress_period in touched if is_ranked(task)}
+    if not periods:
+        return
+    scores = [
+        (task_id, value)
+        for task_id, progress_period, value in _eligible(TaskProgress.objects.filter(
+            user_id=user_id, task_id__in=periods, period__in=set(periods.values()),
+        )).values_list('task_id', 'period', 'value')
+        if periods[task_id] == progress_period
+    ]
+    transaction.on_commit(lambda: _write_scores(user_id, scores))
+
+
+def _write_scores(user_id, scores):
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for task_id, value in scores:
+            pipe.zadd(key(task_id), {user_id: value}, gt=True)
+        pipe.execute()
+    except redis.RedisError as e:
+        mark_redis_down(e)
+
+
+def _ranked_progress(task):
+    return _eligible(TaskProgress.objects.filter(task=task, period=period(task, localdate()), value__gt=0))
+
+
+def remove_users(user_ids):
+    """
+    Убирает пользователей из множеств незафиксированных челленджей (после модерации).
+    """
+    client = get_redis()
+    if client is None:
+        return
+    task_ids = list(_unfrozen().values_list('pk', flat=True))
+    if not task_ids:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.zrem(key(task_id), *user_ids)
+        pipe.execute()
+    except redis.RedisError as e:
+        mark_redis_down(e)
+
+
+def restore_users(user_ids):
+    """
+    Возвращает в множества незафиксированных челленджей текущий прогресс разблокированных пользователей.
+    """
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for task in _unfrozen():
+            for user_id, value in _ranked_progress(task).filter(user_id__in=user_ids).values_list('user_id', 'value'):
+                pipe.zadd(key(task.pk), {user_id: value}, gt=True)
+        pipe.execute()
+    except redis.RedisError as e:
+        mark_redis_down(e)
+
+
+def leaderboard(task, user_id=None, limit=100):
+    """
+    Топ челленджа и место пользователя.
+    :return: {'frozen': bool, 'top': [{'rank', 'user_id', 'score'}, ...], 'me': {...} или None}.
+    """
+    if task.leaderboard_frozen_at is not None:
+        top = list(ChallengeResult.objects.filter(task=task).order_by('rank', 'user_id')
+                   .values('rank', 'user_id', 'score')[:limit])
+        me = ChallengeResult.objects.filter(task=task, user_id=user_id).values('rank', 'user_id', 'score').first()
+        return {'frozen': True, 'top': top, 'me': me}
+
+    result = _redis_leaderboard(task, user_id, limit)
+    if result is None:
+        result = _db_leaderboard(task, user_id, limit)
+    return {'frozen': False, **result}
+
+
+def _with_ranks(rows):
+    """
+    Места для отсортированного по убыванию топа: равные очки делят место.
+    """
+    top = []
+    for position, (user_id, score) in enumerate(rows, start=1):
+        rank = top[-1]['rank'] if top and top[-1]['score'] == score else position
+        top.append({'rank': rank, 'user_id': user_id, 'score': score})
+    return top
+
+
+def _redis_leaderboard(task, user_id, limit):
+    client = get_redis()
+    if client is None:
+        return None
+    name = key(task.pk)
+    try:
+        if not client.exists(ready_key(task.pk)):
+            return None
+        top = _with_ranks((int(member), score) for member, score in client.zrevrange(name, 0, limit - 1, withscores=True))
+        me = None
+        score = client.zscore(name, user_id) if user_id is not None else None
+        if score is not None:
+            me = {'rank': client.zcount(name, f"({score}", "+inf") + 1, 'user_id': user_id, 'score': score}
+    except redis.RedisError as e:
+        mark_redis_down(e)
+        return None
+    return {'top': top, 'me': me}
+
+
+def _db_leaderboard(task, user_id, limit):
+    progress = _ranked_progress(task)
+    top = _with_ranks(progress.order_by('-value', 'user_id').values_list('user_id', 'value')[:limit])
+    me = None
+    score = progress.filter(user_id=user_id).values_list('value', flat=True).first() if user_id is not None else None
+    if score is not None:
+        me = {'rank': progress.filter(value__gt=score).count() + 1, 'user_id': user_id, 'score': score}
+    return {'top': top, 'me': me}
+
+
+def freeze(task):
+    """
+    Фиксирует итоговые места челленджа в ChallengeResult. Повторный вызов ничего не делает.
+    :return: Сколько мест записано или None, если рейтинг уже зафиксирован.
+    """
+    with transaction.atomic():
+        if not Task.objects.filter(pk=task.pk, leaderboard_frozen_at__isnull=True).update(leaderboard_frozen_at=now()):
+            return None
+        ranked = _ranked_progress(task).annotate(
+            rank=Window(expression=Rank(), order_by=F('value').desc()),
+        ).values_list('user_id', 'value', 'rank').order_by()
+        written = 0
+        batch = []
+        for user_id, value, rank in ranked.iterator(chunk_size=CHUNK_SIZE):
+            batch.append(ChallengeResult(task=task, user_id=user_id, rank=rank, score=value))
+            if len(batch) == CHUNK_SIZE:
+                ChallengeResult.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        ChallengeResult.objects.bulk_create(batch)
+        written += len(batch)
+        transaction.on_commit(lambda: _delete(task.pk))
+    logger.info(f"Рейтинг челленджа {task.pk} зафиксирован: {written} участников")
+    return written
+
+
+def _delete(task_id):
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.delete(key(task_id), ready_key(task_id))
+    except redis.RedisError as e:
+        mark_redis_down(e)
+
+
+def rebuild(task):
+    """
+    Заполняет сортированное множество челленджа из TaskProgress.
+    """
+    client = get_redis()
+    if client is None:
+        return False
+    rows = _ranked_progress(task).order_by().values_list('user_id', 'value').iterator(chunk_size=CHUNK_SIZE)
+    try:
+        pipe = client.pipeline(transaction=False)
+        for count, (user_id, value) in enumerate(rows, start=1):
+            pipe.zadd(key(task.pk), {user_id: value}, gt=True)
+            if count % CHUNK_SIZE == 0:
+                pipe.execute()
+        pipe.set(ready_key(task.pk), 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        mark_redis_down(e)
+        return False
+    return True
+
+
+def maintain():
+    """
+    Фиксирует рейтинги завершившихся челленджей и заполняет множества идущих, которые ещё не готовы.
+    :return: {'frozen': [ID], 'rebuilt': [ID]}.
+    """
+    challenges = _unfrozen()
+    frozen = [task.pk for task in challenges.filter(end_date__lt=localdate()) if freeze(task) is not None]
+
+    rebuilt = []
+    client = get_redis()
+    for task in challenges.filter(is_active=True).exclude(end_date__lt=localdate()):
+        try:
+            missing = client is not None and not client.exists(ready_key(task.pk))
+        except redis.RedisError as e:
+            mark_redis_down(e)
+            break
+        if missing and rebuild(task):
+            rebuilt.append(task.pk)
+    return {'frozen': frozen, 'rebuilt': rebuilt}
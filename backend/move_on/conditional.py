@@ -0,0 +1,147 @@
+"""
+Условные ответы (ETag и 304 Not Modified) для GET-запросов, которые клиент опрашивает постоянно.
+
+Валидатор (ETag) строится до выполнения представления из дешёвых данных:
+- у данных пользователя — из его версий в Redis (хэш versions:v1:<id>, поле на каждую область).
+  Код, меняющий данные области, после фиксации транзакции удаляет версию (bump), и следующий
+  запрос заводит новую — случайный токен. Токен не зависит от прежнего, поэтому ETag не повторится
+  и после перезапуска Redis или истечения USER_VERSION_TTL;
+- у общих данных — агрегатом одного запроса (например, последний updated_at и число строк).
+Если ETag совпал с If-None-Match, ответ 304 отдаётся без запросов представления и сериализатора.
+Без Redis у данных пользователя валидатора нет, и они отдаются полностью, как раньше.
+
+Заголовки: данные пользователя — Cache-Control: private (клиент переспрашивает с If-None-Match,
+nginx их не кэширует), общие — public с max-age, их кэширует nginx (см. nginx.conf).
+Vary: Accept-Encoding, чтобы сжатые и несжатые варианты не смешивались в кэшах.
+"""
+import secrets
+from functools import wraps
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, \
+    set_response_etag
+from django.utils.http import quote_etag
+
+from . import identity_cache
+from .metrics import registry
+from .redis_client import get_redis, mark_redis_down
+
+REDIS_PREFIX = "versions:v1:"
+
+# Области данных пользователя с отдельными версиями
+SCOPE_STATS = 'stats'
+SCOPE_BONUS = 'bonus'
+SCOPE_REFERRALS = 'referrals'
+
+registry.describe("move_on_conditional_responses_total", "counter",
+                  "Ответы условных GET-запросов по представлению и результату (not_modified, full).")
+
+
+def bump(user_ids, scope):
+    """
+    Отмечает, что данные области у пользователей изменились (после фиксации транзакции).
+    """
+    user_ids = list(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: _invalidate(user_ids, scope))
+
+
+def _invalidate(user_ids, scope):
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hdel(f"{REDIS_PREFIX}{user_id}", scope)
+        pipe.execute()
+    except redis.RedisError as e:
+        mark_redis_down(e)
+
+
+def version(user_id, scope):
+    """
+    Текущая версия данных области пользователя или None без Redis.
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    name = f"{REDIS_PREFIX}{user_id}"
+    try:
+        current = client.hget(name, scope)
+        if current is None:
+            pipe = client.pipeline(transaction=False)
+            pipe.hsetnx(name, scope, secrets.token_hex(8))
+            pipe.expire(name, settings.USER_VERSION_TTL)
+            pipe.hget(name, scope)
+            current = pipe.execute()[-1]
+    except redis.RedisError as e:
+        mark_redis_down(e)
+        return None
+    return current.decode()
+
+
+def conditional(etag_func=None, max_age=0, public=False):
+    """
+    Декоратор представления: отвечает 304, если ETag не изменился, и ставит Cache-Control и Vary.
+    :param etag_func: (request, *args, **kwargs) → ETag или None (тогда ETag не ставится).
+        Без etag_func ETag считается по телу готового ответа: для представлений, которые и так
+        дёшевы, 304 экономит только передачу.
+    :param max_age: Сколько секунд ответ можно отдавать из кэша без проверки.
+    :param public: Ответ одинаков для всех и его можно кэшировать в nginx.
+    """
+    def decorator(view):
+        name = view.__name__
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag = etag_func(request, *args, **kwargs) if etag_func else None
+            response = None
+            if etag is not None:
+                etag = quote_etag(etag)
+                response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.streaming:
+                    if etag is not None:
+                        response.headers.setdefault('ETag', etag)
+                    elif etag_func is None:
+                        if hasattr(response, 'render'):
+                            response.render()
+                        set_response_etag(response)
+                        response = get_conditional_response(request, etag=response['ETag'], response=response)
+            elif etag is not None:
+                response['ETag'] = etag
+
+            if response.status_code in (200, 304):
+                if public:
+                    patch_cache_control(response, public=True, max_age=max_age)
+                elif max_age:
+                    patch_cache_control(response, private=True, max_age=max_age)
+                else:
+                    patch_cache_control(response, private=True, no_cache=True)
+                patch_vary_headers(response, ('Accept-Encoding',))
+                result = 'not_modified' if response.status_code == 304 else 'full'
+                registry.add([(("move_on_conditional_responses_total", (("view", name), ("result", result))), 1)])
+            return response
+        return wrapper
+    return decorator
+
+
+def user_etag(scope, *parts):
+    """
+    etag_func для данных пользователя из пути (telegram_id): версия области и дополнительные части
+    (например, текущая дата для данных, которые зависят от дня).
+    :param parts: Функции без аргументов, их значения добавляются к ETag.
+    """
+    def etag_func(request, telegram_id, *args, **kwargs):
+        identity = identity_cache.lookup(telegram_id)
+        if identity is None:
+            return None
+        current = version(identity['id'], scope)
+        if current is None:
+            return None
+        return '-'.join([scope, str(identity['id']), current] + [str(part()) for part in parts])
+    return etag_func
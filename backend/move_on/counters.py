@@ -0,0 +1,383 @@
+"""
+Отложенная запись счётчиков пользователя (points, energy, last_energy_update).
+
+Вместо сохранения всей строки users на каждое начисление приращения копятся в буфере
+(Redis или память процесса) и раз в COUNTER_FLUSH_INTERVAL секунд записываются пачками:
+на PostgreSQL одним UPDATE ... FROM (VALUES ...) на COUNTER_FLUSH_BATCH пользователей,
+на остальных базах построчными UPDATE с F(). updated_at при этом не меняется.
+
+Чтения остаются согласованными: overlay() добавляет к загруженному пользователю ещё не записанные
+приращения, в том числе те, что сейчас записываются (in-flight). Если в буфере больше
+COUNTER_BUFFER_MAX_USERS пользователей, запись выполняется сразу в запросе, который его переполнил.
+Если Redis недоступен, приращения пишутся в базу напрямую.
+"""
+import logging
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least
+
+from .metrics import registry
+from .redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ('points', 'energy', 'last_energy_update')
+REDIS_PENDING = "counters:v1:p:"
+REDIS_INFLIGHT = "counters:v1:f:"
+REDIS_DIRTY = "counters:v1:dirty"
+# In-flight копия нужна только на время одной записи; после падения процесса она не должна жить долго.
+INFLIGHT_TTL = 60
+
+registry.describe("move_on_counter_flush_users_total", "counter", "Пользователи, чьи счётчики записаны из буфера в базу.")
+
+# KEYS: хэш приращений, множество пользователей с приращениями. ARGV: id, points, energy, last_energy_update.
+ADD_SCRIPT = """
+if tonumber(ARGV[2]) ~= 0 then redis.call('HINCRBYFLOAT', KEYS[1], 'points', ARGV[2]) end
+if tonumber(ARGV[3]) ~= 0 then redis.call('HINCRBY', KEYS[1], 'energy', ARGV[3]) end
+if ARGV[4] ~= '' then
+    local current = tonumber(redis.call('HGET', KEYS[1], 'last_energy_update') or '0')
+    if tonumber(ARGV[4]) > current then redis.call('HSET', KEYS[1], 'last_energy_update', ARGV[4]) end
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+return redis.call('SCARD', KEYS[2])
+"""
+
+# Переносит приращения в in-flight ключи. Пользователи, у которых запись уже идёт, остаются в очереди.
+# KEYS: множество пользователей. ARGV: лимит, TTL in-flight, затем явный список id (если есть).
+TAKE_SCRIPT = """
+local ids
+if #ARGV > 2 then
+    ids = {unpack(ARGV, 3)}
+    for _, id in ipairs(ids) do redis.call('SREM', KEYS[1], id) end
+else
+    ids = redis.call('SPOP', KEYS[1], ARGV[1])
+end
+local out = {}
+for _, id in ipairs(ids) do
+    local pending = '""" + REDIS_PENDING + """' .. id
+    local inflight = '""" + REDIS_INFLIGHT + """' .. id
+    if redis.call('EXISTS', inflight) == 1 then
+        redis.call('SADD', KEYS[1], id)
+    elseif redis.call('EXISTS', pending) == 1 then
+        redis.call('RENAME', pending, inflight)
+        redis.call('EXPIRE', inflight, ARGV[2])
+        out[#out + 1] = id
+        out[#out + 1] = redis.call('HGETALL', inflight)
+    end
+end
+return out
+"""
+
+
+def _empty():
+    return {'points': 0.0, 'energy': 0, 'last_energy_update': None}
+
+
+def _merge(target, delta):
+    target['points'] += delta['points']
+    target['energy'] += delta['energy']
+    if delta['last_energy_update'] is not None and (
+            target['last_energy_update'] is None or delta['last_energy_update'] > target['last_energy_update']):
+        target['last_energy_update'] = delta['last_energy_update']
+    return target
+
+
+def _from_redis(raw):
+    """
+    Разбирает хэш приращений из Redis (ключи и значения в байтах) в словарь приращений.
+    """
+    if isinstance(raw, list):
+        raw = dict(zip(raw[::2], raw[1::2]))
+    delta = _empty()
+    for key, value in raw.items():
+        key = key.decode() if isinstance(key, bytes) else key
+        if key == 'points':
+            delta['points'] = float(value)
+        elif key == 'energy':
+            delta['energy'] = int(value)
+        elif key == 'last_energy_update':
+            delta['last_energy_update'] = float(value)
+    return delta
+
+
+class MemoryBuffer:
+    """
+    Буфер в памяти процесса. Подходит только для одного процесса (разработка, тесты):
+    другие воркеры не видят его приращений при чтении.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._inflight = {}
+
+    def add(self, user_id, delta):
+        with self._lock:
+            _merge(self._pending.setdefault(user_id, _empty()), delta)
+            return len(self._pending)
+
+    def get(self, user_id):
+        with self._lock:
+            sources = [source[user_id] for source in (self._pending, self._inflight) if user_id in source]
+        if not sources:
+            return None
+        delta = _empty()
+        for source in sources:
+            _merge(delta, source)
+        return delta
+
+    def take(self, limit, user_ids=None):
+        with self._lock:
+            candidates = list(self._pending) if user_ids is None else list(user_ids)
+            batch = {}
+            for user_id in candidates:
+                if len(batch) >= limit:
+                    break
+                if user_id in self._inflight or user_id not in self._pending:
+                    continue
+                batch[user_id] = self._inflight[user_id] = self._pending.pop(user_id)
+            return batch
+
+    def done(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._inflight.pop(user_id, None)
+
+    def requeue(self, batch):
+        with self._lock:
+            for user_id, delta in batch.items():
+                self._inflight.pop(user_id, None)
+                _merge(self._pending.setdefault(user_id, _empty()), delta)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._inflight.clear()
+
+
+class RedisBuffer:
+    """
+    Общий для всех процессов буфер в Redis: хэш приращений на пользователя и множество «грязных» id.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._add = client.register_script(ADD_SCRIPT)
+        self._take = client.register_script(TAKE_SCRIPT)
+
+    def add(self, user_id, delta):
+        return self._add(
+            keys=[f"{REDIS_PENDING}{user_id}", REDIS_DIRTY],
+            args=[user_id, repr(delta['points']), delta['energy'],
+                  '' if delta['last_energy_update'] is None else repr(delta['last_energy_update'])],
+            client=self.client,
+        )
+
+    def get(self, user_id):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(f"{REDIS_PENDING}{user_id}")
+        pipe.hgetall(f"{REDIS_INFLIGHT}{user_id}")
+        sources = [raw for raw in pipe.execute() if raw]
+        if not sources:
+            return None
+        delta = _empty()
+        for raw in sources:
+            _merge(delta, _from_redis(raw))
+        return delta
+
+    def take(self, limit, user_ids=None):
+        args = [limit, INFLIGHT_TTL] + (list(user_ids) if user_ids is not None else [])
+        out = self._take(keys=[REDIS_DIRTY], args=args, client=self.client)
+        return {int(user_id): _from_redis(raw) for user_id, raw in zip(out[::2], out[1::2])}
+
+    def done(self, user_ids):
+        if user_ids:
+            self.client.delete(*(f"{REDIS_INFLIGHT}{user_id}" for user_id in user_ids))
+
+    def requeue(self, batch):
+        for user_id, delta in batch.items():
+            self.add(user_id, delta)
+        self.done(list(batch))
+
+
+memory_buffer = MemoryBuffer()
+_redis_buffer = None
+_flush_lock = threading.Lock()
+# Размер буфера (число пользователей с незаписанными приращениями) по последнему add()
+_last_depth = 0
+
+
+def get_buffer():
+    """
+    Возвращает буфер по настройке COUNTER_BUFFER: 'redis', 'memory' или None ('off' или Redis недоступен).
+    """
+    global _redis_buffer
+    if settings.COUNTER_BUFFER == 'memory':
+        return memory_buffer
+    if settings.COUNTER_BUFFER != 'redis':
+        return None
+    client = get_redis()
+    if client is None:
+        return None
+    if _redis_buffer is None or _redis_buffer.client is not client:
+        _redis_buffer = RedisBuffer(client)
+    return _redis_buffer
+
+
+def add(user_id, points=0, energy=0, last_energy_update=None):
+    """
+    Добавляет приращения счётчиков пользователя в буфер.
+    last_energy_update — новое время восстановления энергии (в буфере остаётся наибольшее).
+    """
+    delta = {
+        'points': float(points),
+        'energy': int(energy),
+        'last_energy_update': last_energy_update.timestamp() if last_energy_update else None,
+    }
+    global _last_depth
+    buffer = get_buffer()
+    if buffer is not None:
+        try:
+            size = _last_depth = buffer.add(user_id, delta)
+        except redis.RedisError as e:
+            mark_redis_down(e)
+        else:
+            if size >= settings.COUNTER_BUFFER_MAX_USERS:
+                flush()
+            return
+    write({user_id: delta})
+
+
+def depth():
+    """
+    Размер буфера по последней записи в него, без обращения к Redis (для оценки нагрузки).
+    """
+    return _last_depth
+
+
+def pending(user_id):
+    """
+    Возвращает ещё не записанные в базу приращения пользователя или None.
+    """
+    buffer = get_buffer()
+    if buffer is None:
+        return None
+    try:
+        return buffer.get(user_id)
+    except redis.RedisError as e:
+        mark_redis_down(e)
+        return None
+
+
+def overlay(user):
+    """
+    Добавляет к загруженному пользователю приращения из буфера.
+
+    Повторный вызов для того же объекта ничего не делает. После overlay() User.save()
+    без update_fields не перезаписывает счётчики (см. User.save), иначе приращения учлись бы дважды.
+    """
+    if getattr(user, '_counters_overlaid', False):
+        return user
+    user._counters_overlaid = True
+    delta = pending(user.pk)
+    if delta is None:
+        return user
+    user.points += delta['points']
+    user.energy = min(user.max_energy, max(0, user.energy + delta['energy']))
+    if delta['last_energy_update'] is not None:
+        restored_at = datetime.fromtimestamp(delta['last_energy_update'], tz=dt_timezone.utc)
+        if restored_at > user.last_energy_update:
+            user.last_energy_update = restored_at
+    return user
+
+
+def flush(user_ids=None):
+    """
+    Записывает приращения из буфера в базу.
+    Без user_ids записывается весь буфер пачками по COUNTER_FLUSH_BATCH, с user_ids — только эти пользователи.
+
+    :return: Количество пользователей, чьи счётчики записаны.
+    """
+    global _last_depth
+    buffer = get_buffer()
+    if buffer is None:
+        return 0
+    flushed = 0
+    with _flush_lock:
+        while True:
+            try:
+                batch = buffer.take(settings.COUNTER_FLUSH_BATCH, user_ids)
+            except redis.RedisError as e:
+                mark_redis_down(e)
+                break
+            if not batch:
+                break
+            try:
+                write(batch)
+            except Exception as e:
+                logger.error(f"Не удалось записать счётчики пользователей: {e}", exc_info=True)
+                buffer.requeue(batch)
+                break
+            buffer.done(list(batch))
+            flushed += len(batch)
+            if user_ids is not None:
+                break
+        if user_ids is None:
+            _last_depth = 0
+    if flushed:
+        registry.inc("move_on_counter_flush_users_total", flushed)
+    return flushed
+
+
+def write(batch):
+    """
+    Применяет приращения {user_id: приращения} к таблице пользователей одной транзакцией.
+    """
+    items = list(batch.items())
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            for start in range(0, len(items), settings.COUNTER_FLUSH_BATCH):
+                _write_values(items[start:start + settings.COUNTER_FLUSH_BATCH])
+            return
+        for user_id, delta in items:
+            _write_row(user_id, delta)
+
+
+def _write_values(items):
+    from .models import User
+
+    rows = ", ".join(["(%s, %s::double precision, %s::integer, %s::timestamptz)"] * len(items))
+    params = []
+    for user_id, delta in items:
+        restored_at = delta['last_energy_update']
+        params += [user_id, delta['points'], delta['energy'],
+                   datetime.fromtimestamp(restored_at, tz=dt_timezone.utc) if restored_at is not None else None]
+    # GREATEST в PostgreSQL пропускает NULL, поэтому пустое время восстановления не меняет столбец.
+    sql = f"""
+        UPDATE {connection.ops.quote_name(User._meta.db_table)} AS u SET
+            points = u.points + v.points,
+            energy = LEAST(GREATEST(u.energy + v.energy, 0), u.max_energy),
+            last_energy_update = GREATEST(u.last_energy_update, v.last_energy_update)
+        FROM (VALUES {rows}) AS v(id, points, energy, last_energy_update)
+        WHERE u.id = v.id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _write_row(user_id, delta):
+    from .models import User
+
+    fields = {
+        'points': F('points') + delta['points'],
+        'energy': Least(Greatest(F('energy') + delta['energy'], Value(0)), F('max_energy')),
+    }
+    if delta['last_energy_update'] is not None:
+        restored_at = datetime.fromtimestamp(delta['last_energy_update'], tz=dt_timezone.utc)
+        fields['last_energy_update'] = Greatest(F('last_energy_update'), Value(restored_at))
+    User.objects.filter(pk=user_id).update(**fields)
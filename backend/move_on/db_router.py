@@ -0,0 +1,220 @@
+"""
+Чтение с реплик PostgreSQL.
+
+Реплики задаются в DB_REPLICA_HOSTS и попадают в DATABASES как replica_1, replica_2, ...
+(список — settings.DATABASE_REPLICAS). По умолчанию все запросы идут в default; с реплик читают
+только представления с декоратором @replica_reads, списки админки (LargeTableAdmin) и код внутри
+with read_replica(). Реплика выбирается случайно среди тех, что не отстают.
+
+Read-your-writes:
+- после первой записи внутри запроса (db_for_write) его чтения идут в default;
+- ответ на такой запрос ставит cookie PIN_COOKIE на REPLICA_PIN_SECONDS секунд, и пока она жива,
+  все чтения клиента идут в default (ReplicaPinMiddleware);
+- внутри транзакции на default чтения тоже остаются на default.
+
+Отставание реплик проверяется не чаще раза в REPLICA_LAG_CHECK_INTERVAL секунд на процесс.
+Реплика, которая отстаёт больше REPLICA_MAX_LAG_SECONDS, недоступна или не получает WAL с основной
+базы (нет потоковой репликации в pg_stat_wal_receiver), исключается до следующей проверки; текущее
+отставание показывает /health/ready. Пользователю БД на репликах нужна роль pg_read_all_stats (или
+pg_monitor): без неё статус приёмника WAL не виден и реплика считается отключённой.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, router
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = "db_pin"
+
+registry.describe("move_on_replica_excluded_total", "counter",
+                  "Проверки отставания, после которых реплика исключена из чтения.")
+
+_replica_reads = ContextVar("replica_reads", default=False)
+# [закреплён за default, была запись] для текущего HTTP-запроса или блока read_replica()
+_request_state = ContextVar("replica_request_state", default=None)
+
+
+def measure_lag(alias):
+    """
+    Отставание реплики в секундах. Реплика, которая применила всё полученное, не отстаёт,
+    даже если на основной базе давно не было записей, — но только пока приёмник WAL получает
+    данные с основной базы. Без него реплика не знает, что пропустила, и равенство позиций
+    ничего не значит.
+    :return: Отставание или None, если потоковая репликация не работает.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT pg_is_in_recovery(),
+                EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming'),
+                CASE
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                END
+            """
+        )
+        in_recovery, streaming, lag = cursor.fetchone()
+    if not in_recovery:
+        return 0.0
+    if not streaming:
+        return None
+    return float(lag or 0)
+
+
+class LagMonitor:
+    """
+    Кэш отставания реплик в памяти процесса. Проверку выполняет один поток,
+    остальные в это время пользуются предыдущим результатом.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lags = {}
+        self._checked_at = None
+
+    def lags(self):
+        """
+        {реплика: отставание в секундах или None, если недоступна}.
+        """
+        if self._checked_at is None or time.monotonic() - self._checked_at >= settings.REPLICA_LAG_CHECK_INTERVAL:
+            self.refresh()
+        return dict(self._lags)
+
+    def healthy(self):
+        """
+        Реплики, с которых сейчас можно читать.
+        """
+        if not settings.DATABASE_REPLICAS:
+            return []
+        lags = self.lags()
+        return [alias for alias in settings.DATABASE_REPLICAS
+                if lags.get(alias) is not None and lags[alias] <= settings.REPLICA_MAX_LAG_SECONDS]
+
+    def refresh(self):
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            lags = {}
+            for alias in settings.DATABASE_REPLICAS:
+                try:
+                    lags[alias] = measure_lag(alias)
+                    if lags[alias] is None:
+                        logger.warning(f"Реплика {alias} не получает WAL с основной базы")
+                except Exception as e:
+                    logger.warning(f"Реплика {alias} недоступна: {e}")
+                    lags[alias] = None
+                if lags[alias] is None or lags[alias] > settings.REPLICA_MAX_LAG_SECONDS:
+                    registry.inc("move_on_replica_excluded_total", labels=(("alias", alias),))
+            self._lags = lags
+            self._checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lags = {}
+        self._checked_at = None
+
+
+lag_monitor = LagMonitor()
+
+
+@contextmanager
+def read_replica():
+    """
+    Чтения внутри блока идут на реплику, пока в нём не было записи.
+    """
+    token = _replica_reads.set(True)
+    state_token = _request_state.set([False, False]) if _request_state.get() is None else None
+    try:
+        yield
+    finally:
+        if state_token is not None:
+            _request_state.reset(state_token)
+        _replica_reads.reset(token)
+
+
+def replica_alias(model):
+    """
+    База, которую выбрал бы read_replica(), — для запросов, которые выполняются уже после выхода
+    из блока (потоковые ответы).
+    """
+    with read_replica():
+        return router.db_for_read(model)
+
+
+def replica_reads(view):
+    """
+    Декоратор представления только для чтения: его запросы идут на реплику.
+    Ставится под @api_view, чтобы охватить только код представления.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            with read_replica():
+                return await view(*args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with read_replica():
+                return view(*args, **kwargs)
+    return wrapper
+
+
+def begin_request(request):
+    """
+    Начало HTTP-запроса: закрепляет его за default, если у клиента есть свежая запись.
+    :return: Токен для finish_request.
+    """
+    return _request_state.set([request.COOKIES.get(PIN_COOKIE) == '1', False])
+
+
+def finish_request(token, response):
+    """
+    Конец HTTP-запроса: если он что-то записал, следующие запросы клиента читают из default.
+    """
+    wrote = _request_state.get()[1]
+    _request_state.reset(token)
+    if wrote and settings.DATABASE_REPLICAS and response is not None:
+        response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+    return response
+
+
+class ReplicaRouter:
+    """
+    Роутер Django: запись всегда в default, чтение — на реплику только внутри read_replica().
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return None
+        state = _request_state.get()
+        if (state is not None and state[0]) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = lag_monitor.healthy()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state[0] = state[1] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии default, связи между объектами из разных баз допустимы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in settings.DATABASE_REPLICAS else None
@@ -0,0 +1,128 @@
+"""
+Потоковая выгрузка данных для аналитики: прогулки, пользователи, рефералы и пожертвования.
+
+Строки читаются через iterator(chunk_size=EXPORT_CHUNK_SIZE) — в PostgreSQL это серверный курсор —
+и отдаются пачками в CSV или NDJSON, сжатыми gzip, если клиент его принимает. В памяти процесса
+одновременно не больше одной пачки, сколько бы строк ни было в таблице. Выгрузку обслуживает
+ASGI-сервис (async_views.export): каждая пачка читается через sync_to_async, и пока база её отдаёт,
+воркер обслуживает другие запросы. aiterator() здесь не подходит: для values_list он выполняет
+запрос прямо в event loop.
+
+Фильтр по датам — по created_at; для прогулок это ключ секционирования, поэтому лишние секции
+не читаются. Порядок строк не гарантируется: сортировка заставила бы базу упорядочить весь диапазон
+до отдачи первой строки.
+"""
+import csv
+import io
+import zlib
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.timezone import make_aware
+
+from .models import User, Walk, Referral, Donation
+
+# {набор: (модель, [(колонка, поле), ...])}. Персональные данные (имена, кошельки) не выгружаются.
+DATASETS = {
+    'walks': (Walk, [
+        ('id', 'id'), ('telegram_id', 'user__telegram_id'), ('start_time', 'start_time'),
+        ('end_time', 'end_time'), ('steps', 'steps'), ('distance', 'distance'), ('avg_speed', 'avg_speed'),
+        ('reward', 'reward'), ('is_lucky_walk', 'is_lucky_walk'), ('is_valid', 'is_valid'),
+        ('is_interrupted', 'is_interrupted'), ('created_at', 'created_at'),
+    ]),
+    'users': (User, [
+        ('telegram_id', 'telegram_id'), ('points', 'points'), ('energy', 'energy'),
+        ('endurance_level', 'endurance_level'), ('efficiency_level', 'efficiency_level'),
+        ('luck_level', 'luck_level'), ('daily_streak', 'daily_streak'), ('max_daily_streak', 'max_daily_streak'),
+        ('is_active', 'is_active'), ('is_scam', 'is_scam'), ('is_fake', 'is_fake'), ('created_at', 'created_at'),
+    ]),
+    'referrals': (Referral, [
+        ('telegram_id', 'user__telegram_id'), ('invited_by', 'invited_by__telegram_id'),
+        ('reward_percentage', 'reward_percentage'), ('total_rewards', 'total_rewards'),
+        ('total_invited', 'total_invited'), ('created_at', 'created_at'),
+    ]),
+    'donations': (Donation, [
+        ('telegram_id', 'user__telegram_id'), ('stars_bought', 'stars_bought'),
+        ('amount_paid', 'amount_paid'), ('created_at', 'created_at'),
+    ]),
+}
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def parse_range(start, end):
+    """
+    Даты 'YYYY-MM-DD' (включительно, любая может быть None) → границы created_at [начало, конец).
+    :raises ValueError: Неверный формат даты.
+    """
+    lower = make_aware(datetime.combine(date.fromisoformat(start), time.min)) if start else None
+    upper = make_aware(datetime.combine(date.fromisoformat(end) + timedelta(days=1), time.min)) if end else None
+    return lower, upper
+
+
+def queryset(dataset, start=None, end=None):
+    """
+    Строки набора за период в виде кортежей значений колонок.
+    """
+    model, columns = DATASETS[dataset]
+    rows = model.objects.order_by()
+    if start is not None:
+        rows = rows.filter(created_at__gte=start)
+    if end is not None:
+        rows = rows.filter(created_at__lt=end)
+    return rows.values_list(*(field for _, field in columns))
+
+
+def filename(dataset, fmt, start=None, end=None):
+    return f"{dataset}_{start or 'all'}_{end or 'now'}.{fmt}"
+
+
+def _chunks(rows, chunk_size):
+    iterator = rows.iterator(chunk_size=chunk_size)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+def _drain(buffer, compressor):
+    data = buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+    return compressor.compress(data) if compressor else data
+
+
+async def stream(rows, dataset, fmt, compress, chunk_size):
+    """
+    Асинхронный генератор байтов выгрузки: одна порция на каждые chunk_size строк.
+    """
+    names = [name for name, _ in DATASETS[dataset][1]]
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+        write = writer.writerow
+    else:
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+        def write(row):
+            buffer.write(encoder.encode(dict(zip(names, row))))
+            buffer.write('\n')
+
+    # Генератор и его курсор живут в потоке sync_to_async, там же курсор закрывается при обрыве выгрузки
+    chunks = _chunks(rows, chunk_size)
+    fetch = sync_to_async(next)
+    try:
+        while (chunk := await fetch(chunks, None)) is not None:
+            for row in chunk:
+                write(row)
+            data = _drain(buffer, compressor)
+            if data:
+                yield data
+    finally:
+        await sync_to_async(chunks.close)()
+    yield _drain(buffer, compressor) + (compressor.flush() if compressor else b'')
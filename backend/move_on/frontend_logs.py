@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+import zlib
+
+from django.conf import settings
+
+from .background import BackgroundBatcher
+from .metrics import registry
+
+frontend_logger = logging.getLogger("move_on.frontend")
+
+LEVELS = {
+    "debug": logging.DEBUG,
+    "log": logging.INFO,
+    "info": logging.INFO,
+    "warn": logging.WARNING,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
+
+registry.describe("move_on_frontend_log_entries_total", "counter", "Записи логов фронтенда по результату приёма.")
+
+
+def write_batch(entries):
+    """
+    Записывает пачку логов фронтенда через логгер move_on.frontend (в LOGGING — ротируемый файл).
+    """
+    for level, user_id, message in entries:
+        frontend_logger.log(level, "User: %s - %s", user_id, message)
+
+
+writer = BackgroundBatcher(write_batch, name="frontend-log-writer", maxsize=10000, batch_size=500)
+
+
+class UserQuota:
+    """
+    Ограничение количества записей от одного пользователя в минуту (в пределах процесса).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def take(self, user_id, requested, limit):
+        window = int(time.monotonic() // 60)
+        with self._lock:
+            if len(self._windows) > 10000:
+                self._windows = {k: v for k, v in self._windows.items() if v[0] == window}
+            start, used = self._windows.get(user_id, (window, 0))
+            if start != window:
+                used = 0
+            allowed = max(0, min(requested, limit - used))
+            self._windows[user_id] = (window, used + allowed)
+        return allowed
+
+
+quota = UserQuota()
+
+
+def is_sampled(user_id):
+    """
+    Детерминированная выборка по пользователю: либо все debug/info записи пользователя, либо ни одной.
+    """
+    rate = settings.FRONTEND_LOG_SAMPLE_RATE
+    if rate >= 1:
+        return True
+    return zlib.crc32(str(user_id).encode()) % 10000 < rate * 10000
+
+
+def normalize_batch(data):
+    """
+    Приводит тело запроса к виду (user_id, [записи]).
+    Поддерживаются одиночная запись {"level", "message", "user_id"}, список записей
+    и пачка {"user_id": ..., "entries": [...]}.
+    """
+    if isinstance(data, list):
+        entries = data
+        user_id = next((e.get("user_id") for e in entries if isinstance(e, dict) and e.get("user_id")), None)
+    elif isinstance(data, dict) and "entries" in data:
+        entries = data["entries"] if isinstance(data["entries"], list) else []
+        user_id = data.get("user_id")
+    elif isinstance(data, dict):
+        entries = [data]
+        user_id = data.get("user_id")
+    else:
+        entries, user_id = [], None
+    return user_id or "Unknown User", entries
+
+
+def ingest(data):
+    """
+    Проверяет и ставит в очередь записи логов фронтенда.
+    :return: (принято, отброшено).
+    """
+    user_id, entries = normalize_batch(data)
+    max_message = settings.FRONTEND_LOG_MAX_MESSAGE
+    total = len(entries)
+    entries = entries[:settings.FRONTEND_LOG_MAX_BATCH]
+    sampled = is_sampled(user_id)
+
+    prepared = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        level = LEVELS.get(str(entry.get("level", "info")).lower(), logging.INFO)
+        if level < logging.WARNING and not sampled:
+            continue
+        message = str(entry.get("message", "No message provided"))[:max_message]
+        prepared.append((level, user_id, message))
+
+    prepared = prepared[:quota.take(user_id, len(prepared), settings.FRONTEND_LOG_USER_LIMIT)]
+    accepted = sum(1 for item in prepared if writer.put(item))
+    dropped = total - accepted
+    registry.add([
+        (("move_on_frontend_log_entries_total", (("result", "accepted"),)), accepted),
+        (("move_on_frontend_log_entries_total", (("result", "dropped"),)), dropped),
+    ])
+    return accepted, dropped
@@ -0,0 +1,164 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+from django.http import Http404
+
+from .metrics import registry
+from .models import User
+from .redis_client import get_redis, mark_redis_down
+
+REDIS_PREFIX = "identity:v1:"
+# Поля профиля, которые почти не меняются: их можно отдавать из кэша вместо запроса к users.
+IDENTITY_FIELDS = ('id', 'username', 'first_name', 'last_name', 'referral_uuid', 'created_at')
+
+registry.describe("move_on_identity_cache_total", "counter", "Обращения к кэшу telegram_id → пользователь по уровню и результату.")
+_LOCAL_HIT = ("move_on_identity_cache_total", (("tier", "local"), ("result", "hit")))
+_REDIS_HIT = ("move_on_identity_cache_total", (("tier", "redis"), ("result", "hit")))
+_MISS = ("move_on_identity_cache_total", (("tier", "db"), ("result", "miss")))
+
+
+class LocalLRU:
+    """
+    Потокобезопасный LRU-кэш процесса с ограничением по размеру и времени жизни записей.
+    Размер и TTL читаются из настроек при каждой записи.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if time.monotonic() >= expires_at:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + settings.IDENTITY_CACHE_TTL, value)
+            self._data.move_to_end(key)
+            while len(self._data) > settings.IDENTITY_CACHE_SIZE:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_tier = LocalLRU()
+
+
+def _identity(values):
+    """
+    Приводит поля пользователя к виду, одинаковому в обоих уровнях кэша (JSON-совместимому).
+    """
+    return {
+        'id': values['id'],
+        'username': values['username'],
+        'first_name': values['first_name'],
+        'last_name': values['last_name'],
+        'referral_uuid': str(values['referral_uuid']),
+        'created_at': values['created_at'].isoformat() if values['created_at'] else None,
+    }
+
+
+def _store(telegram_id, identity):
+    local_tier.set(telegram_id, identity)
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.set(f"{REDIS_PREFIX}{telegram_id}", json.dumps(identity), ex=settings.IDENTITY_CACHE_REDIS_TTL)
+    except redis.RedisError as e:
+        mark_redis_down(e)
+
+
+def lookup(telegram_id):
+    """
+    Возвращает неизменяемые данные пользователя по telegram_id:
+    сначала из памяти процесса, затем из Redis, затем одним запросом к базе.
+
+    :return: Словарь с полями IDENTITY_FIELDS или None, если пользователя нет.
+    """
+    try:
+        telegram_id = int(telegram_id)
+    except (TypeError, ValueError):
+        return None
+
+    identity = local_tier.get(telegram_id)
+    if identity is not None:
+        registry.add([(_LOCAL_HIT, 1)])
+        return identity
+
+    client = get_redis()
+    if client is not None:
+        try:
+            raw = client.get(f"{REDIS_PREFIX}{telegram_id}")
+        except redis.RedisError as e:
+            mark_redis_down(e)
+            raw = None
+        if raw is not None:
+            identity = json.loads(raw)
+            local_tier.set(telegram_id, identity)
+            registry.add([(_REDIS_HIT, 1)])
+            return identity
+
+    registry.add([(_MISS, 1)])
+    values = User.objects.filter(telegram_id=telegram_id).values(*IDENTITY_FIELDS).first()
+    if values is None:
+        return None
+    identity = _identity(values)
+    _store(telegram_id, identity)
+    return identity
+
+
+def get_user_id_or_404(telegram_id):
+    """
+    Возвращает первичный ключ пользователя по telegram_id или выбрасывает Http404.
+    """
+    identity = lookup(telegram_id)
+    if identity is None:
+        raise Http404("Пользователь не найден")
+    return identity['id']
+
+
+def refresh(user):
+    """
+    Обновляет кэш после сохранения пользователя.
+    Если неизменяемые поля не поменялись (например, сохранялась только энергия), кэш не трогаем.
+    Другие процессы увидят изменения не позже чем через IDENTITY_CACHE_TTL секунд.
+    """
+    if user.get_deferred_fields() & set(IDENTITY_FIELDS):
+        invalidate(user.telegram_id)
+        return
+    identity = _identity({field: getattr(user, field) for field in IDENTITY_FIELDS})
+    if local_tier.get(user.telegram_id) != identity:
+        _store(user.telegram_id, identity)
+
+
+def invalidate(telegram_id):
+    """
+    Удаляет пользователя из обоих уровней кэша.
+    """
+    local_tier.delete(telegram_id)
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.delete(f"{REDIS_PREFIX}{telegram_id}")
+    except redis.RedisError as e:
+        mark_redis_down(e)
@@ -0,0 +1,169 @@
+"""
+Живые обновления прогулки через Server-Sent Events (async_views.walk_stream).
+
+Обновления и завершение прогулки публикуют состояние сессии в канал Redis walk:v1:<id сессии>.
+В каждом ASGI-процессе работает один StreamHub: одно соединение pub/sub, подписка на канал
+сессии появляется при первом открытом потоке этой сессии и снимается с закрытием последнего.
+Сообщения раскладываются по ограниченным asyncio-очередям подписчиков, поэтому открытый поток
+стоит одну корутину и очередь, а не поток ОС. Если Redis не настроен или недоступен, сообщения
+доставляются только подписчикам того же процесса (разработка, один процесс uvicorn).
+"""
+import asyncio
+import json
+import logging
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+from .redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "walk:v1:"
+
+
+def session_state(walk_session, energy=None, current_speed=None, finished=False):
+    """
+    Состояние сессии в том виде, в каком его получает клиент.
+    """
+    state = {
+        "walk_id": walk_session.id,
+        "steps": walk_session.steps,
+        "distance": round(walk_session.distance, 2),
+        "average_speed": round(walk_session.avg_speed, 2),
+        "finished": finished or walk_session.finished_at is not None,
+    }
+    if current_speed is not None:
+        state["current_speed"] = round(current_speed, 2)
+    if energy is not None:
+        state["energy"] = energy
+    if state["finished"]:
+        state["reward"] = walk_session.reward
+    return state
+
+
+def publish(session_id, state):
+    """
+    Публикует состояние сессии всем открытым потокам (во всех процессах, если есть Redis).
+    """
+    message = json.dumps(state)
+    client = get_redis()
+    if client is not None:
+        try:
+            client.publish(f"{CHANNEL_PREFIX}{session_id}", message)
+            return
+        except redis.RedisError as e:
+            mark_redis_down(e)
+    hub.deliver_threadsafe(session_id, message)
+
+
+class StreamHub:
+    """
+    Раздаёт сообщения каналов сессий по очередям открытых потоков этого процесса.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._subscribers = {}
+        self._client = None
+        self._pubsub = None
+        self._listener = None
+
+    async def subscribe(self, session_id):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Новый цикл событий (например, в тестах): состояние прежнего цикла не переиспользуем
+            self._loop, self._subscribers, self._client, self._pubsub, self._listener = loop, {}, None, None, None
+
+        queue = asyncio.Queue(maxsize=settings.WALK_STREAM_QUEUE_SIZE)
+        queues = self._subscribers.setdefault(session_id, set())
+        queues.add(queue)
+        if len(queues) == 1 and settings.REDIS_URL:
+            await self._redis_call('subscribe', session_id)
+        if settings.REDIS_URL and (self._listener is None or self._listener.done()):
+            self._listener = loop.create_task(self._listen())
+        return queue
+
+    async def unsubscribe(self, session_id, queue):
+        queues = self._subscribers.get(session_id)
+        if not queues:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[session_id]
+            if settings.REDIS_URL:
+                await self._redis_call('unsubscribe', session_id)
+
+    def deliver(self, session_id, message):
+        for queue in self._subscribers.get(session_id, ()):
+            if queue.full():
+                # Клиенту важно последнее состояние: отбрасываем самое старое
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def deliver_threadsafe(self, session_id, message):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self.deliver(session_id, message)
+        else:
+            loop.call_soon_threadsafe(self.deliver, session_id, message)
+
+    def _get_pubsub(self):
+        if self._pubsub is None:
+            # Без socket_timeout: соединение подписки большую часть времени ждёт сообщений
+            self._client = aioredis.Redis.from_url(
+                settings.REDIS_URL,
+                socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                health_check_interval=30,
+            )
+            self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        return self._pubsub
+
+    async def _redis_call(self, command, session_id):
+        try:
+            await getattr(self._get_pubsub(), command)(f"{CHANNEL_PREFIX}{session_id}")
+        except (redis.RedisError, OSError) as e:
+            # Подписки восстановит _listen после переподключения
+            logger.warning(f"Ошибка {command} канала прогулки {session_id}: {e}")
+            await self._reset()
+
+    async def _reset(self):
+        pubsub, client = self._pubsub, self._client
+        self._pubsub = self._client = None
+        if pubsub is not None:
+            try:
+                await pubsub.aclose()
+                await client.aclose()
+            except (redis.RedisError, OSError):
+                pass
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self._get_pubsub()
+                if not pubsub.subscribed and self._subscribers:
+                    await pubsub.subscribe(*(f"{CHANNEL_PREFIX}{session_id}" for session_id in self._subscribers))
+                if not pubsub.subscribed:
+                    await asyncio.sleep(1)
+                    continue
+                message = await pubsub.get_message(timeout=1.0)
+                if message and message['type'] == 'message':
+                    session_id = int(message['channel'][len(CHANNEL_PREFIX):])
+                    data = message['data']
+                    self.deliver(session_id, data.decode() if isinstance(data, bytes) else data)
+            except asyncio.CancelledError:
+                raise
+            except (redis.RedisError, OSError) as e:
+                logger.warning(f"Соединение подписки на прогулки потеряно, переподключение: {e}")
+                await self._reset()
+                await asyncio.sleep(1)
+
+
+hub = StreamHub()
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import aiohttp
+from django.core.management.base import BaseCommand
+
+ENDPOINTS = {
+    'energy': ('/energy/{telegram_id}/', '/api/async/energy/{telegram_id}/'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает пропускную способность синхронного (WSGI) и асинхронного (ASGI) развёртывания "
+        "при большом числе одновременных клиентов."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--telegram-id', type=int, required=True, help="Пользователь, от имени которого идут запросы")
+        parser.add_argument('--sync-url', default='http://localhost:8000', help="Адрес WSGI-сервиса")
+        parser.add_argument('--async-url', default='http://localhost:8001', help="Адрес ASGI-сервиса")
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='energy')
+        parser.add_argument('--concurrency', type=int, default=200, help="Число одновременных клиентов")
+        parser.add_argument('--requests', type=int, default=5000, help="Число запросов на каждый сервис")
+
+    def handle(self, *args, **options):
+        sync_path, async_path = ENDPOINTS[options['endpoint']]
+        targets = [
+            ('sync', options['sync_url'] + sync_path.format(telegram_id=options['telegram_id'])),
+            ('async', options['async_url'] + async_path.format(telegram_id=options['telegram_id'])),
+        ]
+        self.stdout.write(f"{'target':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for name, url in targets:
+            result = asyncio.run(run_load(url, options['concurrency'], options['requests']))
+            self.stdout.write(
+                f"{name:<8}{result['rps']:>10.1f}{result['p50']:>10.1f}"
+                f"{result['p95']:>10.1f}{result['p99']:>10.1f}{result['errors']:>8}"
+            )
+
+
+async def run_load(url, concurrency, total):
+    """
+    Выполняет total GET-запросов к url силами concurrency одновременных клиентов.
+    """
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def client(session):
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                async with session.get(url) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0
+
+    return {
+        'rps': len(latencies) / elapsed if elapsed else 0,
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'errors': errors,
+    }
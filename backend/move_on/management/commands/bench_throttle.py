@@ -0,0 +1,58 @@
+import statistics
+import time
+
+import redis
+from django.core.management.base import BaseCommand, CommandError
+
+from move_on import redis_client, throttling
+
+
+def bench(check, requests, users):
+    """
+    Вызывает check(ident) requests раз по кругу для users пользователей.
+    :return: Список задержек в микросекундах.
+    """
+    latencies = []
+    for i in range(requests):
+        start = time.perf_counter()
+        check(f"bench:{i % users}")
+        latencies.append((time.perf_counter() - start) * 1_000_000)
+    return latencies
+
+
+class Command(BaseCommand):
+    help = "Измеряет задержку, которую добавляет ограничение частоты запросов (Redis и запасной режим в памяти)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000, help="Сколько проверок выполнить")
+        parser.add_argument('--users', type=int, default=1000, help="Сколько разных telegram_id использовать")
+        parser.add_argument('--scope', default='walk_update', help="Группа лимитов из DEFAULT_THROTTLE_RATES")
+        parser.add_argument('--max-p99-us', type=float, default=None,
+                            help="Завершиться с ошибкой, если p99 в Redis больше этого значения (мкс)")
+
+    def handle(self, *args, **options):
+        rate, capacity = throttling.parse_rate(throttling.api_settings.DEFAULT_THROTTLE_RATES[options['scope']])
+        modes = [('memory', lambda ident: throttling._check_local(ident, rate, capacity))]
+        try:
+            redis_client.ping()
+            client = redis_client.get_redis()
+        except redis.RedisError:
+            client = None
+        if client is not None:
+            modes.append(('redis', lambda ident: throttling._check_redis(client, ident, rate, capacity)))
+        else:
+            self.stderr.write("Redis недоступен: измеряется только запасной режим в памяти")
+
+        self.stdout.write(f"{'mode':<10}{'p50 us':>10}{'p99 us':>10}{'max us':>10}")
+        p99 = {}
+        for mode, check in modes:
+            latencies = sorted(bench(check, options['requests'], options['users']))
+            p99[mode] = latencies[int(len(latencies) * 0.99) - 1]
+            self.stdout.write(
+                f"{mode:<10}{statistics.median(latencies):>10.1f}{p99[mode]:>10.1f}{latencies[-1]:>10.1f}"
+            )
+        if client is not None:
+            client.delete(*(f"bench:{i}" for i in range(min(options['users'], options['requests']))))
+
+        if options['max_p99_us'] is not None and p99.get('redis', 0) > options['max_p99_us']:
+            raise CommandError(f"p99 {p99['redis']:.0f} мкс больше {options['max_p99_us']:.0f} мкс")
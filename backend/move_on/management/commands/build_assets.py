@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from move_on import assets
+
+
+class Command(BaseCommand):
+    help = (
+        "Собирает статику в STATIC_ROOT с манифестом имён с хэшем содержимого "
+        "и кладёт рядом сжатые копии (.gz, .br) для nginx."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Потоков для сжатия (по умолчанию — по числу ядер)")
+
+    def handle(self, *args, **options):
+        call_command('collectstatic', interactive=False, verbosity=options['verbosity'])
+        counts = assets.compress(settings.STATIC_ROOT, workers=options['workers'])
+        self.stdout.write(f"Сжатых копий записано: gzip {counts['.gz']}, brotli {counts['.br']}")
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from move_on import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Помесячные секции прогулок и аномалий: status — список секций и архивов, maintain — то же, что задача "
+        "maintain_partitions, archive/restore — выгрузить секцию месяца в архив или загрузить её обратно."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['status', 'maintain', 'archive', 'restore'])
+        parser.add_argument('table', nargs='?', choices=sorted(partitions.partitioned_tables()),
+                            help="Таблица для archive и restore")
+        parser.add_argument('month', nargs='?', help="Месяц для archive и restore в формате YYYY-MM")
+
+    def handle(self, *args, **options):
+        if not partitions.is_supported():
+            raise CommandError("Секционирование поддерживается только для PostgreSQL")
+        action = options['action']
+
+        if action == 'maintain':
+            result = partitions.maintain()
+            self.stdout.write(f"Создано: {', '.join(result['created']) or '-'}")
+            self.stdout.write(f"Архивировано: {', '.join(result['archived']) or '-'}")
+            return
+
+        if action == 'status':
+            for short_name, (table, retain_months) in partitions.partitioned_tables().items():
+                self.stdout.write(f"{short_name} ({table}), хранится месяцев: {retain_months or 'без ограничения'}")
+                for month, (name, restored) in sorted(partitions.attached_partitions(table).items()):
+                    self.stdout.write(f"  {month:%Y-%m}  {name}{'  (восстановлена)' if restored else ''}")
+                for month in partitions.detached_partitions(table):
+                    self.stdout.write(f"  {month:%Y-%m}  отсоединена, ожидает выгрузки")
+                stray = partitions.default_rows(table)
+                if stray is None:
+                    self.stdout.write("  секции по умолчанию нет, её создаст maintain")
+                elif stray:
+                    self.stdout.write(f"  {partitions.default_partition_name(table)}: строк вне месячных секций: {stray}")
+            return
+
+        if not options['table'] or not options['month']:
+            raise CommandError(f"Для {action} нужны таблица и месяц, например: partitions {action} walk 2024-01")
+        table, _ = partitions.partitioned_tables()[options['table']]
+        try:
+            month = partitions.parse_month(options['month'])
+        except ValueError:
+            raise CommandError("Месяц указывается в формате YYYY-MM")
+
+        if action == 'archive':
+            self.stdout.write(f"Архив: {partitions.archive_partition(table, month)}")
+        else:
+            try:
+                rows = partitions.restore_partition(table, month)
+            except (ValueError, FileNotFoundError) as e:
+                raise CommandError(str(e))
+            self.stdout.write(f"Загружено строк: {rows}")
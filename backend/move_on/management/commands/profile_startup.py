@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+TARGETS = {
+    'web': "from django.urls import get_resolver; get_resolver().url_patterns",
+    'celery': "from backend.celery import app; app.loader.import_default_modules()",
+    'manage': "",
+}
+
+# Дочерний процесс: audit-хук на событие import запоминает RSS в момент начала каждой загрузки модуля.
+# Прирост RSS до следующего события приписывается модулю, который загружался последним (аналог self в importtime).
+CHILD_SCRIPT = """
+import json, os, sys, time
+_page = os.sysconf('SC_PAGE_SIZE')
+def _rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * _page
+_events = []
+def _hook(event, args):
+    if event == 'import':
+        _events.append((args[0], _rss()))
+sys.addaudithook(_hook)
+_start = time.perf_counter()
+import django
+django.setup()
+{target}
+_wall = time.perf_counter() - _start
+_events.append(('<end>', _rss()))
+rss_by_module = {{}}
+for (name, rss), (_, next_rss) in zip(_events, _events[1:]):
+    rss_by_module[name] = rss_by_module.get(name, 0) + max(0, next_rss - rss)
+sys.stdout.write(json.dumps({{'wall_ms': _wall * 1000, 'rss': _rss(), 'rss_by_module': rss_by_module}}))
+"""
+
+
+def measure_startup(target='web'):
+    """
+    Запускает холодный старт в отдельном процессе с -X importtime.
+    :return: Словарь с общим временем старта, итоговым RSS и разбивкой по пакетам верхнего уровня.
+    """
+    script = CHILD_SCRIPT.format(target=TARGETS[target])
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+    )
+    if completed.returncode != 0:
+        raise CommandError(completed.stderr.strip().splitlines()[-1])
+
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    packages = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, self_us, _, name = line.replace('|', ':').split(':', 3)
+        name = name.strip()
+        package = packages.setdefault(name.split('.')[0], {'modules': 0, 'self_ms': 0.0, 'rss': 0})
+        package['modules'] += 1
+        package['self_ms'] += int(self_us) / 1000
+    for name, rss in result['rss_by_module'].items():
+        package = packages.setdefault(name.split('.')[0], {'modules': 0, 'self_ms': 0.0, 'rss': 0})
+        package['rss'] += rss
+
+    return {'wall_ms': result['wall_ms'], 'rss': result['rss'], 'packages': packages}
+
+
+class Command(BaseCommand):
+    help = (
+        "Показывает время импорта и прирост RSS по пакетам при холодном старте процесса "
+        "(разбор вывода python -X importtime)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=sorted(TARGETS), default='web',
+                            help="web — URLconf и представления, celery — задачи Celery, manage — только django.setup()")
+        parser.add_argument('--top', type=int, default=20, help="Сколько самых тяжёлых пакетов показать")
+        parser.add_argument('--check', action='store_true',
+                            help="Завершиться с ошибкой, если старт дольше STARTUP_BUDGET_MS")
+
+    def handle(self, *args, **options):
+        result = measure_startup(options['target'])
+        packages = sorted(result['packages'].items(), key=lambda item: item[1]['self_ms'], reverse=True)
+
+        self.stdout.write(f"{'package':<32}{'modules':>8}{'import ms':>12}{'RSS KB':>10}")
+        for name, package in packages[:options['top']]:
+            self.stdout.write(
+                f"{name:<32}{package['modules']:>8}{package['self_ms']:>12.1f}{package['rss'] // 1024:>10}"
+            )
+        self.stdout.write(
+            f"\nХолодный старт ({options['target']}): {result['wall_ms']:.0f} ms, "
+            f"RSS {result['rss'] // 1024} KB, бюджет {settings.STARTUP_BUDGET_MS} ms"
+        )
+        if options['check'] and result['wall_ms'] > settings.STARTUP_BUDGET_MS:
+            raise CommandError(f"Старт занял {result['wall_ms']:.0f} ms при бюджете {settings.STARTUP_BUDGET_MS} ms")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from move_on import referral_graph
+
+
+class Command(BaseCommand):
+    help = (
+        "Реферальный граф: пересчёт таблицы замыкания (после развёртывания или для исправления) "
+        "и поиск подозрительных кластеров."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Пересчитать таблицу замыкания")
+        parser.add_argument('--clusters', action='store_true', help="Найти подозрительные кластеры")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.stdout.write(f"Строк в таблице замыкания: {referral_graph.rebuild()}")
+        if options['clusters']:
+            for cluster in referral_graph.find_clusters():
+                self.stdout.write(
+                    f"Пользователь {cluster['user_id']}: {cluster['size']} аккаунтов, пригласил {cluster['fanout']}, "
+                    f"малоактивных {cluster['low_activity_share']:.0%}"
+                )
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from move_on import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает суточные сводки для навигации по датам в админке. "
+        "После развёртывания запускается с --days, покрывающим всю историю."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ROLLUP_REFRESH_DAYS,
+                            help="За сколько последних дней, включая сегодняшний")
+
+    def handle(self, *args, **options):
+        written = rollups.refresh(options['days'])
+        self.stdout.write(f"Записано сводок: {written}")
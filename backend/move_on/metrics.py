@@ -0,0 +1,209 @@
+import threading
+import time
+from bisect import bisect_left
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis, mark_redis_down
+
+REDIS_KEY = "metrics:v1"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса.
+
+    Все значения хранятся как плоские счётчики {(имя, метки): значение}: гистограмма
+    раскладывается на счётчики корзин, _sum и _count. Поэтому агрегация между процессами
+    сводится к сложению: каждый процесс раз в METRICS_FLUSH_INTERVAL секунд отправляет
+    накопленные приращения в общий хэш Redis, а /metrics читает этот хэш.
+    Если Redis недоступен, /metrics отдаёт метрики текущего процесса.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._pending = {}
+        self._unsent = {}
+        self._descriptions = {}
+        self._histogram_keys = {}
+        self._next_flush = 0.0
+
+    def describe(self, name, metric_type, help_text):
+        self._descriptions[name] = (metric_type, help_text)
+
+    def inc(self, name, value=1, labels=()):
+        self.add([((name, labels), value)])
+
+    def observe(self, name, value, labels=(), buckets=DURATION_BUCKETS):
+        self.add(self.observation(name, value, labels, buckets))
+
+    def observation(self, name, value, labels=(), buckets=DURATION_BUCKETS):
+        """
+        Возвращает приращения счётчиков для одного наблюдения гистограммы.
+        Ключи кэшируются, чтобы горячий путь не собирал кортежи меток заново.
+        """
+        keys = self._histogram_keys.get((name, labels))
+        if keys is None:
+            bucket_keys = tuple(
+                (f"{name}_bucket", labels + (("le", str(bound)),)) for bound in buckets
+            ) + ((f"{name}_bucket", labels + (("le", "+Inf"),)),)
+            keys = (bucket_keys, (f"{name}_sum", labels), (f"{name}_count", labels))
+            self._histogram_keys[(name, labels)] = keys
+        bucket_keys, sum_key, count_key = keys
+        return [(bucket_keys[bisect_left(buckets, value)], 1), (sum_key, value), (count_key, 1)]
+
+    def add(self, items):
+        """
+        Применяет пачку приращений [((имя, метки), значение), ...] под одной блокировкой.
+        """
+        with self._lock:
+            pending = self._pending
+            for key, value in items:
+                pending[key] = pending.get(key, 0) + value
+
+    def maybe_flush(self):
+        """
+        Отправляет приращения в Redis, если с прошлой отправки прошло METRICS_FLUSH_INTERVAL секунд.
+        """
+        if time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Переносит накопленные приращения в локальные итоги и отправляет их в Redis.
+        Возвращает True, если общий хэш в Redis актуален.
+        """
+        self._next_flush = time.monotonic() + settings.METRICS_FLUSH_INTERVAL
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for key, value in pending.items():
+                self._totals[key] = self._totals.get(key, 0) + value
+            unsent = self._unsent
+            for key, value in pending.items():
+                unsent[key] = unsent.get(key, 0) + value
+            self._unsent = {}
+        client = get_redis()
+        if client is None:
+            self._requeue(unsent)
+            return False
+        if not unsent:
+            return True
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, value in unsent.items():
+                pipe.hincrbyfloat(REDIS_KEY, _encode_key(key), value)
+            pipe.execute()
+            return True
+        except redis.RedisError as e:
+            mark_redis_down(e)
+            self._requeue(unsent)
+            return False
+
+    def _requeue(self, unsent):
+        with self._lock:
+            for key, value in unsent.items():
+                self._unsent[key] = self._unsent.get(key, 0) + value
+
+    def snapshot(self):
+        """
+        Возвращает агрегированные по всем процессам значения (или значения процесса без Redis).
+        """
+        if self.flush():
+            try:
+                raw = get_redis().hgetall(REDIS_KEY)
+                return {_decode_key(k.decode()): float(v) for k, v in raw.items()}
+            except (redis.RedisError, AttributeError) as e:
+                mark_redis_down(e)
+        with self._lock:
+            return dict(self._totals)
+
+    def render(self):
+        """
+        Формирует ответ в текстовом формате Prometheus.
+        """
+        grouped = {}
+        for (name, labels), value in self.snapshot().items():
+            grouped.setdefault(_family(name), []).append((name, labels, value))
+
+        lines = []
+        for family in sorted(grouped):
+            if family in self._descriptions:
+                metric_type, help_text = self._descriptions[family]
+                lines.append(f"# HELP {family} {help_text}")
+                lines.append(f"# TYPE {family} {metric_type}")
+            samples = grouped[family]
+            if self._descriptions.get(family, ("",))[0] == "histogram":
+                samples = _cumulative_buckets(samples)
+            for name, labels, value in sorted(samples, key=_sample_order):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _family(name):
+    for suffix in ("_bucket", "_sum", "_count"):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def _cumulative_buckets(samples):
+    result = []
+    series = {}
+    for name, labels, value in samples:
+        if name.endswith("_bucket"):
+            le = dict(labels)["le"]
+            base = tuple(item for item in labels if item[0] != "le")
+            series.setdefault((name, base), {})[le] = value
+        else:
+            result.append((name, labels, value))
+    for (name, base), counts in series.items():
+        counts.setdefault("+Inf", 0)
+        running = 0
+        for bound in sorted(counts, key=float):
+            running += counts[bound]
+            result.append((name, base + (("le", bound),), running))
+    return result
+
+
+def _sample_order(sample):
+    name, labels, _ = sample
+    le = dict(labels).get("le")
+    return name, tuple(item for item in labels if item[0] != "le"), float(le) if le else 0
+
+
+def _encode_key(key):
+    name, labels = key
+    return name + "|" + ",".join(f"{k}={v}" for k, v in labels)
+
+
+def _decode_key(field):
+    name, _, raw_labels = field.partition("|")
+    labels = tuple(tuple(item.split("=", 1)) for item in raw_labels.split(",") if item)
+    return name, labels
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+registry = MetricsRegistry()
+
+registry.describe("move_on_http_requests_total", "counter", "Количество HTTP-запросов.")
+registry.describe("move_on_http_request_duration_seconds", "histogram", "Время обработки HTTP-запроса.")
+registry.describe("move_on_http_errors_total", "counter", "Количество ответов 5xx и необработанных исключений.")
+registry.describe("move_on_db_queries_total", "counter", "Количество SQL-запросов, выполненных во время HTTP-запросов.")
+registry.describe("move_on_db_query_seconds_total", "counter", "Суммарное время SQL-запросов во время HTTP-запросов.")
@@ -0,0 +1,126 @@
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import db_router
+from .metrics import registry
+
+_query_stats = ContextVar("query_stats", default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Обёртка выполнения SQL, которая накапливает число и время запросов текущего HTTP-запроса.
+    Устанавливается один раз на каждое соединение с БД (см. install_query_counter).
+    """
+    stats = _query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    query_start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - query_start
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """
+    Обработчик сигнала connection_created.
+    """
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+class MetricsMiddleware:
+    """
+    Собирает по каждому маршруту время ответа, число и время SQL-запросов и количество ошибок.
+
+    Маршрут берётся из шаблона URL (resolver_match.route), а не из пути запроса,
+    чтобы число меток не зависело от telegram_id и других параметров.
+    Поддерживает и синхронную, и асинхронную цепочку, чтобы под ASGI не переключать поток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = [0, 0.0]
+        token = _query_stats.set(stats)
+        start = time.perf_counter()
+        status_class = "5xx"
+        try:
+            response = self.get_response(request)
+            status_class = f"{response.status_code // 100}xx"
+            return response
+        finally:
+            _query_stats.reset(token)
+            self.record(request, time.perf_counter() - start, stats, status_class)
+
+    async def __acall__(self, request):
+        stats = [0, 0.0]
+        token = _query_stats.set(stats)
+        start = time.perf_counter()
+        status_class = "5xx"
+        try:
+            response = await self.get_response(request)
+            status_class = f"{response.status_code // 100}xx"
+            return response
+        finally:
+            _query_stats.reset(token)
+            self.record(request, time.perf_counter() - start, stats, status_class)
+
+    def record(self, request, duration, stats, status_class):
+        match = request.resolver_match
+        route = match.route if match and match.route else "unmatched"
+        labels = (("route", route), ("method", request.method))
+        items = registry.observation("move_on_http_request_duration_seconds", duration, labels)
+        items.append((("move_on_http_requests_total", labels + (("status", status_class),)), 1))
+        if stats[0]:
+            items.append((("move_on_db_queries_total", labels), stats[0]))
+            items.append((("move_on_db_query_seconds_total", labels), stats[1]))
+        if status_class == "5xx":
+            items.append((("move_on_http_errors_total", labels), 1))
+        registry.add(items)
+        registry.maybe_flush()
+
+
+class ReplicaPinMiddleware:
+    """
+    Read-your-writes для чтения с реплик: запросы клиента, который недавно что-то записал,
+    читают из основной базы (см. db_router).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = db_router.begin_request(request)
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            db_router.finish_request(token, response)
+        return response
+
+    async def __acall__(self, request):
+        token = db_router.begin_request(request)
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            db_router.finish_request(token, response)
+        return response
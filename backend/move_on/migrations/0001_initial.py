@@ -0,0 +1,159 @@
+# Generated by Django 5.1.3 on 2026-10-19 06:36
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GlobalStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_steps', models.IntegerField(default=0)),
+                ('total_distance', models.FloatField(default=0)),
+                ('total_rewards', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Название задания', max_length=255)),
+                ('description', models.TextField(blank=True, help_text='Описание задания', null=True)),
+                ('reward', models.FloatField(default=0, help_text='Награда за выполнение задания')),
+                ('difficulty', models.IntegerField(default=1, help_text='Сложность задания (1-легко, 3-сложно)')),
+                ('task_type', models.CharField(choices=[('daily', 'Ежедневное'), ('challenge', 'Челлендж')], default='daily', help_text='Тип задания (ежедневное, челлендж)', max_length=20)),
+                ('start_date', models.DateField(blank=True, help_text='Дата начала действия задания', null=True)),
+                ('end_date', models.DateField(blank=True, help_text='Дата окончания действия задания', null=True)),
+                ('is_active', models.BooleanField(default=True, help_text='Активно ли задание')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Дата создания задания')),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='Дата последнего обновления')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telegram_id', models.BigIntegerField(unique=True)),
+                ('username', models.CharField(blank=True, max_length=255, null=True)),
+                ('first_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('energy', models.IntegerField(default=100)),
+                ('max_energy', models.IntegerField(default=100)),
+                ('last_energy_update', models.DateTimeField(auto_now_add=True)),
+                ('points', models.FloatField(default=0)),
+                ('endurance_level', models.IntegerField(default=0)),
+                ('efficiency_level', models.IntegerField(default=0)),
+                ('luck_level', models.IntegerField(default=0)),
+                ('upgrade_points', models.IntegerField(default=0)),
+                ('max_daily_streak', models.IntegerField(default=0, help_text='Максимальный достигнутый ежедневный стрик.')),
+                ('daily_streak', models.IntegerField(default=0)),
+                ('last_login_date', models.DateField(blank=True, null=True)),
+                ('referral_bonus_percentage', models.FloatField(default=10)),
+                ('is_scam', models.BooleanField(default=False)),
+                ('is_fake', models.BooleanField(default=False)),
+                ('is_active', models.BooleanField(default=True, help_text='Статус активности пользователя.')),
+                ('ton_wallet', models.CharField(blank=True, max_length=255, null=True)),
+                ('referral_uuid', models.UUIDField(default=uuid.uuid4, editable=False, help_text='Уникальный идентификатор для реферальной программы', unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Statistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_steps', models.IntegerField(default=0)),
+                ('total_distance', models.FloatField(default=0)),
+                ('total_rewards', models.FloatField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='move_on.user')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Referral',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reward_percentage', models.FloatField(default=5)),
+                ('total_rewards', models.FloatField(default=0)),
+                ('total_invited', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('invited_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invited_users', to='move_on.user')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='referral', to='move_on.user')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Donation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stars_bought', models.IntegerField()),
+                ('amount_paid', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='donations', to='move_on.user')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyBonus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('streak', models.IntegerField(default=0)),
+                ('max_streak', models.IntegerField(default=0)),
+                ('last_claim_date', models.DateField(blank=True, null=True)),
+                ('claimed_days', models.JSONField(default=dict)),
+                ('streak_rewards', models.JSONField(default=dict)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='daily_bonus', to='move_on.user')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnomalyLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='move_on.user')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Walk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField(blank=True, null=True)),
+                ('steps', models.IntegerField(default=0)),
+                ('distance', models.FloatField(default=0)),
+                ('avg_speed', models.FloatField(default=0)),
+                ('reward', models.FloatField(default=0)),
+                ('is_lucky_walk', models.BooleanField(default=False)),
+                ('is_valid', models.BooleanField(default=True)),
+                ('efficiency_multiplier', models.FloatField(default=1.0)),
+                ('bonus_streak', models.FloatField(default=1.0)),
+                ('is_interrupted', models.BooleanField(default=False, help_text='Указывает, была ли прогулка прервана пользователем до её завершения.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='walks', to='move_on.user')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WalkSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_time', models.DateTimeField(auto_now_add=True)),
+                ('steps', models.IntegerField(default=0)),
+                ('distance', models.FloatField(default=0.0)),
+                ('avg_speed', models.FloatField(default=0.0)),
+                ('last_step_time', models.DateTimeField(blank=True, null=True)),
+                ('last_latitude', models.FloatField(blank=True, null=True)),
+                ('last_longitude', models.FloatField(blank=True, null=True)),
+                ('data_window', models.JSONField(default=list)),
+                ('pattern', models.CharField(default='неопределен', max_length=50)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='walk_sessions', to='move_on.user')),
+            ],
+        ),
+    ]
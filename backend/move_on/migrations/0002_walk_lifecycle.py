@@ -0,0 +1,56 @@
+# Generated by Django 5.1.3 on 2026-10-19 06:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('move_on', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='walk',
+            name='finalized_steps',
+            field=models.JSONField(blank=True, default=list, help_text='Выполненные шаги фоновой обработки (см. walk_pipeline).'),
+        ),
+        migrations.AddField(
+            model_name='walksession',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, help_text='Время завершения; после него сессия не обновляется.', null=True),
+        ),
+        migrations.AddField(
+            model_name='walksession',
+            name='is_interrupted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='walksession',
+            name='reward',
+            field=models.FloatField(blank=True, help_text='Награда, зафиксированная при завершении.', null=True),
+        ),
+        migrations.AddField(
+            model_name='walksession',
+            name='walk',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='session', to='move_on.walk'),
+        ),
+        migrations.CreateModel(
+            name='OfflineWalkSubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.CharField(max_length=64)),
+                ('payload', models.BinaryField()),
+                ('status', models.CharField(choices=[('pending', 'Ожидает обработки'), ('done', 'Обработана'), ('failed', 'Ошибка')], default='pending', max_length=16)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='offline_walks', to='move_on.user')),
+                ('walk', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='offline_submission', to='move_on.walk')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'idempotency_key'), name='unique_offline_walk_key')],
+            },
+        ),
+    ]
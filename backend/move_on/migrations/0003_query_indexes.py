@@ -0,0 +1,45 @@
+# Generated by Django 5.1.3 on 2026-10-19 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('move_on', '0002_walk_lifecycle'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='anomalylog',
+            index=models.Index(fields=['user', '-created_at'], name='anomaly_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offlinewalksubmission',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['created_at'], name='offline_walk_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['task_type'], name='task_active_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-points'], name='user_points_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walk',
+            index=models.Index(fields=['user', '-start_time'], name='walk_user_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walk',
+            index=models.Index(condition=models.Q(('is_interrupted', True)), fields=['user'], name='walk_user_interrupted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walksession',
+            index=models.Index(condition=models.Q(('finished_at__isnull', True)), fields=['last_step_time'], name='walksession_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walksession',
+            index=models.Index(condition=models.Q(('finished_at__isnull', False)), fields=['finished_at'], name='walksession_finished_idx'),
+        ),
+    ]
@@ -0,0 +1,121 @@
+# Перевод move_on_walk и move_on_anomalylog в таблицы, секционированные по месяцам created_at
+# (только PostgreSQL, на других СУБД таблицы не меняются). Обслуживание секций — move_on/partitions.py.
+#
+# Таблица пересоздаётся: данные копируются в новую секционированную таблицу, затем на ней заново
+# создаются индексы и внешние ключи с прежними именами. Первичный ключ становится (id, created_at):
+# уникальный ключ секционированной таблицы обязан включать ключ секционирования. Поэтому внешние ключи
+# на прогулку сначала переводятся в db_constraint=False. Кроме месячных секций создаётся секция
+# по умолчанию: без неё вставка падает, если секция текущего месяца не была создана заранее.
+
+from datetime import date
+
+from django.db import migrations, models
+from django.utils.timezone import now
+import django.db.models.deletion
+
+TABLES = ('move_on_walk', 'move_on_anomalylog')
+COLUMN = 'created_at'
+MONTHS_AHEAD = 3
+
+
+def _add_months(month, count):
+    years, index = divmod(month.month - 1 + count, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def _rebuild(cursor, table, partitioned):
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname != %s",
+        [table, f"{table}_pkey"],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table],
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute(
+        "SELECT pg_get_serial_sequence(%s, 'id'), attidentity FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'",
+        [table, table],
+    )
+    sequence, identity = cursor.fetchone()
+
+    old = f"{table}_old"
+    cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{old}"')
+    if partitioned:
+        cursor.execute(
+            f'CREATE TABLE "{table}" (LIKE "{old}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE ({COLUMN})'
+        )
+        cursor.execute(f'SELECT min({COLUMN}) FROM "{old}"')
+        first = cursor.fetchone()[0] or now()
+        current = now()
+        month = date(first.year, first.month, 1)
+        last = _add_months(date(current.year, current.month, 1), MONTHS_AHEAD)
+        while month <= last:
+            cursor.execute(
+                f'CREATE TABLE "{table}_p{month:%Y_%m}" PARTITION OF "{table}" '
+                f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{_add_months(month, 1):%Y-%m-%d} 00:00:00+00')"
+            )
+            month = _add_months(month, 1)
+        # Строки вне месячных секций (если задача обслуживания не создала секцию вовремя)
+        cursor.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+    else:
+        cursor.execute(f'CREATE TABLE "{table}" (LIKE "{old}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{old}"')
+
+    # id: у таблицы, созданной Django, это identity-колонка. В секционированной таблице identity появилась
+    # только в PostgreSQL 17, поэтому используется обычная последовательность, принадлежащая колонке.
+    cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN id DROP DEFAULT')
+    if sequence and not identity:
+        # Последовательность принадлежит старой таблице: отвязываем, чтобы она пережила DROP TABLE
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    # Вместе со старой таблицей удаляются её индексы и ограничения, их имена освобождаются
+    cursor.execute(f'DROP TABLE "{old}"')
+    cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS "{table}_id_seq"')
+    cursor.execute(f'ALTER SEQUENCE "{table}_id_seq" OWNED BY "{table}".id')
+    cursor.execute(f"ALTER TABLE \"{table}\" ALTER COLUMN id SET DEFAULT nextval('\"{table}_id_seq\"')")
+    cursor.execute(f"SELECT setval('\"{table}_id_seq\"', COALESCE((SELECT max(id) FROM \"{table}\"), 0) + 1, false)")
+
+    primary_key = f"(id, {COLUMN})" if partitioned else "(id)"
+    cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" PRIMARY KEY {primary_key}')
+    for indexdef in indexes:
+        cursor.execute(indexdef)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            _rebuild(cursor, table, partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            _rebuild(cursor, table, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('move_on', '0003_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='offlinewalksubmission',
+            name='walk',
+            field=models.OneToOneField(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='offline_submission', to='move_on.walk'),
+        ),
+        migrations.AlterField(
+            model_name='walksession',
+            name='walk',
+            field=models.OneToOneField(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='session', to='move_on.walk'),
+        ),
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,76 @@
+# Индексы для списков админки на больших таблицах и суточные сводки для навигации по датам.
+#
+# В PostgreSQL индекс на move_on_user и триграммные индексы для поиска создаются CONCURRENTLY,
+# чтобы не блокировать запись в таблицу на время построения (поэтому миграция не атомарная).
+# move_on_walk секционирована, для неё CONCURRENTLY не поддерживается.
+# Триграммные индексы построены по UPPER(поле): так Django строит фильтр icontains в PostgreSQL.
+# В модели их нет — на других СУБД такого индекса не существует.
+
+from django.db import migrations, models
+
+TRGM_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def _add_index(model_name, index, concurrently):
+    def forwards(apps, schema_editor):
+        model = apps.get_model('move_on', model_name)
+        if concurrently and schema_editor.connection.vendor == 'postgresql':
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
+
+    def backwards(apps, schema_editor):
+        schema_editor.remove_index(apps.get_model('move_on', model_name), index)
+
+    return migrations.SeparateDatabaseAndState(
+        state_operations=[migrations.AddIndex(model_name=model_name, index=index)],
+        database_operations=[migrations.RunPython(forwards, backwards)],
+    )
+
+
+def add_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for field in TRGM_FIELDS:
+            cursor.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "user_{field}_trgm_idx" '
+                f'ON "move_on_user" USING gin (UPPER("{field}") gin_trgm_ops)'
+            )
+
+
+def remove_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for field in TRGM_FIELDS:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "user_{field}_trgm_idx"')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('move_on', '0004_partition_walk_anomalylog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(help_text='Имя модели (model_name), например walk или user.', max_length=64)),
+                ('day', models.DateField()),
+                ('rows', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('table', 'day'), name='unique_daily_rollup')],
+            },
+        ),
+        _add_index('user', models.Index(fields=['-created_at'], name='user_created_idx'), concurrently=True),
+        _add_index('walk', models.Index(fields=['-created_at'], name='walk_created_idx'), concurrently=False),
+        migrations.RunPython(add_trigram_indexes, remove_trigram_indexes),
+    ]
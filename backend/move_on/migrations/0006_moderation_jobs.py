@@ -0,0 +1,40 @@
+# Generated by Django 5.1.3 on 2026-10-19 06:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('move_on', '0005_admin_scaling'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='referral',
+            name='is_revoked',
+            field=models.BooleanField(default=False, help_text='Отозван модерацией: бонус пригласившему вычтен и больше не начисляется.'),
+        ),
+        migrations.CreateModel(
+            name='ModerationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('scam', 'Скам: заблокировать и отозвать награды'), ('fake', 'Фейк: заблокировать и отозвать награды'), ('deactivate', 'Заблокировать'), ('reactivate', 'Снять отметки и разблокировать')], max_length=16)),
+                ('user_ids', models.JSONField(default=list)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Выполнено'), ('failed', 'Ошибка')], default='pending', max_length=16)),
+                ('total', models.IntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('walks_voided', models.IntegerField(default=0)),
+                ('points_revoked', models.FloatField(default=0)),
+                ('referrals_revoked', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.3 on 2026-10-19 06:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('move_on', '0006_moderation_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='referral_descendants', to='move_on.user')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='referral_ancestors', to='move_on.user')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_referral_closure')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-19 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('move_on', '0007_referral_closure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationCampaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('segment', models.CharField(choices=[('all', 'Все активные пользователи'), ('streak_reminder', 'Стрик под угрозой: не заходили сегодня'), ('leaderboard', 'Топ-100 рейтинга')], max_length=32)),
+                ('text', models.TextField()),
+                ('status', models.CharField(choices=[('draft', 'Черновик'), ('pending', 'В очереди'), ('running', 'Отправляется'), ('paused', 'Приостановлена'), ('done', 'Завершена')], default='draft', max_length=16)),
+                ('cursor', models.BigIntegerField(default=0)),
+                ('sent', models.IntegerField(default=0)),
+                ('blocked', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('rate_limited', models.IntegerField(default=0)),
+                ('send_seconds', models.FloatField(default=0, help_text='Время отправки без пауз между запусками, секунд.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.3 on 2026-10-19 07:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('move_on', '0008_notification_campaigns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='metric',
+            field=models.CharField(blank=True, choices=[('steps', 'Шаги'), ('distance', 'Дистанция, км'), ('walks', 'Прогулки'), ('streak', 'Ежедневный стрик, дней')], default='', help_text='Показатель прогулок, по которому задание выполняется автоматически (пусто — выполняется по запросу)', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='target',
+            field=models.FloatField(default=0, help_text='Значение показателя, при котором задание выполнено'),
+        ),
+        migrations.CreateModel(
+            name='TaskProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('value', models.FloatField(default=0)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='move_on.task')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='task_progress', to='move_on.user')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'task', 'period'), name='unique_task_progress')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.3 on 2026-10-19 07:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('move_on', '0009_task_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChallengeResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.IntegerField()),
+                ('score', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='leaderboard_frozen_at',
+            field=models.DateTimeField(blank=True, help_text='Когда рейтинг завершённого челленджа зафиксирован в ChallengeResult', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='taskprogress',
+            index=models.Index(fields=['task', 'period', '-value'], name='task_progress_rank_idx'),
+        ),
+        migrations.AddField(
+            model_name='challengeresult',
+            name='task',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='results', to='move_on.task'),
+        ),
+        migrations.AddField(
+            model_name='challengeresult',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='challenge_results', to='move_on.user'),
+        ),
+        migrations.AddIndex(
+            model_name='challengeresult',
+            index=models.Index(fields=['task', 'rank'], name='challenge_result_rank_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='challengeresult',
+            constraint=models.UniqueConstraint(fields=('task', 'user'), name='unique_challenge_result'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.3 on 2026-10-19 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('move_on', '0010_challenge_leaderboards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offlinewalksubmission',
+            name='samples_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='offlinewalksubmission',
+            constraint=models.UniqueConstraint(fields=('user', 'samples_hash'), name='unique_offline_walk_samples'),
+        ),
+    ]
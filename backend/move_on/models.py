@@ -1,8 +1,13 @@
 import uuid
 from datetime import timedelta
-from django.db import models
-from django.db.models import Sum
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Q, Sum
 from django.utils.timezone import now
+from . import counters
+
+ENERGY_RESTORE_SECONDS = 60 * 12
 
 
 class User(models.Model):
@@ -71,24 +76,71 @@ class User(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Рейтинг пользователей по очкам (global_statistics)
+            models.Index(fields=['-points'], name='user_points_idx'),
+            # Список пользователей в админке, новые первыми; пересчёт суточных сводок (rollups)
+            models.Index(fields=['-created_at'], name='user_created_idx'),
+        ]
+        # Поиск в админке по username, first_name и last_name обслуживают триграммные индексы
+        # user_*_trgm_idx (миграция 0004, только PostgreSQL)
+
     def __str__(self):
         return f"User {self.telegram_id} ({self.username or 'No username'})"
 
-    def update_energy(self):
+    def save(self, *args, **kwargs):
+        # Счётчики с приращениями из буфера (counters.overlay) пишет только буфер, иначе они учтутся дважды.
+        if getattr(self, '_counters_overlaid', False) and kwargs.get('update_fields') is None and not self._state.adding:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in counters.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    def restore_energy(self):
         """
-        Обновляет текущую энергию пользователя на основе времени последнего обновления.
+        Восстанавливает энергию в памяти на основе времени последнего обновления.
+        Возвращает True, если поля изменились и их нужно сохранить.
         """
         now_time = now()
         elapsed_time = now_time - self.last_energy_update
 
-        if elapsed_time.total_seconds() < 60 * 12:
-            return
+        if elapsed_time.total_seconds() < ENERGY_RESTORE_SECONDS:
+            return False
 
-        restored_energy = int(elapsed_time.total_seconds() // (60 * 12))
+        restored_energy = int(elapsed_time.total_seconds() // ENERGY_RESTORE_SECONDS)
         if restored_energy > 0:
             self.energy = min(100, self.energy + restored_energy)
             self.last_energy_update = now_time
-            self.save()
+            return True
+        return False
+
+    def energy_restore_due(self):
+        """
+        Прошёл ли период восстановления энергии по загруженному времени последнего обновления.
+        Если нет, то и в буфере счётчиков нет более позднего восстановления, и обращаться к нему не нужно.
+        """
+        return (now() - self.last_energy_update).total_seconds() >= ENERGY_RESTORE_SECONDS
+
+    def update_energy(self):
+        """
+        Обновляет текущую энергию пользователя на основе времени последнего обновления.
+        Изменения записываются через буфер счётчиков (см. counters).
+        """
+        if not self.energy_restore_due():
+            return
+        counters.overlay(self)
+        energy = self.energy
+        if self.restore_energy():
+            counters.add(self.pk, energy=self.energy - energy, last_energy_update=self.last_energy_update)
+
+    async def aupdate_energy(self):
+        """
+        Асинхронный вариант update_energy.
+        """
+        if self.energy_restore_due():
+            await sync_to_async(self.update_energy)()
 
     @property
     def referral_count(self):
@@ -117,7 +169,7 @@ class Walk(models.Model):
         - is_interrupted: Указывает, была ли прогулка прервана.
 
         Системные данные:
-        - created_at: Дата создания записи о прогулке.
+        - created_at: Дата создания записи о прогулке (в PostgreSQL — ключ помесячных секций, см. partitions.py).
 
         Методы:
         - __str__: Возвращает строковое представление прогулки.
@@ -132,10 +184,21 @@ class Walk(models.Model):
     is_lucky_walk = models.BooleanField(default=False)
     is_valid = models.BooleanField(default=True)
     efficiency_multiplier = models.FloatField(default=1.0)
+    finalized_steps = models.JSONField(default=list, blank=True, help_text="Выполненные шаги фоновой обработки (см. walk_pipeline).")
     bonus_streak = models.FloatField(default=1.0)
     is_interrupted = models.BooleanField(default=False, help_text="Указывает, была ли прогулка прервана пользователем до её завершения.")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # История прогулок пользователя, новые первыми (walk_history)
+            models.Index(fields=['user', '-start_time'], name='walk_user_start_idx'),
+            # Прерванные прогулки пользователя (check_unfinished): в индексе только прерванные
+            models.Index(fields=['user'], condition=Q(is_interrupted=True), name='walk_user_interrupted_idx'),
+            # Список прогулок в админке, новые первыми; пересчёт суточных сводок (rollups)
+            models.Index(fields=['-created_at'], name='walk_created_idx'),
+        ]
+
     def __str__(self):
         return f"Walk {self.id} - User {self.user.telegram_id}"
 
@@ -154,13 +217,15 @@ class DailyBonus(models.Model):
     def __str__(self):
         return f"DailyBonus - User {self.user.telegram_id} - Streak {self.streak}"
 
-    def process_daily_bonus(self):
+    def process_daily_bonus(self, bonus=0.05 * 100):
         """
-        Начисляет ежедневный бонус и обновляет стрик.
+        Начисляет ежедневный бонус и обновляет стрик. Вызывается в транзакции с заблокированной строкой бонуса:
+        очки попадают в буфер счётчиков только после фиксации записи о полученном дне.
+        :return: Начисленный бонус или None, если бонус за сегодня уже получен.
         """
         today = now().date()
-        if self.last_claim_date == today:
-            return
+        if self.last_claim_date == today or str(today) in self.claimed_days:
+            return None
 
         if self.last_claim_date == today - timedelta(days=1):
             self.streak += 1
@@ -169,12 +234,10 @@ class DailyBonus(models.Model):
 
         self.max_streak = max(self.max_streak, self.streak)
         self.last_claim_date = today
-
-        bonus = 0.05 * 100
-        self.user.points += bonus
         self.claimed_days[str(today)] = {"coinsEarned": bonus, "bonusReceived": True}
-        self.user.save()
         self.save()
+        transaction.on_commit(lambda: counters.add(self.user_id, points=bonus))
+        return bonus
 
     def process_streak_reward(self):
         """
@@ -186,7 +249,7 @@ class DailyBonus(models.Model):
             if self.streak >= milestone and str(milestone) not in rewards:
                 self.user.upgrade_points += 1
                 rewards[str(milestone)] = True
-                self.user.save()
+                self.user.save(update_fields=['upgrade_points'])
         self.streak_rewards = rewards
         self.save()
 
@@ -212,6 +275,7 @@ class Referral(models.Model):
     - reward_percentage: Процент награды для пользователя за приглашённого реферала (по умолчанию 5%).
     - total_rewards: Общая сумма наград, полученных за рефералов.
     - total_invited: Общее количество приглашённых пользователей.
+    - is_revoked: Реферал отозван модерацией (см. moderation.py).
 
     Методы:
     - __str__: Возвращает строковое представление реферала в формате:
@@ -222,6 +286,7 @@ class Referral(models.Model):
     reward_percentage = models.FloatField(default=5)
     total_rewards = models.FloatField(default=0)
     total_invited = models.IntegerField(default=0)
+    is_revoked = models.BooleanField(default=False, help_text="Отозван модерацией: бонус пригласившему вычтен и больше не начисляется.")
     created_at = models.DateTimeField(auto_now_add=True)
 
 
@@ -229,6 +294,27 @@ class Referral(models.Model):
         return f"Referral - User {self.user.telegram_id} invited by {self.invited_by.telegram_id if self.invited_by else ''}"
 
 
+class ReferralClosure(models.Model):
+    """
+    Таблица замыкания реферального графа: строка на каждую пару (предок, потомок) в дереве приглашений.
+    Позволяет одним запросом по индексу получить размер сети пользователя и её разбивку по уровням
+    (см. referral_graph.py).
+
+    Поля:
+    - ancestor: Пользователь, от которого ведётся цепочка приглашений.
+    - descendant: Пользователь в его сети.
+    - depth: Уровень: 1 — приглашён напрямую, 2 — приглашён приглашённым и т. д.
+    """
+    # Индекс по ancestor не нужен: его покрывает уникальное ограничение (ancestor, descendant)
+    ancestor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="referral_descendants", db_index=False)
+    descendant = models.ForeignKey(User, on_delete=models.CASCADE, related_name="referral_ancestors")
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='unique_referral_closure'),
+        ]
+
 
 class Task(models.Model):
     """
@@ -238,6 +324,12 @@ class Task(models.Model):
         ('daily', 'Ежедневное'),
         ('challenge', 'Челлендж'),
     ]
+    METRIC_CHOICES = [
+        ('steps', 'Шаги'),
+        ('distance', 'Дистанция, км'),
+        ('walks', 'Прогулки'),
+        ('streak', 'Ежедневный стрик, дней'),
+    ]
 
     name = models.CharField(max_length=255, help_text="Название задания")
     description = models.TextField(null=True, blank=True, help_text="Описание задания")
@@ -252,9 +344,26 @@ class Task(models.Model):
     start_date = models.DateField(null=True, blank=True, help_text="Дата начала действия задания")
     end_date = models.DateField(null=True, blank=True, help_text="Дата окончания действия задания")
     is_active = models.BooleanField(default=True, help_text="Активно ли задание")
+    metric = models.CharField(
+        max_length=16,
+        choices=METRIC_CHOICES,
+        blank=True,
+        default='',
+        help_text="Показатель прогулок, по которому задание выполняется автоматически (пусто — выполняется по запросу)"
+    )
+    target = models.FloatField(default=0, help_text="Значение показателя, при котором задание выполнено")
+    leaderboard_frozen_at = models.DateTimeField(
+        null=True, blank=True, help_text="Когда рейтинг завершённого челленджа зафиксирован в ChallengeResult"
+    )
     created_at = models.DateTimeField(auto_now_add=True, help_text="Дата создания задания")
     updated_at = models.DateTimeField(auto_now=True, help_text="Дата последнего обновления")
 
+    class Meta:
+        indexes = [
+            # Активные задания, в том числе по типу (get_tasks)
+            models.Index(fields=['task_type'], condition=Q(is_active=True), name='task_active_type_idx'),
+        ]
+
     def __str__(self):
         return f"Task {self.name} - Type: {self.task_type}"
 
@@ -270,6 +379,65 @@ class Task(models.Model):
         )
 
 
+class TaskProgress(models.Model):
+    """
+    Прогресс пользователя по заданию за период (см. task_progress.py).
+
+    Поля:
+    - period: Для ежедневных заданий — день, для челленджей — дата начала задания.
+    - value: Накопленное значение показателя задания.
+    - completed_at: Когда значение достигло цели (для заданий без показателя — когда получена награда).
+    - claimed_at: Когда начислена награда.
+    """
+    # Индекс по user не нужен: его покрывает уникальное ограничение (user, task, period)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="task_progress", db_index=False)
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name="progress")
+    period = models.DateField()
+    value = models.FloatField(default=0)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'task', 'period'], name='unique_task_progress'),
+        ]
+        indexes = [
+            # Рейтинг челленджа без Redis и его снимок по завершении (challenges.py)
+            models.Index(fields=['task', 'period', '-value'], name='task_progress_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"TaskProgress {self.user_id} {self.task_id} {self.period}: {self.value}"
+
+
+class ChallengeResult(models.Model):
+    """
+    Итоговое место пользователя в завершённом челлендже: неизменяемый снимок рейтинга (см. challenges.py).
+
+    Поля:
+    - rank: Место; у равных результатов одно место, следующее место пропускается (1, 2, 2, 4).
+    - score: Значение показателя челленджа на момент завершения.
+    """
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name="results", db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="challenge_results")
+    rank = models.IntegerField()
+    score = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'user'], name='unique_challenge_result'),
+        ]
+        indexes = [
+            # Топ завершённого челленджа
+            models.Index(fields=['task', 'rank'], name='challenge_result_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"ChallengeResult {self.task_id} {self.user_id}: #{self.rank} ({self.score})"
+
+
 class Statistics(models.Model):
     """
     Модель статистики пользователя, отслеживающая общие показатели его активности.
@@ -293,6 +461,54 @@ class Statistics(models.Model):
         return f"Statistics - User {self.user.telegram_id}"
 
 
+class OfflineWalkSubmission(models.Model):
+    """
+    Прогулка, записанная на устройстве без связи и отправленная целиком одним запросом.
+
+    Поля:
+    - user: Пользователь, отправивший прогулку.
+    - idempotency_key: Ключ, сгенерированный клиентом; повторная отправка с тем же ключом не создаёт новую прогулку.
+    - samples_hash: SHA-256 замеров, считается сервером; те же замеры с другим ключом тоже не создают новую прогулку.
+    - payload: Данные датчиков и GPS (JSON, сжатый gzip).
+    - status: pending — ждёт обработки, done — прогулка создана, failed — данные не удалось обработать.
+    - walk: Созданная прогулка.
+    - error: Причина ошибки обработки.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает обработки'),
+        (STATUS_DONE, 'Обработана'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="offline_walks")
+    idempotency_key = models.CharField(max_length=64)
+    samples_hash = models.CharField(max_length=64, null=True, blank=True)
+    payload = models.BinaryField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # db_constraint=False: таблица прогулок секционирована, уникального ключа только по id в ней нет (см. partitions.py)
+    walk = models.OneToOneField(Walk, on_delete=models.SET_NULL, null=True, blank=True, related_name="offline_submission",
+                                db_constraint=False)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='unique_offline_walk_key'),
+            models.UniqueConstraint(fields=['user', 'samples_hash'], name='unique_offline_walk_samples'),
+        ]
+        indexes = [
+            # Давно ожидающие обработки (retry_pending_offline_walks)
+            models.Index(fields=['created_at'], condition=Q(status='pending'), name='offline_walk_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"OfflineWalkSubmission {self.idempotency_key} - User {self.user_id} ({self.status})"
+
+
 class WalkSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="walk_sessions")
     start_time = models.DateTimeField(auto_now_add=True)
@@ -304,6 +520,19 @@ class WalkSession(models.Model):
     last_longitude = models.FloatField(null=True, blank=True)
     data_window = models.JSONField(default=list)
     pattern = models.CharField(max_length=50, default="неопределен")
+    finished_at = models.DateTimeField(null=True, blank=True, help_text="Время завершения; после него сессия не обновляется.")
+    reward = models.FloatField(null=True, blank=True, help_text="Награда, зафиксированная при завершении.")
+    is_interrupted = models.BooleanField(default=False)
+    walk = models.OneToOneField('Walk', on_delete=models.SET_NULL, null=True, blank=True, related_name="session",
+                                db_constraint=False)
+
+    class Meta:
+        indexes = [
+            # Незавершённые сессии без обновлений (auto_complete_walks)
+            models.Index(fields=['last_step_time'], condition=Q(finished_at__isnull=True), name='walksession_active_idx'),
+            # Завершённые сессии, которые ещё не обработаны (resume_walk_finalization)
+            models.Index(fields=['finished_at'], condition=Q(finished_at__isnull=False), name='walksession_finished_idx'),
+        ]
 
     def __str__(self):
         return f"WalkSession {self.id} - User {self.user.telegram_id}"
@@ -314,6 +543,12 @@ class AnomalyLog(models.Model):
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Аномалии пользователя, новые первыми
+            models.Index(fields=['user', '-created_at'], name='anomaly_user_created_idx'),
+        ]
+
 
 class Donation(models.Model):
     """
@@ -343,3 +578,130 @@ class GlobalStatistics(models.Model):
     total_distance = models.FloatField(default=0)
     total_rewards = models.FloatField(default=0)
     updated_at = models.DateTimeField(auto_now=True)
+
+
+class DailyRollup(models.Model):
+    """
+    Сколько строк большой таблицы создано за день (по created_at в часовом поясе проекта).
+    По этим сводкам строится навигация по датам в админке, см. rollups.py.
+    """
+    table = models.CharField(max_length=64, help_text="Имя модели (model_name), например walk или user.")
+    day = models.DateField()
+    rows = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['table', 'day'], name='unique_daily_rollup'),
+        ]
+
+    def __str__(self):
+        return f"DailyRollup {self.table} {self.day}: {self.rows}"
+
+
+class ModerationJob(models.Model):
+    """
+    Массовая модерация пользователей, запущенная из админки и выполняемая в фоне (см. moderation.py).
+
+    Поля:
+    - action: Что сделать с пользователями (ACTION_CHOICES).
+    - user_ids: ID пользователей, выбранных при запуске.
+    - processed: Сколько первых ID из user_ids уже обработано; с этого места задание продолжается.
+    - walks_voided, points_revoked, referrals_revoked: Итоги отзыва наград.
+    """
+    ACTION_SCAM = 'scam'
+    ACTION_FAKE = 'fake'
+    ACTION_DEACTIVATE = 'deactivate'
+    ACTION_REACTIVATE = 'reactivate'
+    ACTION_CHOICES = [
+        (ACTION_SCAM, 'Скам: заблокировать и отозвать награды'),
+        (ACTION_FAKE, 'Фейк: заблокировать и отозвать награды'),
+        (ACTION_DEACTIVATE, 'Заблокировать'),
+        (ACTION_REACTIVATE, 'Снять отметки и разблокировать'),
+    ]
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнено'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    action = models.CharField(max_length=16, choices=ACTION_CHOICES)
+    user_ids = models.JSONField(default=list)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    walks_voided = models.IntegerField(default=0)
+    points_revoked = models.FloatField(default=0)
+    referrals_revoked = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"ModerationJob {self.pk} {self.action} ({self.processed}/{self.total}, {self.status})"
+
+
+class NotificationCampaign(models.Model):
+    """
+    Рассылка сообщения боту по сегменту пользователей (см. notifications.py).
+
+    Поля:
+    - segment: Кому отправлять (SEGMENT_CHOICES).
+    - text: Текст сообщения (HTML-разметка Telegram).
+    - cursor: Наибольший telegram_id, до которого рассылка уже дошла; с него она продолжается.
+    - sent, blocked, failed: Доставлено; бот заблокирован пользователем; не доставлено по другой причине.
+    - rate_limited: Сколько раз Telegram ответил 429.
+    """
+    SEGMENT_ALL = 'all'
+    SEGMENT_STREAK_REMINDER = 'streak_reminder'
+    SEGMENT_LEADERBOARD = 'leaderboard'
+    SEGMENT_CHOICES = [
+        (SEGMENT_ALL, 'Все активные пользователи'),
+        (SEGMENT_STREAK_REMINDER, 'Стрик под угрозой: не заходили сегодня'),
+        (SEGMENT_LEADERBOARD, 'Топ-100 рейтинга'),
+    ]
+    STATUS_DRAFT = 'draft'
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_PAUSED = 'paused'
+    STATUS_DONE = 'done'
+    STATUS_CHOICES = [
+        (STATUS_DRAFT, 'Черновик'),
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Отправляется'),
+        (STATUS_PAUSED, 'Приостановлена'),
+        (STATUS_DONE, 'Завершена'),
+    ]
+
+    name = models.CharField(max_length=255)
+    segment = models.CharField(max_length=32, choices=SEGMENT_CHOICES)
+    text = models.TextField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_DRAFT)
+    cursor = models.BigIntegerField(default=0)
+    sent = models.IntegerField(default=0)
+    blocked = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    rate_limited = models.IntegerField(default=0)
+    send_seconds = models.FloatField(default=0, help_text="Время отправки без пауз между запусками, секунд.")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"NotificationCampaign {self.pk} {self.name} ({self.status})"
+
+    @property
+    def throughput(self):
+        """
+        Сообщений в секунду за время отправки.
+        """
+        attempts = self.sent + self.blocked + self.failed
+        return round(attempts / self.send_seconds, 1) if self.send_seconds else 0
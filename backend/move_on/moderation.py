@@ -0,0 +1,153 @@
+"""
+Массовая модерация пользователей из админки фоновыми заданиями (ModerationJob).
+
+Действие в UserAdmin запоминает ID выбранных пользователей в задании и ставит задачу
+run_moderation_job, поэтому запрос админки не ждёт обработки тысяч аккаунтов. Задача идёт пачками
+по MODERATION_CHUNK_SIZE пользователей: каждая пачка — несколько UPDATE по множеству строк в одной
+транзакции вместе с продвижением ModerationJob.processed. Если воркер упадёт, пачка откатится целиком,
+а задание продолжится с неё же; зависшие задания подбирает resume_moderation_jobs.
+
+Повторный запуск безопасен: меняются только строки, которые ещё не изменены (награда прогулки ещё
+не обнулена, реферал ещё не отозван), поэтому очки вычитаются ровно один раз.
+
+Действия:
+- scam, fake: отметка is_scam или is_fake и блокировка. Награды за прогулки обнуляются и вычитаются
+  из очков пользователя, бонус, полученный пригласившим за этого пользователя, вычитается у пригласившего,
+  а реферал отзывается (больше не приносит бонусов).
+- deactivate: только блокировка.
+- reactivate: снятие отметок и блокировки; вычтенные очки не возвращаются.
+Отмеченные и заблокированные пользователи убираются из рейтингов идущих челленджей, после reactivate
+их прогресс возвращается туда (см. challenges).
+"""
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils.timezone import now
+
+from . import challenges, counters
+from .models import ModerationJob, Referral, User, Walk
+
+logger = logging.getLogger(__name__)
+
+USER_UPDATES = {
+    ModerationJob.ACTION_SCAM: {'is_scam': True, 'is_active': False},
+    ModerationJob.ACTION_FAKE: {'is_fake': True, 'is_active': False},
+    ModerationJob.ACTION_DEACTIVATE: {'is_active': False},
+    ModerationJob.ACTION_REACTIVATE: {'is_scam': False, 'is_fake': False, 'is_active': True},
+}
+# Действия, после которых награды пользователя и бонусы за него отзываются
+REVOKING_ACTIONS = {ModerationJob.ACTION_SCAM, ModerationJob.ACTION_FAKE}
+
+
+def create_job(action, user_ids, created_by=None):
+    """
+    Создаёт задание и ставит его в очередь после фиксации транзакции.
+    """
+    job = ModerationJob.objects.create(action=action, user_ids=user_ids, total=len(user_ids), created_by=created_by)
+    transaction.on_commit(lambda: enqueue(job.pk))
+    return job
+
+
+def rerun(job):
+    """
+    Запускает задание повторно: незавершённое — с места остановки, выполненное — сначала.
+    """
+    fields = {'status': ModerationJob.STATUS_PENDING, 'error': '', 'finished_at': None}
+    if job.status == ModerationJob.STATUS_DONE:
+        fields['processed'] = 0
+    ModerationJob.objects.filter(pk=job.pk).update(**fields, updated_at=now())
+    transaction.on_commit(lambda: enqueue(job.pk))
+
+
+def enqueue(job_id):
+    from .tasks import run_moderation_job
+
+    # Если брокер недоступен, задание подберёт resume_moderation_jobs.
+    try:
+        run_moderation_job.delay(job_id)
+    except Exception as e:
+        logger.warning(f"Не удалось поставить задание модерации {job_id} в очередь: {e}")
+
+
+def run(job_id):
+    """
+    Обрабатывает задание до конца.
+    :return: Задание после обработки.
+    """
+    user_ids = ModerationJob.objects.values_list('user_ids', flat=True).get(pk=job_id)
+    while process_chunk(job_id, user_ids):
+        pass
+    return ModerationJob.objects.defer('user_ids').get(pk=job_id)
+
+
+def process_chunk(job_id, user_ids):
+    """
+    Обрабатывает следующую пачку пользователей задания в одной транзакции.
+    :return: True, если задание ещё не закончено.
+    """
+    with transaction.atomic():
+        job = ModerationJob.objects.select_for_update().defer('user_ids').get(pk=job_id)
+        if job.status in (ModerationJob.STATUS_DONE, ModerationJob.STATUS_FAILED):
+            return False
+        chunk = user_ids[job.processed:job.processed + settings.MODERATION_CHUNK_SIZE]
+        if not chunk:
+            job.status = ModerationJob.STATUS_DONE
+            job.finished_at = now()
+            job.save(update_fields=['status', 'finished_at', 'updated_at'])
+            return False
+
+        User.objects.filter(id__in=chunk).update(**USER_UPDATES[job.action])
+        if job.action in REVOKING_ACTIONS:
+            walks_voided, points_revoked, referrals_revoked = revoke_rewards(chunk)
+            job.walks_voided += walks_voided
+            job.points_revoked += points_revoked
+            job.referrals_revoked += referrals_revoked
+        if job.action == ModerationJob.ACTION_REACTIVATE:
+            transaction.on_commit(lambda: challenges.restore_users(chunk))
+        else:
+            transaction.on_commit(lambda: challenges.remove_users(chunk))
+        job.processed += len(chunk)
+        job.status = ModerationJob.STATUS_RUNNING
+        job.save(update_fields=['processed', 'status', 'walks_voided', 'points_revoked', 'referrals_revoked',
+                                'updated_at'])
+    return True
+
+
+def revoke_rewards(user_ids):
+    """
+    Обнуляет награды за прогулки пользователей и отзывает их рефералы, вычитая начисленное из очков.
+    Вызывается внутри транзакции.
+    :return: (прогулок обнулено, очков вычтено всего, рефералов отозвано).
+    """
+    deltas = defaultdict(float)
+
+    walks = Walk.objects.filter(user_id__in=user_ids, reward__gt=0)
+    # Прогулки, сохранённые после этой границы, обнулит повторный запуск
+    last_walk_id = walks.aggregate(last=Max('id'))['last']
+    walks_voided = 0
+    if last_walk_id is not None:
+        walks = walks.filter(id__lte=last_walk_id)
+        for user_id, reward, count in walks.values('user_id').annotate(
+                reward=Sum('reward'), count=Count('id')).values_list('user_id', 'reward', 'count').order_by():
+            deltas[user_id] -= reward
+            walks_voided += count
+        walks.update(reward=0, is_valid=False)
+
+    # Строки рефералов блокируются: walk_pipeline.apply_referral не начислит бонус по уже отозванному
+    referrals = list(
+        Referral.objects.select_for_update().filter(user_id__in=user_ids, is_revoked=False)
+        .values_list('id', 'invited_by_id', 'total_rewards')
+    )
+    for _, invited_by_id, total_rewards in referrals:
+        if invited_by_id is not None and total_rewards > 0:
+            deltas[invited_by_id] -= total_rewards
+    Referral.objects.filter(id__in=[referral_id for referral_id, _, _ in referrals]).update(is_revoked=True)
+
+    if deltas:
+        counters.write({user_id: {'points': delta, 'energy': 0, 'last_energy_update': None}
+                        for user_id, delta in deltas.items()})
+    return walks_voided, -sum(deltas.values()), len(referrals)
+
@@ -0,0 +1,110 @@
+"""
+Обработка данных датчиков прогулки (акселерометр, GPS).
+
+numpy, scipy и geopy импортируются внутри функций: их загрузка занимает около секунды и
+десятки мегабайт, а нужны они только запросам с данными датчиков. Веб-процессы, воркеры Celery
+и manage.py не платят за них при старте. gunicorn вызывает preload() в мастер-процессе,
+чтобы воркеры получили уже загруженные модули через copy-on-write.
+"""
+
+
+def preload():
+    """
+    Загружает тяжёлые зависимости заранее.
+    """
+    import numpy  # noqa: F401
+    import scipy.signal  # noqa: F401
+    import geopy.distance  # noqa: F401
+
+
+def calculate_steps(acceleration_data, threshold=1.2):
+    """
+    Расчёт количества шагов на основе данных акселерометра.
+    :param acceleration_data: Список значений ускорений [{'x': ..., 'y': ..., 'z': ...}, ...].
+    :param threshold: Порог для определения шага.
+    :return: Количество шагов.
+    """
+    import numpy as np
+    from scipy.signal import find_peaks
+
+    magnitudes = [
+        np.sqrt(data['x']**2 + data['y']**2 + data['z']**2) for data in acceleration_data
+    ]
+    peaks, _ = find_peaks(magnitudes, height=threshold)
+    return len(peaks)
+
+
+def calculate_speed(acceleration_data, delta_time):
+    """
+    Расчёт скорости на основе данных акселерометра.
+    :param acceleration_data: Список значений ускорений [{'x': ..., 'y': ..., 'z': ...}, ...].
+    :param delta_time: Время между измерениями (в секундах).
+    :return: Средняя скорость (в м/с).
+    """
+    import numpy as np
+
+    magnitudes = [
+        np.sqrt(data['x']**2 + data['y']**2 + data['z']**2) for data in acceleration_data
+    ]
+    # Убираем гравитацию (~9.81 м/с²) из ускорений
+    adjusted_magnitudes = [max(0, mag - 9.81) for mag in magnitudes]
+    # Интегрируем ускорение по времени, чтобы получить скорость
+    speed = sum(adjusted_magnitudes) * delta_time / len(acceleration_data)
+    return speed
+
+
+def calculate_speed_from_gps(prev_coords, current_coords, delta_time):
+    """
+    Расчёт скорости на основе GPS-координат.
+    :param prev_coords: Предыдущие координаты (широта, долгота) в формате (lat, lon).
+    :param current_coords: Текущие координаты (широта, долгота) в формате (lat, lon).
+    :param delta_time: Время между измерениями (в секундах).
+    :return: Скорость (в м/с).
+    """
+    from geopy.distance import geodesic
+
+    distance = geodesic(prev_coords, current_coords).meters  # Дистанция в метрах
+    speed = distance / delta_time if delta_time > 0 else 0
+    return speed
+
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def count_steps(acc_x, acc_y, acc_z, threshold=1.2):
+    """
+    Расчёт количества шагов по целым рядам ускорений (та же логика, что в calculate_steps, но без цикла по замерам).
+    :param acc_x: Ряд ускорений по оси X.
+    :param acc_y: Ряд ускорений по оси Y.
+    :param acc_z: Ряд ускорений по оси Z.
+    :param threshold: Порог для определения шага.
+    :return: Количество шагов.
+    """
+    import numpy as np
+    from scipy.signal import find_peaks
+
+    magnitudes = np.sqrt(
+        np.square(np.asarray(acc_x, dtype=float))
+        + np.square(np.asarray(acc_y, dtype=float))
+        + np.square(np.asarray(acc_z, dtype=float))
+    )
+    peaks, _ = find_peaks(magnitudes, height=threshold)
+    return len(peaks)
+
+
+def track_distance(latitudes, longitudes, min_segment=2, max_segment=50):
+    """
+    Длина GPS-трека по формуле гаверсинусов.
+    Как и при онлайн-обновлении прогулки, учитываются только отрезки от min_segment до max_segment метров:
+    дрожание на месте и скачки координат отбрасываются.
+    :return: Дистанция (в метрах).
+    """
+    import numpy as np
+
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    if lat.size < 2:
+        return 0.0
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    segments = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    return float(segments[(segments > min_segment) & (segments < max_segment)].sum())
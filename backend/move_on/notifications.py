@@ -0,0 +1,276 @@
+"""
+Рассылки пользователям через бота (NotificationCampaign): напоминания о стрике, бонусы, рейтинг.
+
+Получатели читаются пачками по NOTIFY_CHUNK_SIZE по возрастанию telegram_id (keyset: следующая пачка
+начинается после последнего telegram_id предыдущей), поэтому чтение сегмента любого размера — это
+короткие запросы по уникальному индексу. Пачку отправляют NOTIFY_CONCURRENCY асинхронных обработчиков
+через один aiohttp-сеанс. Ограничения Telegram соблюдает RateLimiter: не больше NOTIFY_RATE_PER_SECOND
+сообщений в секунду на бота и не чаще одного сообщения в NOTIFY_CHAT_INTERVAL секунд в один чат.
+На 429 отправки всего бота приостанавливаются на retry_after из ответа, на ошибки сети и 5xx —
+повтор с экспоненциальной задержкой, не больше NOTIFY_MAX_RETRIES раз.
+
+После каждой пачки в рассылке сохраняются курсор (последний telegram_id) и счётчики, так что
+остановленная или прерванная рассылка продолжается со следующей пачки; при падении воркера повторно
+могут уйти сообщения только из незаконченной пачки. Зависшие рассылки подбирает resume_notification_campaigns.
+Приостановить рассылку можно из админки: она остановится после текущей пачки.
+aiohttp импортируется внутри функций, как numpy в motion.py: модуль загружает админка при старте веб-процесса.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+
+from .metrics import registry
+from .models import NotificationCampaign, User
+
+logger = logging.getLogger(__name__)
+
+registry.describe("move_on_notifications_total", "counter", "Сообщения рассылок по сегменту и результату.")
+registry.describe("move_on_notifications_rate_limited_total", "counter", "Ответы 429 от Telegram при рассылках.")
+
+RESULT_SENT = 'sent'
+RESULT_BLOCKED = 'blocked'
+RESULT_FAILED = 'failed'
+LEADERBOARD_SIZE = 100
+STREAK_REMINDER_TEXT = "🔥 Не потеряйте стрик! Загляните в MoveOn сегодня, чтобы серия не прервалась."
+
+
+def segment_queryset(segment):
+    users = User.objects.filter(is_active=True, is_scam=False, is_fake=False)
+    if segment == NotificationCampaign.SEGMENT_STREAK_REMINDER:
+        # Стрик прервётся, если бонус, последний раз полученный вчера, не забрать сегодня.
+        # День считается так же, как в DailyBonus.process_daily_bonus
+        return users.filter(daily_bonus__streak__gt=0,
+                            daily_bonus__last_claim_date=now().date() - timedelta(days=1))
+    if segment == NotificationCampaign.SEGMENT_LEADERBOARD:
+        return users.filter(pk__in=users.order_by('-points').values('pk')[:LEADERBOARD_SIZE])
+    return users
+
+
+def next_chunk(segment, after, size):
+    """
+    Следующая пачка telegram_id сегмента после telegram_id after.
+    """
+    return list(segment_queryset(segment).filter(telegram_id__gt=after).order_by('telegram_id')
+                .values_list('telegram_id', flat=True)[:size])
+
+
+class RateLimiter:
+    """
+    Ограничение частоты отправок для одного event loop: общие слоты раз в 1/rate секунд,
+    в один чат — не чаще раза в chat_interval секунд, pause() останавливает все отправки.
+    """
+
+    def __init__(self, rate, chat_interval):
+        self.interval = 1 / rate
+        self.chat_interval = chat_interval
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._chats = {}
+
+    async def acquire(self, chat_id):
+        while True:
+            current = time.monotonic()
+            wait = max(self._chats.get(chat_id, 0.0), self._paused_until) - current
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            slot = max(current, self._next_slot)
+            self._next_slot = slot + self.interval
+            if slot > current:
+                await asyncio.sleep(slot - current)
+            # Пока ждали слота, Telegram мог попросить паузу
+            if self._paused_until > time.monotonic():
+                continue
+            self._chats[chat_id] = time.monotonic() + self.chat_interval
+            return
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def prune(self):
+        """
+        Забывает чаты, для которых ограничение уже истекло.
+        """
+        current = time.monotonic()
+        self._chats = {chat_id: ready for chat_id, ready in self._chats.items() if ready > current}
+
+
+class Sender:
+    """
+    Отправка сообщений методом sendMessage с ограничением частоты и повторами.
+    """
+
+    def __init__(self, session, limiter):
+        self.session = session
+        self.limiter = limiter
+        self.url = f"{settings.TELEGRAM_API_URL}/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
+
+    async def send(self, chat_id, text, results):
+        import aiohttp
+
+        payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+        for attempt in range(settings.NOTIFY_MAX_RETRIES + 1):
+            await self.limiter.acquire(chat_id)
+            try:
+                async with self.session.post(self.url, json=payload) as response:
+                    code = response.status
+                    data = await response.json(content_type=None) if code == 429 else None
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.debug(f"Ошибка отправки в чат {chat_id}: {e}")
+                code = None
+            if code == 200:
+                results[RESULT_SENT] += 1
+                return
+            if code == 403:
+                results[RESULT_BLOCKED] += 1
+                return
+            if code == 429:
+                results['rate_limited'] += 1
+                retry_after = ((data or {}).get("parameters") or {}).get("retry_after", 1)
+                self.limiter.pause(retry_after)
+                continue
+            if code is not None and code < 500:
+                break
+            await asyncio.sleep(min(settings.NOTIFY_RETRY_BACKOFF * 2 ** attempt, 30))
+        results[RESULT_FAILED] += 1
+
+    async def send_all(self, chat_ids, text):
+        """
+        Отправляет сообщение в чаты пулом из NOTIFY_CONCURRENCY обработчиков.
+        :return: Counter результатов.
+        """
+        queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            queue.put_nowait(chat_id)
+        results = Counter()
+
+        async def worker():
+            while not queue.empty():
+                await self.send(queue.get_nowait(), text, results)
+
+        await asyncio.gather(*(worker() for _ in range(min(settings.NOTIFY_CONCURRENCY, len(chat_ids)))))
+        return results
+
+
+def create_campaign(name, segment, text):
+    """
+    Создаёт рассылку и ставит её в очередь после фиксации транзакции.
+    """
+    campaign = NotificationCampaign.objects.create(
+        name=name, segment=segment, text=text, status=NotificationCampaign.STATUS_PENDING)
+    transaction.on_commit(lambda: enqueue(campaign.pk))
+    return campaign
+
+
+def start(campaign_ids):
+    """
+    Запускает черновики и продолжает приостановленные рассылки.
+    :return: Сколько рассылок поставлено в очередь.
+    """
+    campaign_ids = list(NotificationCampaign.objects.filter(
+        pk__in=campaign_ids, status__in=[NotificationCampaign.STATUS_DRAFT, NotificationCampaign.STATUS_PAUSED],
+    ).values_list('pk', flat=True))
+    NotificationCampaign.objects.filter(pk__in=campaign_ids).update(
+        status=NotificationCampaign.STATUS_PENDING, updated_at=now())
+    for campaign_id in campaign_ids:
+        transaction.on_commit(lambda campaign_id=campaign_id: enqueue(campaign_id))
+    return len(campaign_ids)
+
+
+def pause(campaign_ids):
+    return NotificationCampaign.objects.filter(
+        pk__in=campaign_ids, status__in=[NotificationCampaign.STATUS_PENDING, NotificationCampaign.STATUS_RUNNING],
+    ).update(status=NotificationCampaign.STATUS_PAUSED, updated_at=now())
+
+
+def enqueue(campaign_id):
+    from .tasks import run_notification_campaign
+
+    # Если брокер недоступен, рассылку подберёт resume_notification_campaigns.
+    try:
+        run_notification_campaign.delay(campaign_id)
+    except Exception as e:
+        logger.warning(f"Не удалось поставить рассылку {campaign_id} в очередь: {e}")
+
+
+def claim(campaign_id):
+    """
+    Помечает рассылку выполняемой, если она ждёт запуска или зависла.
+    :return: True, если рассылку выполняет этот вызов.
+    """
+    stale = now() - timedelta(seconds=settings.NOTIFY_STALE_SECONDS)
+    return NotificationCampaign.objects.filter(
+        Q(status=NotificationCampaign.STATUS_PENDING)
+        | Q(status=NotificationCampaign.STATUS_RUNNING, updated_at__lt=stale),
+        pk=campaign_id,
+    ).update(
+        status=NotificationCampaign.STATUS_RUNNING, updated_at=now(), started_at=Coalesce(F('started_at'), Value(now())),
+    ) == 1
+
+
+def run(campaign_id):
+    """
+    Выполняет рассылку до конца или до приостановки.
+    :return: Рассылка после выполнения или None, если её уже выполняет другой воркер.
+    """
+    if not claim(campaign_id):
+        return None
+    async_to_sync(_send_campaign)(campaign_id)
+    return NotificationCampaign.objects.get(pk=campaign_id)
+
+
+async def _send_campaign(campaign_id):
+    import aiohttp
+
+    campaign = await NotificationCampaign.objects.aget(pk=campaign_id)
+    limiter = RateLimiter(settings.NOTIFY_RATE_PER_SECOND, settings.NOTIFY_CHAT_INTERVAL)
+    timeout = aiohttp.ClientTimeout(total=settings.NOTIFY_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=settings.NOTIFY_CONCURRENCY)
+    cursor = campaign.cursor
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        sender = Sender(session, limiter)
+        while chat_ids := await sync_to_async(next_chunk)(campaign.segment, cursor, settings.NOTIFY_CHUNK_SIZE):
+            started = time.monotonic()
+            results = await sender.send_all(chat_ids, campaign.text)
+            cursor = chat_ids[-1]
+            status = await sync_to_async(_save_progress)(
+                campaign, cursor, results, time.monotonic() - started)
+            if status != NotificationCampaign.STATUS_RUNNING:
+                logger.info(f"Рассылка {campaign_id} остановлена на telegram_id {cursor}: {status}")
+                return
+            limiter.prune()
+    await NotificationCampaign.objects.filter(pk=campaign_id, status=NotificationCampaign.STATUS_RUNNING).aupdate(
+        status=NotificationCampaign.STATUS_DONE, finished_at=now(), updated_at=now())
+
+
+def _save_progress(campaign, cursor, results, seconds):
+    """
+    Сохраняет курсор и счётчики после пачки.
+    :return: Текущий статус рассылки (её могли приостановить из админки).
+    """
+    NotificationCampaign.objects.filter(pk=campaign.pk).update(
+        cursor=cursor,
+        sent=F('sent') + results[RESULT_SENT],
+        blocked=F('blocked') + results[RESULT_BLOCKED],
+        failed=F('failed') + results[RESULT_FAILED],
+        rate_limited=F('rate_limited') + results['rate_limited'],
+        send_seconds=F('send_seconds') + seconds,
+        updated_at=now(),
+    )
+    registry.add(
+        [(("move_on_notifications_total", (("segment", campaign.segment), ("result", result))), results[result])
+         for result in (RESULT_SENT, RESULT_BLOCKED, RESULT_FAILED) if results[result]]
+        + [(("move_on_notifications_rate_limited_total", ()), results['rate_limited'])]
+    )
+    # В воркере Celery нет запросов, после которых метрики отправляются сами
+    registry.flush()
+    return NotificationCampaign.objects.values_list('status', flat=True).get(pk=campaign.pk)
@@ -0,0 +1,226 @@
+"""
+Приём прогулок, записанных на устройстве без связи.
+
+Клиент отправляет всю прогулку одним запросом (JSON, можно сжать gzip и указать Content-Encoding: gzip):
+
+    {
+        "telegram_id": 123,
+        "idempotency_key": "<uuid клиента>",
+        "start_time": "2024-11-20T10:00:00+03:00",
+        "samples": {"t": [...], "accX": [...], "accY": [...], "accZ": [...],
+                    "latitude": [...], "longitude": [...]}
+    }
+
+t — секунды от начала прогулки. Запрос сохраняется как есть (сжатым) и сразу получает ответ 202,
+прогулку считает задача Celery process_offline_walk. Повторная отправка с тем же ключом или с теми же
+замерами (samples_hash считает сервер, ключ выбирает клиент) ничего не создаёт и возвращает текущее
+состояние обработки.
+
+Принимаются только прогулки, которые уже закончились (с запасом OFFLINE_WALK_CLOCK_SKEW_SECONDS на часы
+устройства) и не пересекаются по времени с другими прогулками пользователя. Пересечение проверяется
+при приёме и ещё раз при обработке под блокировкой строки пользователя: две одновременно принятые
+пересекающиеся прогулки не дадут две награды.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware, now
+
+from . import counters
+from . import walk_pipeline
+from .models import OfflineWalkSubmission, User, Walk
+from .motion import count_steps, track_distance
+from .utils import calculate_reward
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_FIELDS = ('t', 'accX', 'accY', 'accZ', 'latitude', 'longitude')
+
+
+class InvalidPayload(ValueError):
+    pass
+
+
+class OverlappingWalk(ValueError):
+    pass
+
+
+def decompress(body):
+    """
+    Распаковывает gzip с ограничением размера результата (защита от «zip-бомб»).
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, settings.OFFLINE_WALK_MAX_UNPACKED_BYTES)
+    except zlib.error:
+        raise InvalidPayload("Invalid gzip payload")
+    if decompressor.unconsumed_tail:
+        raise InvalidPayload("Payload too large")
+    return data
+
+
+def parse(raw):
+    """
+    Разбирает и проверяет JSON прогулки.
+    :return: Словарь прогулки с датами начала и окончания (end_time) в виде datetime.
+    """
+    try:
+        data = json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise InvalidPayload("Invalid JSON")
+    if not isinstance(data, dict):
+        raise InvalidPayload("Invalid JSON")
+
+    start_time = parse_datetime(str(data.get('start_time') or ''))
+    if start_time is None:
+        raise InvalidPayload("start_time is required")
+    data['start_time'] = make_aware(start_time) if is_naive(start_time) else start_time
+
+    samples = data.get('samples')
+    if not isinstance(samples, dict) or any(not isinstance(samples.get(field), list) for field in SAMPLE_FIELDS):
+        raise InvalidPayload(f"samples must contain arrays: {', '.join(SAMPLE_FIELDS)}")
+    lengths = {len(samples[field]) for field in SAMPLE_FIELDS}
+    if len(lengths) != 1:
+        raise InvalidPayload("samples arrays must have the same length")
+    count = lengths.pop()
+    if not count or count > settings.OFFLINE_WALK_MAX_SAMPLES:
+        raise InvalidPayload(f"samples must contain from 1 to {settings.OFFLINE_WALK_MAX_SAMPLES} entries")
+    try:
+        duration = float(max(samples['t']) - min(samples['t']))
+    except (TypeError, ValueError):
+        raise InvalidPayload("samples.t must contain numbers")
+    data['end_time'] = data['start_time'] + timedelta(seconds=duration)
+    if data['end_time'] > now() + timedelta(seconds=settings.OFFLINE_WALK_CLOCK_SKEW_SECONDS):
+        raise InvalidPayload("start_time is in the future")
+    return data
+
+
+def samples_hash(data):
+    """
+    SHA-256 замеров прогулки: одна и та же запись даёт один хэш при любом ключе идемпотентности.
+    """
+    samples = {field: data['samples'][field] for field in SAMPLE_FIELDS}
+    return hashlib.sha256(json.dumps(samples, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def overlapping_walks(user_id, start_time, end_time):
+    """
+    Прогулки пользователя, пересекающиеся с интервалом [start_time, end_time].
+    """
+    return Walk.objects.filter(user_id=user_id, start_time__lt=end_time).filter(
+        Q(end_time__gt=start_time) | Q(end_time__isnull=True, start_time__gte=start_time))
+
+
+def submit(user_id, idempotency_key, payload, data):
+    """
+    Сохраняет прогулку и ставит её обработку в очередь (только для новой прогулки).
+    :param payload: Тело запроса, сжатое gzip.
+    :param data: Разобранная прогулка (parse).
+    :return: (отправка, создана ли она сейчас). Повтор по ключу или по замерам возвращает прежнюю отправку.
+    :raises OverlappingWalk: Прогулка пересекается по времени с уже сохранённой.
+    """
+    from .tasks import process_offline_walk
+
+    digest = samples_hash(data)
+    duplicates = OfflineWalkSubmission.objects.filter(user_id=user_id).filter(
+        Q(idempotency_key=idempotency_key) | Q(samples_hash=digest))
+    submission = duplicates.first()
+    if submission is not None:
+        return submission, False
+    if overlapping_walks(user_id, data['start_time'], data['end_time']).exists():
+        raise OverlappingWalk("Walk overlaps an existing walk")
+    try:
+        with transaction.atomic():
+            submission = OfflineWalkSubmission.objects.create(
+                user_id=user_id, idempotency_key=idempotency_key, samples_hash=digest, payload=payload)
+    except IntegrityError:
+        # Та же прогулка пришла параллельным запросом
+        return duplicates.get(), False
+    transaction.on_commit(lambda: _enqueue(process_offline_walk, submission.pk))
+    return submission, True
+
+
+def _enqueue(task, submission_id):
+    # Если брокер недоступен, прогулку подберёт retry_pending_offline_walks.
+    try:
+        task.delay(submission_id)
+    except Exception as e:
+        logger.warning(f"Не удалось поставить в очередь офлайн-прогулку {submission_id}: {e}")
+
+
+def process(submission_id):
+    """
+    Считает шаги, дистанцию и награду по записанным данным и создаёт прогулку.
+
+    Всё выполняется в одной транзакции под блокировкой строки отправки, поэтому повторный
+    или параллельный запуск задачи для той же отправки не создаёт вторую прогулку. Строка пользователя
+    тоже блокируется: пересечение с другими прогулками проверяется без гонки с соседними отправками.
+    Статистика, реферальное начисление и проверки выполняются шагами walk_pipeline после коммита.
+    :return: ID созданной прогулки или None, если данные не удалось обработать.
+    """
+    with transaction.atomic():
+        submission = OfflineWalkSubmission.objects.select_for_update().get(pk=submission_id)
+        if submission.status != OfflineWalkSubmission.STATUS_PENDING:
+            return submission.walk_id
+
+        user = User.objects.select_for_update().get(pk=submission.user_id)
+        try:
+            data = parse(decompress(bytes(submission.payload)))
+            if overlapping_walks(user.pk, data['start_time'], data['end_time']).exists():
+                raise OverlappingWalk("Walk overlaps an existing walk")
+            samples = data['samples']
+            steps = count_steps(samples['accX'], samples['accY'], samples['accZ'])
+            distance = track_distance(samples['latitude'], samples['longitude'])
+            duration = (data['end_time'] - data['start_time']).total_seconds()
+        except (InvalidPayload, TypeError, ValueError) as e:
+            # Повторять обработку таких данных бессмысленно: отмечаем ошибку и не даём задаче ретраить.
+            submission.status = OfflineWalkSubmission.STATUS_FAILED
+            submission.error = str(e)
+            submission.processed_at = now()
+            submission.save(update_fields=['status', 'error', 'processed_at'])
+            return None
+
+        avg_speed = distance / duration if duration > 0 else 0
+        reward = calculate_reward(
+            distance_km=distance / 1000,
+            steps=steps,
+            avg_speed_kmh=avg_speed * 3.6,
+            daily_streak=user.daily_streak,
+            endurance_level=user.endurance_level,
+            efficiency_level=user.efficiency_level,
+            luck_level=user.luck_level,
+        )
+        walk = Walk.objects.create(
+            user=user,
+            start_time=data['start_time'],
+            end_time=data['end_time'],
+            steps=steps,
+            distance=distance,
+            avg_speed=avg_speed,
+            reward=reward,
+        )
+
+        # Начисление пишется прямо в базу в этой же транзакции, а не через буфер: так оно происходит ровно один раз.
+        counters.write({user.pk: {'points': reward, 'energy': 0, 'last_energy_update': None}})
+
+        submission.walk = walk
+        submission.status = OfflineWalkSubmission.STATUS_DONE
+        submission.processed_at = now()
+        submission.save(update_fields=['walk', 'status', 'processed_at'])
+        transaction.on_commit(lambda: walk_pipeline.start_for_walk(walk.pk))
+        return walk.pk
+
+
+def encode(raw):
+    """
+    Сжимает тело запроса для хранения, если клиент прислал его без сжатия.
+    """
+    return gzip.compress(raw, compresslevel=6)
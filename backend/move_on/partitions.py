@@ -0,0 +1,283 @@
+"""
+Помесячные секции таблиц прогулок и аномалий (PostgreSQL, декларативное секционирование по created_at).
+
+Таблицы переводятся в секционированные миграцией 0004_partition_walk_anomalylog. Секции называются
+<таблица>_pYYYY_MM и покрывают месяц по UTC. Строки вне всех месячных секций попадают в секцию
+по умолчанию <таблица>_default, поэтому вставка не падает, даже если обслуживание давно не запускалось.
+Первичный ключ в базе — (id, created_at), поэтому внешние ключи на прогулку объявлены
+с db_constraint=False; для Django первичным ключом остаётся id.
+
+Задача maintain_partitions раз в день:
+- создаёт секции на PARTITION_MONTHS_AHEAD месяцев вперёд и переносит в них строки этих месяцев
+  из секции по умолчанию (о таких строках пишется предупреждение в лог);
+- отсоединяет секции старше срока хранения, выгружает их в PARTITION_ARCHIVE_DIR
+  (<секция>.csv.gz, COPY в CSV с заголовком) и удаляет.
+Архив загружается обратно командой manage.py partitions restore <таблица> <YYYY-MM>;
+восстановленные секции помечаются и автоматически повторно не архивируются.
+На других СУБД (SQLite в тестах) функции ничего не делают.
+"""
+import gzip
+import logging
+import os
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from .models import Walk, AnomalyLog
+
+logger = logging.getLogger(__name__)
+
+RESTORED_COMMENT = 'restored'
+PARTITION_COLUMN = 'created_at'
+
+
+def partitioned_tables():
+    """
+    {короткое имя: (таблица, срок хранения в месяцах)}. Срок 0 — не архивировать.
+    """
+    return {
+        'walk': (Walk._meta.db_table, settings.WALK_PARTITION_RETAIN_MONTHS),
+        'anomalylog': (AnomalyLog._meta.db_table, settings.ANOMALY_PARTITION_RETAIN_MONTHS),
+    }
+
+
+def is_supported():
+    return connection.vendor == 'postgresql'
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    years, index = divmod(month.month - 1 + count, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def parse_month(value):
+    """
+    'YYYY-MM' → первое число месяца.
+    """
+    year, month = value.split('-')
+    return date(int(year), int(month), 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+
+def default_partition_name(table):
+    return f"{table}_default"
+
+
+def partition_month(table, name):
+    """
+    Месяц секции по её имени или None, если имя не наше.
+    """
+    prefix = f"{table}_p"
+    if not name.startswith(prefix):
+        return None
+    try:
+        year, month = name[len(prefix):].split('_')
+        return date(int(year), int(month), 1)
+    except ValueError:
+        return None
+
+
+def archive_path(table, month):
+    return os.path.join(settings.PARTITION_ARCHIVE_DIR, f"{partition_name(table, month)}.csv.gz")
+
+
+def _bounds(month):
+    return f"'{month:%Y-%m-%d} 00:00:00+00'", f"'{add_months(month, 1):%Y-%m-%d} 00:00:00+00'"
+
+
+def attached_partitions(table):
+    """
+    {месяц: (имя секции, восстановлена ли из архива)} для присоединённых секций.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, obj_description(child.oid, 'pg_class')
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [table],
+        )
+        rows = cursor.fetchall()
+    partitions = {}
+    for name, comment in rows:
+        month = partition_month(table, name)
+        if month is not None:
+            partitions[month] = (name, comment == RESTORED_COMMENT)
+    return partitions
+
+
+def detached_partitions(table):
+    """
+    Секции, которые отсоединены, но ещё не выгружены (например, процесс упал между шагами).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT relname FROM pg_class
+            WHERE relkind = 'r' AND relname LIKE %s
+              AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = pg_class.oid)
+            """,
+            [f"{table}\\_p%"],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return sorted(month for month in (partition_month(table, name) for name in names) if month)
+
+
+def ensure_default_partition(table):
+    """
+    Создаёт секцию по умолчанию, если её ещё нет.
+    :return: True, если секция создана.
+    """
+    name = default_partition_name(table)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [f'"{name}"'])
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(f'CREATE TABLE "{name}" PARTITION OF "{table}" DEFAULT')
+    logger.info(f"Создана секция {name}")
+    return True
+
+
+def default_rows(table):
+    """
+    Количество строк в секции по умолчанию (вне месячных секций) или None, если её нет.
+    """
+    name = default_partition_name(table)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [f'"{name}"'])
+        if not cursor.fetchone()[0]:
+            return None
+        cursor.execute(f'SELECT count(*) FROM "{name}"')
+        return cursor.fetchone()[0]
+
+
+def _create_month(cursor, table, month):
+    """
+    Создаёт секцию месяца внутри транзакции. PostgreSQL не создаёт секцию, пока строки её месяца лежат
+    в секции по умолчанию, поэтому такие строки переносятся: секция по умолчанию на время отсоединяется.
+    """
+    name = partition_name(table, month)
+    default = default_partition_name(table)
+    lower, upper = _bounds(month)
+    in_month = f"{PARTITION_COLUMN} >= {lower} AND {PARTITION_COLUMN} < {upper}"
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [f'"{default}"'])
+    stray = False
+    if cursor.fetchone()[0]:
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM "{default}" WHERE {in_month})')
+        stray = cursor.fetchone()[0]
+    if stray:
+        cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"')
+    cursor.execute(f'CREATE TABLE "{name}" PARTITION OF "{table}" FOR VALUES FROM ({lower}) TO ({upper})')
+    if stray:
+        cursor.execute(f'WITH moved AS (DELETE FROM "{default}" WHERE {in_month} RETURNING *) '
+                       f'INSERT INTO "{table}" SELECT * FROM moved')
+        logger.warning(f"В секцию {name} перенесено строк из {default}: {cursor.rowcount}")
+        cursor.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{default}" DEFAULT')
+
+
+def create_partition(table, month):
+    """
+    Создаёт секцию месяца, если её ещё нет.
+    :return: True, если секция создана.
+    """
+    if month in attached_partitions(table):
+        return False
+    with transaction.atomic(), connection.cursor() as cursor:
+        _create_month(cursor, table, month)
+    logger.info(f"Создана секция {partition_name(table, month)}")
+    return True
+
+
+def archive_partition(table, month):
+    """
+    Отсоединяет секцию месяца (если присоединена), выгружает её в gzip-архив и удаляет таблицу.
+    Архив сначала пишется во временный файл и только после fsync переименовывается.
+    :return: Путь к архиву.
+    """
+    name = partition_name(table, month)
+    path = archive_path(table, month)
+    os.makedirs(settings.PARTITION_ARCHIVE_DIR, exist_ok=True)
+
+    if month in attached_partitions(table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+
+    tmp_path = f"{path}.tmp"
+    with transaction.atomic():
+        with open(tmp_path, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as archive, connection.cursor() as cursor:
+                cursor.copy_expert(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER true)', archive)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE "{name}"')
+    logger.info(f"Секция {name} выгружена в {path}")
+    return path
+
+
+def restore_partition(table, month):
+    """
+    Загружает секцию месяца из архива и присоединяет её к таблице.
+    :return: Количество загруженных строк.
+    """
+    name = partition_name(table, month)
+    path = archive_path(table, month)
+    if month in attached_partitions(table):
+        raise ValueError(f"Секция {name} уже присоединена")
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+
+    with transaction.atomic(), gzip.open(path, 'rb') as archive, connection.cursor() as cursor:
+        columns = archive.readline().decode().strip()
+        archive.seek(0)
+        _create_month(cursor, table, month)
+        cursor.copy_expert(f'COPY "{name}" ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true)', archive)
+        cursor.execute(f"COMMENT ON TABLE \"{name}\" IS '{RESTORED_COMMENT}'")
+        cursor.execute(f'SELECT count(*) FROM "{name}"')
+        rows = cursor.fetchone()[0]
+    logger.info(f"Секция {name} восстановлена из {path}: {rows} строк")
+    return rows
+
+
+def maintain(today=None):
+    """
+    Создаёт будущие секции и архивирует старые для всех секционированных таблиц.
+    :return: {'created': [...], 'archived': [...]} с именами секций.
+    """
+    result = {'created': [], 'archived': []}
+    if not is_supported():
+        return result
+    current = month_start(today or now())
+    for table, retain_months in partitioned_tables().values():
+        if ensure_default_partition(table):
+            result['created'].append(default_partition_name(table))
+        for offset in range(settings.PARTITION_MONTHS_AHEAD + 1):
+            month = add_months(current, offset)
+            if create_partition(table, month):
+                result['created'].append(partition_name(table, month))
+        stray = default_rows(table)
+        if stray:
+            logger.warning(f"В секции {default_partition_name(table)} строк вне месячных секций: {stray}")
+
+        if not retain_months:
+            continue
+        oldest_kept = add_months(current, -retain_months)
+        expired = [month for month, (_, restored) in attached_partitions(table).items()
+                   if month < oldest_kept and not restored]
+        for month in sorted(set(expired) | set(detached_partitions(table))):
+            archive_partition(table, month)
+            result['archived'].append(partition_name(table, month))
+    return result
@@ -0,0 +1,90 @@
+"""
+Планы частых запросов: каждый из них должен обслуживаться индексом (см. индексы в models.py).
+
+hot_queries() возвращает запросы в том виде, в каком их строят представления и задачи,
+full_scans() — таблицы, которые план запроса читает целиком, estimated_rows() — оценку
+числа строк запроса по плану (для списков админки вместо точного COUNT(*)).
+
+В PostgreSQL план строится с enable_seqscan = off: на маленьких тестовых данных планировщик
+и так предпочитает последовательное чтение, а с этим флагом Seq Scan остаётся в плане,
+только если подходящего индекса нет. В SQLite используется EXPLAIN QUERY PLAN.
+"""
+import json
+from datetime import timedelta
+
+from django.db import connection, connections, transaction
+from django.db.models import F, Window
+from django.db.models.functions import Rank
+from django.utils.timezone import now
+
+from .models import User, Walk, WalkSession, Task, AnomalyLog, OfflineWalkSubmission
+
+
+def hot_queries(user_id):
+    """
+    Частые запросы: {название: QuerySet}.
+    """
+    stale = now() - timedelta(minutes=10)
+    return {
+        'check_unfinished': Walk.objects.filter(user_id=user_id, is_interrupted=True)[:1],
+        'walk_history': Walk.objects.filter(user_id=user_id).order_by('-start_time'),
+        'stepometer_session': WalkSession.objects.filter(user_id=user_id, finished_at__isnull=True)[:1],
+        'auto_complete_walks': WalkSession.objects.filter(finished_at__isnull=True, last_step_time__lt=stale),
+        'resume_walk_finalization': WalkSession.objects.filter(finished_at__lt=stale)[:1000],
+        'points_ranking': User.objects.annotate(
+            rank=Window(expression=Rank(), order_by=F('points').desc()),
+        ).order_by('rank')[:100],
+        'active_tasks': Task.objects.filter(is_active=True, task_type='daily'),
+        'user_anomalies': AnomalyLog.objects.filter(user_id=user_id).order_by('-created_at'),
+        'pending_offline_walks': OfflineWalkSubmission.objects.filter(
+            status=OfflineWalkSubmission.STATUS_PENDING, created_at__lt=stale)[:1000],
+        'admin_walk_list': Walk.objects.select_related('user').order_by('-created_at')[:100],
+        'admin_user_list': User.objects.order_by('-created_at')[:100],
+    }
+
+
+def full_scans(queryset):
+    """
+    :return: Список таблиц, которые план запроса читает целиком (пустой — всё через индексы).
+    """
+    sql, params = queryset.query.sql_with_params()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # SET LOCAL действует до конца транзакции
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return _pg_seq_scans(plan[0]['Plan'])
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        # "SCAN move_on_walk" — полный проход по таблице; "SEARCH/SCAN ... USING INDEX" — по индексу,
+        # "SCAN (subquery-N)" — проход по результату подзапроса, а не по таблице
+        return [
+            row[-1].split()[1] for row in cursor.fetchall()
+            if row[-1].startswith('SCAN ') and ' INDEX ' not in row[-1] and not row[-1].startswith('SCAN (')
+        ]
+
+
+def estimated_rows(queryset):
+    """
+    Оценка числа строк запроса по статистике планировщика PostgreSQL (запрос не выполняется).
+    :return: Число строк или None на других СУБД.
+    """
+    db_connection = connections[queryset.db]
+    if db_connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    with db_connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def _pg_seq_scans(node):
+    scans = [node['Relation Name']] if node['Node Type'] == 'Seq Scan' else []
+    for child in node.get('Plans', ()):
+        scans += _pg_seq_scans(child)
+    return scans
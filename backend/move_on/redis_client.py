@@ -0,0 +1,56 @@
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_down_until = 0.0
+
+
+def get_redis():
+    """
+    Возвращает общий для процесса клиент Redis или None.
+
+    None возвращается, если REDIS_URL не задан или Redis недавно не ответил:
+    после ошибки соединения клиент не используется REDIS_RETRY_INTERVAL секунд,
+    чтобы недоступный Redis не добавлял таймаут к каждому запросу.
+    """
+    if not settings.REDIS_URL or time.monotonic() < _down_until:
+        return None
+    return _get_client()
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _client
+
+
+def mark_redis_down(error):
+    """
+    Отмечает Redis как недоступный до истечения REDIS_RETRY_INTERVAL.
+    """
+    global _down_until
+    if time.monotonic() >= _down_until:
+        logger.warning(f"Redis недоступен, переходим на локальный режим: {error}")
+    _down_until = time.monotonic() + settings.REDIS_RETRY_INTERVAL
+
+
+def ping():
+    """
+    Проверяет Redis в обход паузы после ошибок (для проверки готовности).
+    :return: Время ответа в секундах.
+    """
+    global _down_until
+    start = time.perf_counter()
+    _get_client().ping()
+    _down_until = 0.0
+    return time.perf_counter() - start
@@ -0,0 +1,209 @@
+"""
+Реферальный граф: многоуровневые сети приглашений и поиск подозрительных кластеров.
+
+Сеть пользователя хранится в таблице замыкания ReferralClosure: строка на каждую пару
+(предок, потомок) до глубины REFERRAL_CLOSURE_MAX_DEPTH. Новое приглашение добавляет строки
+для всех предков пригласившего (add_edge), поэтому размер сети и разбивка по уровням (levels)
+читаются одним запросом по индексу, без рекурсии. Заполнить таблицу по существующим рефералам или
+исправить её целиком — manage.py referral_graph --rebuild (пересчёт уровень за уровнем через
+INSERT ... SELECT в базе).
+
+Поиск кластеров (find_clusters) читает все рёбра «приглашённый → пригласивший» в массивы NumPy
+и находит компоненты связности векторизованным union-find, не проходя по графу в Python.
+Подозрительным считается большой кластер (от REFERRAL_CLUSTER_MIN_SIZE аккаунтов), в котором
+кто-то пригласил не меньше REFERRAL_CLUSTER_MIN_FANOUT человек, а малоактивных аккаунтов
+(меньше REFERRAL_LOW_ACTIVITY_STEPS шагов за всё время) не меньше REFERRAL_CLUSTER_LOW_ACTIVITY_SHARE.
+Такой кластер записывается в AnomalyLog на пользователя с наибольшим числом приглашений.
+Отозванные модерацией рефералы (is_revoked) в поиск не входят. numpy импортируется внутри функций
+поиска, как в motion.py: модуль нужен представлениям ради add_edge и levels.
+"""
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from .models import AnomalyLog, Referral, ReferralClosure, Statistics
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_PREFIX = "Подозрительный реферальный кластер"
+EDGE_CHUNK_SIZE = 100_000
+
+
+def add_edge(user_id, inviter_id):
+    """
+    Добавляет в таблицу замыкания приглашение user_id пользователем inviter_id.
+    :return: ID пользователей, в чью сеть добавлен user_id.
+    """
+    ancestors = ReferralClosure.objects.filter(
+        descendant_id=inviter_id, depth__lt=settings.REFERRAL_CLOSURE_MAX_DEPTH,
+    ).exclude(ancestor_id=user_id).values_list('ancestor_id', 'depth')
+    rows = [ReferralClosure(ancestor_id=inviter_id, descendant_id=user_id, depth=1)]
+    rows += [ReferralClosure(ancestor_id=ancestor_id, descendant_id=user_id, depth=depth + 1)
+             for ancestor_id, depth in ancestors]
+    ReferralClosure.objects.bulk_create(rows, ignore_conflicts=True)
+    return [row.ancestor_id for row in rows]
+
+
+def rebuild():
+    """
+    Пересчитывает таблицу замыкания по всем рефералам.
+    :return: Сколько строк записано.
+    """
+    closure = ReferralClosure._meta.db_table
+    referral = Referral._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {closure}")
+        cursor.execute(
+            f"INSERT INTO {closure} (ancestor_id, descendant_id, depth) "
+            f"SELECT invited_by_id, user_id, 1 FROM {referral} "
+            f"WHERE invited_by_id IS NOT NULL AND invited_by_id <> user_id"
+        )
+        total = inserted = cursor.rowcount
+        depth = 1
+        # Путь вверх по приглашениям у каждого пользователя один, поэтому повтор пары возможен только
+        # через цикл, а цикл обрывается на паре (x, x), которая не записывается
+        while inserted and depth < settings.REFERRAL_CLOSURE_MAX_DEPTH:
+            cursor.execute(
+                f"INSERT INTO {closure} (ancestor_id, descendant_id, depth) "
+                f"SELECT c.ancestor_id, r.user_id, c.depth + 1 FROM {closure} c "
+                f"JOIN {referral} r ON r.invited_by_id = c.descendant_id "
+                f"WHERE c.depth = %s AND r.user_id <> c.ancestor_id",
+                [depth],
+            )
+            inserted = cursor.rowcount
+            total += inserted
+            depth += 1
+    logger.info(f"Таблица замыкания рефералов пересчитана: {total} строк, глубина {depth}")
+    return total
+
+
+def levels(user_id):
+    """
+    Сеть пользователя по уровням: сколько в ней пользователей и сколько у них очков.
+    :return: [{'depth', 'users', 'points'}, ...] по возрастанию уровня.
+    """
+    return [
+        {'depth': item['depth'], 'users': item['users'], 'points': item['points'] or 0}
+        for item in ReferralClosure.objects.filter(ancestor_id=user_id)
+        .values('depth').annotate(users=Count('descendant_id'), points=Sum('descendant__points')).order_by('depth')
+    ]
+
+
+def load_edges():
+    """
+    Рёбра графа (приглашённый, пригласивший) в виде двух массивов ID пользователей.
+    """
+    import numpy as np
+
+    rows = Referral.objects.filter(invited_by__isnull=False, is_revoked=False).order_by().values_list(
+        'user_id', 'invited_by_id').iterator(chunk_size=EDGE_CHUNK_SIZE)
+    chunks = []
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == EDGE_CHUNK_SIZE:
+            chunks.append(np.array(chunk, dtype=np.int64))
+            chunk = []
+    if chunk:
+        chunks.append(np.array(chunk, dtype=np.int64))
+    edges = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+    return edges[:, 0], edges[:, 1]
+
+
+def components(src, dst, size):
+    """
+    Компоненты связности графа из size вершин с рёбрами src[i] — dst[i] (номера вершин от 0).
+    Union-find целыми массивами: корни концов каждого ребра подвешиваются к меньшему из них,
+    затем пути сжимаются перескоком по родителям, пока рёбра между разными компонентами не кончатся.
+    :return: Массив меток: у вершин одной компоненты одинаковая метка (наименьший номер вершины).
+    """
+    import numpy as np
+
+    labels = np.arange(size)
+    while True:
+        src_labels, dst_labels = labels[src], labels[dst]
+        crossing = src_labels != dst_labels
+        if not crossing.any():
+            return labels
+        src_labels, dst_labels = src_labels[crossing], dst_labels[crossing]
+        np.minimum.at(labels, np.maximum(src_labels, dst_labels), np.minimum(src_labels, dst_labels))
+        while True:
+            parents = labels[labels]
+            if np.array_equal(parents, labels):
+                break
+            labels = parents
+
+
+def _low_activity(user_ids):
+    """
+    Маска малоактивных пользователей (пользователи без статистики малоактивны).
+    """
+    import numpy as np
+
+    steps = {}
+    for start in range(0, len(user_ids), EDGE_CHUNK_SIZE):
+        steps.update(Statistics.objects.filter(user_id__in=user_ids[start:start + EDGE_CHUNK_SIZE].tolist())
+                     .values_list('user_id', 'total_steps'))
+    return np.fromiter((steps.get(user_id, 0) for user_id in user_ids.tolist()), dtype=np.int64,
+                       count=len(user_ids)) < settings.REFERRAL_LOW_ACTIVITY_STEPS
+
+
+def find_clusters():
+    """
+    Ищет подозрительные реферальные кластеры и записывает новые в AnomalyLog.
+    :return: [{'user_id', 'size', 'fanout', 'low_activity_share'}, ...] — все найденные кластеры.
+    """
+    import numpy as np
+
+    src_ids, dst_ids = load_edges()
+    user_ids, inverse = np.unique(np.concatenate([src_ids, dst_ids]), return_inverse=True)
+    src, dst = inverse[:len(src_ids)], inverse[len(src_ids):]
+    labels = components(src, dst, len(user_ids))
+
+    sizes = np.bincount(labels, minlength=len(user_ids))
+    fanout = np.bincount(dst, minlength=len(user_ids))
+    max_fanout = np.zeros(len(user_ids), dtype=np.int64)
+    np.maximum.at(max_fanout, labels, fanout)
+    candidates = (sizes[labels] >= settings.REFERRAL_CLUSTER_MIN_SIZE) & \
+        (max_fanout[labels] >= settings.REFERRAL_CLUSTER_MIN_FANOUT)
+    nodes = np.flatnonzero(candidates)
+
+    low = np.bincount(labels[nodes], weights=_low_activity(user_ids[nodes]), minlength=len(user_ids))
+    share = np.divide(low, sizes, out=np.zeros(len(user_ids)), where=sizes > 0)
+    # Центр кластера — вершина с наибольшим числом приглашений
+    order = nodes[np.lexsort((-fanout[nodes], labels[nodes]))]
+    cluster_labels, first = np.unique(labels[order], return_index=True)
+    clusters = [
+        {
+            'user_id': int(user_ids[hub]),
+            'size': int(sizes[label]),
+            'fanout': int(fanout[hub]),
+            'low_activity_share': round(float(share[label]), 3),
+        }
+        for label, hub in zip(cluster_labels, order[first])
+        if share[label] >= settings.REFERRAL_CLUSTER_LOW_ACTIVITY_SHARE
+    ]
+    _log(clusters)
+    logger.info(f"Реферальный граф: {len(src_ids)} рёбер, {len(user_ids)} пользователей, "
+                f"подозрительных кластеров: {len(clusters)}")
+    return clusters
+
+
+def _log(clusters):
+    descriptions = {
+        cluster['user_id']: (
+            f"{CLUSTER_PREFIX}: {cluster['size']} аккаунтов, пригласил {cluster['fanout']}, "
+            f"малоактивных {cluster['low_activity_share']:.0%}"
+        )
+        for cluster in clusters
+    }
+    # Тот же кластер при повторном поиске второй раз не записывается
+    logged = set(AnomalyLog.objects.filter(
+        user_id__in=list(descriptions), description__startswith=CLUSTER_PREFIX,
+    ).values_list('user_id', 'description'))
+    AnomalyLog.objects.bulk_create([
+        AnomalyLog(user_id=user_id, description=description)
+        for user_id, description in descriptions.items() if (user_id, description) not in logged
+    ])
@@ -0,0 +1,52 @@
+"""
+Суточные сводки больших таблиц (DailyRollup): сколько строк создано за каждый день.
+
+Стандартная навигация по датам в админке (date_hierarchy) на каждой странице списка считает
+MIN/MAX и DISTINCT по дате по всей таблице — на десятках миллионов строк это секунды.
+Списки прогулок и пользователей строят её по сводкам (templatetags/admin_rollups.py),
+поэтому в ней показаны дни, когда строки создавались, без учёта остальных фильтров списка.
+
+Сводки за последние ROLLUP_REFRESH_DAYS дней пересчитывает задача refresh_daily_rollups,
+за всю историю — manage.py refresh_rollups --days N.
+"""
+import logging
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils.timezone import localdate, make_aware
+
+from .models import DailyRollup, User, Walk
+
+logger = logging.getLogger(__name__)
+
+
+def rollup_models():
+    return {model._meta.model_name: model for model in (Walk, User)}
+
+
+def refresh(days, today=None):
+    """
+    Пересчитывает сводки за последние days дней, включая сегодняшний.
+    :return: Сколько дней со строками записано.
+    """
+    first_day = (today or localdate()) - timedelta(days=days - 1)
+    start = make_aware(datetime.combine(first_day, time.min))
+    written = 0
+    for table, model in rollup_models().items():
+        counts = (
+            model.objects.filter(created_at__gte=start)
+            .annotate(day=TruncDate('created_at'))
+            .values('day')
+            .annotate(rows=Count('id'))
+            .order_by()
+        )
+        rollups = [DailyRollup(table=table, day=item['day'], rows=item['rows']) for item in counts]
+        DailyRollup.objects.filter(table=table, day__gte=first_day).exclude(
+            day__in=[rollup.day for rollup in rollups]).delete()
+        DailyRollup.objects.bulk_create(
+            rollups, update_conflicts=True, unique_fields=['table', 'day'], update_fields=['rows', 'updated_at'],
+        )
+        written += len(rollups)
+    logger.info(f"Суточные сводки за {days} дн. пересчитаны: {written} записей")
+    return written
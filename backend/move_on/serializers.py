@@ -65,6 +65,8 @@ class TaskSerializer(serializers.ModelSerializer):
             'start_date',
             'end_date',
             'is_active',
+            'metric',
+            'target',
         ]
 
 
@@ -108,5 +110,4 @@ class AnomalyLogSerializer(serializers.ModelSerializer):
 
 
 class CompleteTaskSerializer(serializers.Serializer):
-    task_id = serializers.IntegerField(required=True, help_text="ID задачи для завершения")
     telegram_id = serializers.IntegerField(required=True, help_text="Telegram ID пользователя")
\ No newline at end of file
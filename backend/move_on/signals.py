@@ -1,20 +1,29 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Walk, Statistics
-from django.db.models import Sum
-import logging
+from .models import User, Task
+from . import identity_cache, task_progress
 
-logger = logging.getLogger(__name__)
+
+@receiver(post_save, sender=User)
+def refresh_identity_cache(sender, instance, **kwargs):
+    """
+    Обновление кэша telegram_id → пользователь после сохранения пользователя.
+    """
+    identity_cache.refresh(instance)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_identity_cache(sender, instance, **kwargs):
+    """
+    Удаление пользователя из кэша telegram_id → пользователь.
+    """
+    identity_cache.invalidate(instance.telegram_id)
 
 
-@receiver(post_save, sender=Walk)
-def update_global_statistics(sender, instance, **kwargs):
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def reset_task_index(sender, instance, **kwargs):
     """
-    Пересчёт глобальной статистики после сохранения новой прогулки.
+    Сброс индекса активных заданий в этом процессе (в остальных он обновится через TASK_INDEX_TTL секунд).
     """
-    stats = Walk.objects.aggregate(
-        total_steps=Sum('steps'),
-        total_distance=Sum('distance'),
-        total_rewards=Sum('reward'),
-    )
-    logger.info(f"Обновлена глобальная статистика: {stats}")
+    task_progress.reset_index()
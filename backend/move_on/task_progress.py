@@ -0,0 +1,159 @@
+"""
+Прогресс пользователей по заданиям (TaskProgress) и автоматическое выполнение заданий по прогулкам.
+
+Задание с показателем (Task.metric) выполняется, когда накопленное значение достигает Task.target:
+шаги, дистанция в км и число прогулок складываются, стрик ежедневного бонуса (DailyBonus.streak)
+берётся наибольшим. Ежедневные задания считаются за день, челленджи — за всё время действия задания.
+
+Прогулка учитывается шагом tasks в walk_pipeline (apply_walk). Активные задания с показателем
+держатся в памяти процесса, сгруппированными по показателю (active_tasks_by_metric), поэтому
+прогулка затрагивает только задания тех показателей, которые она изменила, и никакой перебор
+всех заданий или всех пользователей не нужен: прогресс пользователя по всем затронутым заданиям
+обновляется одним INSERT ... ON CONFLICT DO UPDATE, выполненные задания отмечаются ещё одним UPDATE.
+Индекс обновляется раз в TASK_INDEX_TTL секунд и сразу после сохранения задания в этом процессе.
+
+Награда начисляется один раз за период запросом пользователя (claim, представление tasks_complete).
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import localdate, now
+
+from . import counters
+from .models import DailyBonus, Task, TaskProgress
+
+# Показатели, которые складываются по прогулкам; остальные (стрик) берутся наибольшим значением
+CUMULATIVE_METRICS = {'steps', 'distance', 'walks'}
+
+_index = {'tasks': {}, 'expires': 0.0}
+
+
+def active_tasks_by_metric():
+    """
+    {показатель: [задание, ...]} активных заданий с показателем.
+    """
+    if time.monotonic() >= _index['expires']:
+        tasks = {}
+        for task in Task.objects.filter(is_active=True).exclude(metric=''):
+            tasks.setdefault(task.metric, []).append(task)
+        _index.update(tasks=tasks, expires=time.monotonic() + settings.TASK_INDEX_TTL)
+    return _index['tasks']
+
+
+def reset_index():
+    _index['expires'] = 0.0
+
+
+def period(task, day):
+    """
+    Период прогресса по заданию для дня day.
+    """
+    if task.task_type == 'daily':
+        return day
+    return task.start_date or task.created_at.date()
+
+
+def current_streak(user_id):
+    """
+    Стрик ежедневного бонуса пользователя; 0, если бонус не получен ни сегодня, ни вчера (стрик прервался).
+    День считается так же, как в DailyBonus.process_daily_bonus.
+    """
+    return DailyBonus.objects.filter(
+        user_id=user_id, last_claim_date__gte=now().date() - timedelta(days=1),
+    ).values_list('streak', flat=True).first() or 0
+
+
+def apply_walk(walk):
+    """
+    Учитывает прогулку в прогрессе пользователя по заданиям и отмечает выполненные.
+    Вызывается внутри транзакции шага завершения прогулки.
+    :return: [(задание, период), ...] — чей прогресс изменился.
+    """
+    if not walk.is_valid:
+        return []
+    index = active_tasks_by_metric()
+    values = {'steps': walk.steps, 'distance': walk.distance / 1000, 'walks': 1}
+    if 'streak' in index:
+        values['streak'] = current_streak(walk.user_id)
+
+    day = localdate(walk.end_time or walk.start_time)
+    rows = [
+        (task, period(task, day), value)
+        for metric, value in values.items() if value
+        for task in index.get(metric, ())
+        if (task.start_date is None or task.start_date <= day) and (task.end_date is None or task.end_date >= day)
+    ]
+    if rows:
+        _upsert(walk.user_id, rows)
+        _complete(walk.user_id, rows)
+    return [(task, progress_period) for task, progress_period, _ in rows]
+
+
+def _upsert(user_id, rows):
+    table = TaskProgress._meta.db_table
+    greatest = 'GREATEST' if connection.vendor == 'postgresql' else 'MAX'
+    updated_at = connection.ops.adapt_datetimefield_value(now())
+    cumulative = [row for row in rows if row[0].metric in CUMULATIVE_METRICS]
+    peak = [row for row in rows if row[0].metric not in CUMULATIVE_METRICS]
+    with connection.cursor() as cursor:
+        for items, merge in ((cumulative, f'"{table}"."value" + EXCLUDED."value"'),
+                             (peak, f'{greatest}("{table}"."value", EXCLUDED."value")')):
+            if not items:
+                continue
+            params = []
+            for task, progress_period, value in items:
+                params += [user_id, task.pk, connection.ops.adapt_datefield_value(progress_period), value, updated_at]
+            cursor.execute(
+                f'INSERT INTO "{table}" ("user_id", "task_id", "period", "value", "updated_at") '
+                f'VALUES {", ".join(["(%s, %s, %s, %s, %s)"] * len(items))} '
+                f'ON CONFLICT ("user_id", "task_id", "period") DO UPDATE '
+                f'SET "value" = {merge}, "updated_at" = EXCLUDED."updated_at"',
+                params,
+            )
+
+
+def _complete(user_id, rows):
+    targets = {task.pk: task.target for task, _, _ in rows}
+    pending = TaskProgress.objects.filter(
+        user_id=user_id, task_id__in=targets, period__in={progress_period for _, progress_period, _ in rows},
+        completed_at__isnull=True,
+    ).values_list('pk', 'task_id', 'value')
+    completed = [pk for pk, task_id, value in pending if value >= targets[task_id]]
+    if completed:
+        TaskProgress.objects.filter(pk__in=completed).update(completed_at=now())
+
+
+def claim(user_id, task):
+    """
+    Начисляет награду за выполненное задание один раз за период.
+    Задание без показателя считается выполненным в момент запроса.
+    :return: True, если награда начислена; False, если задание не выполнено или награда уже получена.
+    """
+    progress_period = period(task, localdate())
+    with transaction.atomic():
+        if not task.metric:
+            TaskProgress.objects.get_or_create(
+                user_id=user_id, task=task, period=progress_period, defaults={'completed_at': now()})
+        claimed = TaskProgress.objects.filter(
+            user_id=user_id, task=task, period=progress_period, completed_at__isnull=False, claimed_at__isnull=True,
+        ).update(claimed_at=now())
+        if claimed:
+            counters.write({user_id: {'points': task.reward, 'energy': 0, 'last_energy_update': None}})
+    return bool(claimed)
+
+
+def user_progress(user_id, tasks):
+    """
+    Текущий прогресс пользователя по заданиям.
+    :return: {ID задания: TaskProgress}; заданий без прогресса в словаре нет.
+    """
+    today = localdate()
+    periods = {task.pk: period(task, today) for task in tasks}
+    return {
+        progress.task_id: progress
+        for progress in TaskProgress.objects.filter(
+            user_id=user_id, task_id__in=periods, period__in=set(periods.values()))
+        if progress.period == periods[progress.task_id]
+    }
@@ -1,9 +1,11 @@
 import logging
 from celery import shared_task
-from django.utils.timezone import now
+from django.utils.timezone import localdate, now
 from datetime import timedelta
-from .models import WalkSession, Walk
-from .utils import calculate_reward
+from django.conf import settings
+from .models import WalkSession, OfflineWalkSubmission, ModerationJob, NotificationCampaign
+from . import challenges, counters, moderation, notifications, offline_walks, partitions, referral_graph, rollups, walk_pipeline
+from .walk_service import claim_session
 
 logger = logging.getLogger(__name__)
 
@@ -13,25 +15,209 @@ def auto_complete_walks():
     """
     Проверяем и завершаем прогулки, которые нужно завершить
     """
-    sessions = WalkSession.objects.all()
-    for session in sessions:
-        elapsed_time = now() - session.last_step_time if session.last_step_time else None
-
-        if session.last_step_time and elapsed_time:
-            if elapsed_time.total_seconds() > 600: 
-                logger.info(f'Завершаем прогулку для пользователя {session.user.telegram_id} по истечению времени.')
-                reward = calculate_reward(session.distance, session.steps, session.avg_speed, session.user)
-
-                Walk.objects.create(
-                    user=session.user,
-                    start_time=session.start_time,
-                    end_time=now(),
-                    steps=session.steps,
-                    distance=session.distance,
-                    avg_speed=session.avg_speed,
-                    reward=reward,
-                    is_interrupted=True,
-                )
-
-                session.delete()
-    return f'{sessions.count()} прогулок проверено и завершено.'
+    sessions = WalkSession.objects.filter(
+        finished_at__isnull=True, last_step_time__lt=now() - timedelta(seconds=600),
+    ).values_list('id', flat=True)
+    completed = 0
+    for session_id in sessions:
+        logger.info(f'Завершаем прогулку {session_id} по истечению времени.')
+        _, claimed = claim_session(session_id, interrupted=True)
+        if claimed:
+            walk_pipeline.start(session_id)
+            completed += 1
+    return f'{completed} прогулок завершено по истечению времени.'
+
+
+@shared_task
+def flush_user_counters():
+    """
+    Записывает в базу накопленные в буфере приращения счётчиков пользователей (см. counters).
+    """
+    flushed = counters.flush()
+    return f'Записаны счётчики {flushed} пользователей.'
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=30)
+def process_offline_walk(self, submission_id):
+    """
+    Обрабатывает прогулку, отправленную целиком после записи без связи (см. offline_walks).
+    Повторные запуски для уже обработанной прогулки ничего не делают.
+    """
+    try:
+        walk_id = offline_walks.process(submission_id)
+    except OfflineWalkSubmission.DoesNotExist:
+        return f'Офлайн-прогулка {submission_id} не найдена.'
+    except Exception as e:
+        logger.warning(f'Ошибка обработки офлайн-прогулки {submission_id}: {e}')
+        raise self.retry(exc=e)
+    return f'Офлайн-прогулка {submission_id} обработана, прогулка {walk_id}.'
+
+
+@shared_task
+def retry_pending_offline_walks():
+    """
+    Ставит в очередь офлайн-прогулки, которые давно ждут обработки (например, брокер был недоступен при приёме).
+    """
+    stale = OfflineWalkSubmission.objects.filter(
+        status=OfflineWalkSubmission.STATUS_PENDING,
+        created_at__lt=now() - timedelta(minutes=10),
+    ).values_list('id', flat=True)[:1000]
+    for submission_id in stale:
+        process_offline_walk.delay(submission_id)
+    return f'{len(stale)} офлайн-прогулок поставлено в очередь повторно.'
+
+
+# Шаги завершения прогулки (см. walk_pipeline). Каждый шаг идемпотентен, поэтому повторы безопасны.
+PIPELINE_TASK_OPTIONS = dict(autoretry_for=(Exception,), retry_backoff=True, retry_backoff_max=300, max_retries=8)
+
+
+@shared_task(**PIPELINE_TASK_OPTIONS)
+def persist_walk(session_id):
+    return walk_pipeline.persist(session_id)
+
+
+@shared_task(**PIPELINE_TASK_OPTIONS)
+def walk_stats(walk_id):
+    return walk_pipeline.run_step(walk_id, 'stats', walk_pipeline.apply_stats)
+
+
+@shared_task(**PIPELINE_TASK_OPTIONS)
+def walk_referral(walk_id):
+    return walk_pipeline.run_step(walk_id, 'referral', walk_pipeline.apply_referral)
+
+
+@shared_task(**PIPELINE_TASK_OPTIONS)
+def walk_anticheat(walk_id):
+    return walk_pipeline.run_step(walk_id, 'anticheat', walk_pipeline.apply_anticheat)
+
+
+@shared_task(**PIPELINE_TASK_OPTIONS)
+def walk_tasks(walk_id):
+    return walk_pipeline.run_step(walk_id, 'tasks', walk_pipeline.apply_tasks)
+
+
+@shared_task(**PIPELINE_TASK_OPTIONS)
+def cleanup_walk_session(session_id):
+    walk_pipeline.cleanup(session_id)
+
+
+@shared_task
+def resume_walk_finalization():
+    """
+    Повторно запускает завершение прогулок, которые застряли (брокер был недоступен, ретраи исчерпаны).
+    """
+    stale = list(WalkSession.objects.filter(
+        finished_at__lt=now() - timedelta(seconds=settings.WALK_FINALIZE_RESUME_AFTER),
+    ).values_list('id', flat=True)[:1000])
+    for session_id in stale:
+        walk_pipeline.start(session_id)
+    return f'Повторно запущено завершение {len(stale)} прогулок.'
+
+
+@shared_task
+def maintain_partitions():
+    """
+    Создаёт будущие помесячные секции и архивирует старые (см. partitions.py).
+    """
+    result = partitions.maintain()
+    return f"Создано секций: {len(result['created'])}, архивировано: {len(result['archived'])}."
+
+
+@shared_task
+def refresh_daily_rollups():
+    """
+    Пересчитывает суточные сводки за последние ROLLUP_REFRESH_DAYS дней (см. rollups.py).
+    """
+    written = rollups.refresh(settings.ROLLUP_REFRESH_DAYS)
+    return f"Суточных сводок записано: {written}."
+
+
+@shared_task
+def run_moderation_job(job_id):
+    """
+    Выполняет задание массовой модерации (см. moderation.py).
+    """
+    try:
+        job = moderation.run(job_id)
+    except ModerationJob.DoesNotExist:
+        return f'Задание модерации {job_id} не найдено.'
+    except Exception as e:
+        logger.exception(f'Ошибка задания модерации {job_id}')
+        ModerationJob.objects.filter(pk=job_id).update(
+            status=ModerationJob.STATUS_FAILED, error=str(e)[:1000], updated_at=now())
+        return f'Задание модерации {job_id} завершилось ошибкой: {e}'
+    return f'Задание модерации {job_id}: обработано {job.processed} из {job.total}.'
+
+
+@shared_task
+def resume_moderation_jobs():
+    """
+    Ставит в очередь задания модерации, которые не продвигались MODERATION_STALE_SECONDS
+    (брокер был недоступен при создании или воркер остановился посреди задания).
+    """
+    stale = list(ModerationJob.objects.filter(
+        status__in=[ModerationJob.STATUS_PENDING, ModerationJob.STATUS_RUNNING],
+        updated_at__lt=now() - timedelta(seconds=settings.MODERATION_STALE_SECONDS),
+    ).values_list('id', flat=True)[:100])
+    for job_id in stale:
+        moderation.enqueue(job_id)
+    return f'{len(stale)} заданий модерации поставлено в очередь повторно.'
+
+
+@shared_task
+def find_referral_clusters():
+    """
+    Ищет подозрительные реферальные кластеры и записывает их в AnomalyLog (см. referral_graph.py).
+    """
+    clusters = referral_graph.find_clusters()
+    return f"Подозрительных реферальных кластеров: {len(clusters)}."
+
+
+@shared_task
+def maintain_challenge_leaderboards():
+    """
+    Фиксирует рейтинги завершившихся челленджей и заполняет рейтинги идущих в Redis (см. challenges.py).
+    """
+    result = challenges.maintain()
+    return f"Зафиксировано рейтингов: {len(result['frozen'])}, заполнено: {len(result['rebuilt'])}."
+
+
+@shared_task
+def run_notification_campaign(campaign_id):
+    """
+    Выполняет рассылку (см. notifications.py).
+    """
+    if not settings.TELEGRAM_BOT_TOKEN:
+        return 'TELEGRAM_BOT_TOKEN не задан, рассылка не отправлена.'
+    campaign = notifications.run(campaign_id)
+    if campaign is None:
+        return f'Рассылка {campaign_id} уже выполняется или не ждёт запуска.'
+    return (f'Рассылка {campaign_id}: {campaign.status}, доставлено {campaign.sent}, заблокировали бота '
+            f'{campaign.blocked}, ошибок {campaign.failed}, {campaign.throughput} сообщ./с.')
+
+
+@shared_task
+def resume_notification_campaigns():
+    """
+    Ставит в очередь рассылки, которые ждут запуска или не продвигались NOTIFY_STALE_SECONDS.
+    """
+    stale = list(NotificationCampaign.objects.filter(
+        status__in=[NotificationCampaign.STATUS_PENDING, NotificationCampaign.STATUS_RUNNING],
+        updated_at__lt=now() - timedelta(seconds=settings.NOTIFY_STALE_SECONDS),
+    ).values_list('id', flat=True)[:100])
+    for campaign_id in stale:
+        notifications.enqueue(campaign_id)
+    return f'{len(stale)} рассылок поставлено в очередь повторно.'
+
+
+@shared_task
+def start_streak_reminders():
+    """
+    Запускает ежедневную рассылку тем, кто сегодня ещё не заходил и может потерять стрик.
+    """
+    name = f'Напоминание о стрике {localdate():%Y-%m-%d}'
+    if NotificationCampaign.objects.filter(name=name).exists():
+        return f'Рассылка «{name}» уже создана.'
+    campaign = notifications.create_campaign(
+        name, NotificationCampaign.SEGMENT_STREAK_REMINDER, notifications.STREAK_REMINDER_TEXT)
+    return f'Рассылка {campaign.pk} «{name}» поставлена в очередь.'
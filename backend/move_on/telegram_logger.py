@@ -1,26 +1,126 @@
+import html
 import logging
+import sys
+import time
+from collections import Counter
+
 import requests
 
+from .background import BackgroundBatcher
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
 class TelegramHandler(logging.Handler):
     """
     Кастомный обработчик для отправки логов уровня ERROR и CRITICAL в Telegram.
+
+    emit() только кладёт запись в ограниченную очередь, а отправкой занимается фоновый поток:
+    - одинаковые сообщения в пачке схлопываются в одно с количеством повторов;
+    - отправка ограничена rate_limit сообщениями за rate_period секунд (лимит Telegram для чата);
+    - при переполнении очереди записи отбрасываются, число пропущенных сообщается в следующем сообщении;
+    - при завершении процесса logging.shutdown() вызывает close(), который дожидается отправки очереди.
     """
-    def __init__(self, bot_token, chat_id):
+    def __init__(self, bot_token, chat_id, api_url="https://api.telegram.org", queue_size=1000,
+                 batch_interval=2.0, rate_limit=20, rate_period=60.0, timeout=5.0):
         super().__init__(level=logging.ERROR)
         self.bot_token = bot_token
         self.chat_id = chat_id
-        self.url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        self.url = f"{api_url}/bot{bot_token}/sendMessage"
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self._tokens = float(rate_limit)
+        self._tokens_updated = time.monotonic()
+        self._reported_dropped = 0
+        self.batcher = BackgroundBatcher(
+            self.send_batch, name="telegram-log-sender", maxsize=queue_size,
+            batch_size=100, flush_interval=batch_interval,
+        )
+
+    @property
+    def dropped(self):
+        return self.batcher.dropped
 
     def emit(self, record):
         try:
-            log_entry = self.format(record)
-            payload = {
-                "chat_id": self.chat_id,
-                "text": f"🔴 <b>Django Error Log:</b>\n<pre>{log_entry}</pre>",
-                "parse_mode": "HTML"
-            }
-            response = requests.post(self.url, json=payload)
-            if not response.ok:
-                print(f"Ошибка отправки лога в Telegram: {response.text}")
-        except Exception as e:
-            print(f"Ошибка отправки лога в Telegram: {e}")
+            self.batcher.put(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.batcher.flush()
+
+    def close(self):
+        self.batcher.close()
+        super().close()
+
+    def send_batch(self, entries):
+        """
+        Отправляет пачку записей: дубликаты схлопываются, длинные пачки делятся на несколько сообщений.
+        """
+        counts = Counter(entries)
+        lines = [entry if count == 1 else f"{entry}\n(повторов: {count})" for entry, count in counts.items()]
+        dropped = self.batcher.dropped - self._reported_dropped
+        if dropped:
+            lines.append(f"Очередь переполнена, пропущено сообщений: {dropped}")
+            self._reported_dropped += dropped
+
+        for chunk in self._chunks(lines):
+            self._wait_for_token()
+            self._send(f"🔴 <b>Django Error Log:</b>\n<pre>{chunk}</pre>")
+
+    def _chunks(self, lines):
+        """
+        Делит строки на сообщения в пределах лимита Telegram. Строки экранируются до деления:
+        экранирование удлиняет текст, и длина считается уже по экранированному.
+        """
+        limit = TELEGRAM_MESSAGE_LIMIT - 100
+        chunk = ""
+        for line in lines:
+            line = html.escape(line)
+            if len(line) > limit:
+                line = line[:limit]
+                # Не оставляем обрезанную сущность вроде «&am»
+                entity = line.rfind('&')
+                if entity > line.rfind(';'):
+                    line = line[:entity]
+            if chunk and len(chunk) + len(line) + 2 > limit:
+                yield chunk
+                chunk = ""
+            chunk = f"{chunk}\n\n{line}" if chunk else line
+        if chunk:
+            yield chunk
+
+    def _wait_for_token(self):
+        while True:
+            current = time.monotonic()
+            refill = (current - self._tokens_updated) * self.rate_limit / self.rate_period
+            self._tokens = min(self.rate_limit, self._tokens + refill)
+            self._tokens_updated = current
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            time.sleep((1 - self._tokens) * self.rate_period / self.rate_limit)
+
+    def _send(self, text, attempts=3):
+        payload = {
+            "chat_id": self.chat_id,
+            "text": text,
+            "parse_mode": "HTML"
+        }
+        for _ in range(attempts):
+            try:
+                response = requests.post(self.url, json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                print(f"Ошибка отправки лога в Telegram: {e}", file=sys.stderr)
+                return
+            if response.status_code != 429:
+                if not response.ok:
+                    print(f"Ошибка отправки лога в Telegram: {response.text}", file=sys.stderr)
+                return
+            try:
+                retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+            except ValueError:
+                retry_after = 1
+            time.sleep(min(retry_after, 30))
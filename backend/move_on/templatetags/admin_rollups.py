@@ -0,0 +1,77 @@
+"""
+Навигация по датам для списков админки по суточным сводкам (см. rollups.py).
+Повторяет стандартный тег date_hierarchy, но даты берёт из DailyRollup, а не из таблицы списка.
+"""
+from datetime import date
+
+from django import template
+from django.db.models import Max, Min
+from django.utils import formats
+from django.utils.text import capfirst
+from django.utils.translation import gettext as _
+
+from ..models import DailyRollup
+
+register = template.Library()
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def rollup_date_hierarchy(cl):
+    field_name = cl.date_hierarchy
+    year_field, month_field, day_field = (f"{field_name}__{part}" for part in ('year', 'month', 'day'))
+    year, month, day = (cl.params.get(field) for field in (year_field, month_field, day_field))
+    days = DailyRollup.objects.filter(table=cl.model._meta.model_name, rows__gt=0)
+
+    def link(filters):
+        return cl.get_query_string(filters, [f"{field_name}__"])
+
+    if not (year or month or day):
+        # Все данные за один год или месяц — сразу открываем его
+        bounds = days.aggregate(first=Min('day'), last=Max('day'))
+        if bounds['first'] and bounds['first'].year == bounds['last'].year:
+            year = bounds['first'].year
+            if bounds['first'].month == bounds['last'].month:
+                month = bounds['first'].month
+
+    if year and month and day:
+        selected = date(int(year), int(month), int(day))
+        return {
+            'show': True,
+            'back': {
+                'link': link({year_field: year, month_field: month}),
+                'title': capfirst(formats.date_format(selected, 'YEAR_MONTH_FORMAT')),
+            },
+            'choices': [{'title': capfirst(formats.date_format(selected, 'MONTH_DAY_FORMAT'))}],
+        }
+    if year and month:
+        return {
+            'show': True,
+            'back': {'link': link({year_field: year}), 'title': str(year)},
+            'choices': [
+                {
+                    'link': link({year_field: year, month_field: month, day_field: value.day}),
+                    'title': capfirst(formats.date_format(value, 'MONTH_DAY_FORMAT')),
+                }
+                for value in days.filter(day__year=year, day__month=month).dates('day', 'day')
+            ],
+        }
+    if year:
+        return {
+            'show': True,
+            'back': {'link': link({}), 'title': _("All dates")},
+            'choices': [
+                {
+                    'link': link({year_field: year, month_field: value.month}),
+                    'title': capfirst(formats.date_format(value, 'YEAR_MONTH_FORMAT')),
+                }
+                for value in days.filter(day__year=year).dates('day', 'month')
+            ],
+        }
+    return {
+        'show': True,
+        'back': None,
+        'choices': [
+            {'link': link({year_field: str(value.year)}), 'title': str(value.year)}
+            for value in days.dates('day', 'year')
+        ],
+    }
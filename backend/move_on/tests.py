@@ -1,7 +1,38 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock, skipUnless
+
+import numpy as np
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.models import User as AuthUser
+from django.db import connection, router, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import User, Walk, Task, Statistics
+from .models import User, Walk, Task, Statistics, WalkSession, OfflineWalkSubmission, Referral, AnomalyLog, \
+    DailyRollup, DailyBonus, ModerationJob, ReferralClosure, NotificationCampaign, TaskProgress, ChallengeResult
+from .metrics import MetricsRegistry
+from .middleware import ReplicaPinMiddleware
+from .walk_service import apply_sample, claim_session
+from .telegram_logger import TELEGRAM_MESSAGE_LIMIT, TelegramHandler
+from . import assets, backpressure, challenges, conditional, counters, db_router, frontend_logs, identity_cache, \
+    moderation, notifications, offline_walks, partitions, query_plans, referral_graph, rollups, task_progress, throttling, \
+    views, walk_pipeline
 from django.urls import reverse
 
 
@@ -82,25 +113,1430 @@ class WalkAPITestCase(APITestCase):
 
     def test_tasks_complete(self):
         user = User.objects.create(telegram_id=12345)
-        task = Task.objects.create(user=user, name="Complete walk", reward=5)
+        task = Task.objects.create(name="Complete walk", reward=5)
+
+        url = reverse('tasks_complete', args=[task.id])
+        response = self.client.post(url, {'telegram_id': user.telegram_id}, format='json')
+
+        user.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['new_points'], 5)
+        self.assertEqual(user.points, 5)
+        self.assertIsNotNone(TaskProgress.objects.get(user=user, task=task).claimed_at)
+        # Награда за период начисляется один раз
+        response = self.client.post(url, {'telegram_id': user.telegram_id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(REDIS_URL='')
+class MetricsTestCase(APITestCase):
+    def test_metrics_endpoint_reports_route_latency_and_queries(self):
+        user = User.objects.create(telegram_id=12345)
+        self.client.get(reverse('get_energy', args=[user.telegram_id]))
+
+        response = self.client.get(reverse('metrics'))
+        body = response.content.decode()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        labels = 'route="energy/<int:telegram_id>/",method="GET"'
+        self.assertIn(f'move_on_http_requests_total{{{labels},status="2xx"}}', body)
+        self.assertIn(f'move_on_http_request_duration_seconds_bucket{{{labels},le="+Inf"}}', body)
+        self.assertIn(f'move_on_db_queries_total{{{labels}}}', body)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        registry.describe('latency', 'histogram', 'test')
+        registry.observe('latency', 0.003)
+        registry.observe('latency', 0.3)
+
+        body = registry.render()
+
+        self.assertIn('latency_bucket{le="0.005"} 1', body)
+        self.assertIn('latency_bucket{le="0.5"} 2', body)
+        self.assertIn('latency_bucket{le="+Inf"} 2', body)
+        self.assertIn('latency_count 2', body)
+
+
+class StubHTTPServer:
+    """
+    Локальный HTTP-сервер для тестов: сохраняет JSON-тела запросов и отвечает заданными ответами.
+    respond(path, payload) возвращает (status, json) и вызывается в потоке сервера.
+    """
+    def __init__(self, respond=None, delay=0):
+        self.requests = []
+        self.delay = delay
+        self.respond = respond or (lambda path, payload: (200, {"ok": True, "result": {}}))
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                payload = json.loads(body or b'{}')
+                stub.requests.append((self.path, payload))
+                time.sleep(stub.delay)
+                code, response = stub.respond(self.path, payload)
+                data = json.dumps(response).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TelegramHandlerTestCase(SimpleTestCase):
+    def make_handler(self, server, **kwargs):
+        handler = TelegramHandler('token', 42, api_url=server.url, batch_interval=0.05, **kwargs)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.addCleanup(handler.close)
+        return handler
+
+    def make_record(self, message):
+        return logging.LogRecord('move_on', logging.ERROR, __file__, 1, message, None, None)
+
+    def test_emit_does_not_wait_for_telegram_and_deduplicates(self):
+        server = StubHTTPServer(delay=0.3)
+        self.addCleanup(server.stop)
+        handler = self.make_handler(server)
+
+        started = time.monotonic()
+        for _ in range(3):
+            handler.emit(self.make_record('db is down <pool>'))
+        self.assertLess(time.monotonic() - started, 0.1)
+
+        self.assertTrue(handler.batcher.flush(timeout=5))
+        self.assertEqual(len(server.requests), 1)
+        path, payload = server.requests[0]
+        self.assertEqual(path, '/bottoken/sendMessage')
+        self.assertEqual(payload['chat_id'], 42)
+        self.assertIn('db is down &lt;pool&gt;\n(повторов: 3)', payload['text'])
+
+    def test_overflow_is_counted_and_reported(self):
+        server = StubHTTPServer(delay=0.3)
+        self.addCleanup(server.stop)
+        handler = self.make_handler(server, queue_size=2)
+
+        handler.emit(self.make_record('first'))
+        time.sleep(0.15)
+        for i in range(10):
+            handler.emit(self.make_record(f'storm {i}'))
+
+        self.assertEqual(handler.dropped, 8)
+        handler.close()
+        self.assertIn('пропущено сообщений: 8', server.requests[-1][1]['text'])
+
+    def test_rate_limit_spreads_messages(self):
+        server = StubHTTPServer()
+        self.addCleanup(server.stop)
+        handler = self.make_handler(server, rate_limit=1, rate_period=0.3)
+
+        started = time.monotonic()
+        handler.send_batch(['a' * 3000, 'b' * 3000])
+
+        self.assertEqual(len(server.requests), 2)
+        self.assertGreaterEqual(time.monotonic() - started, 0.25)
+
+    def test_escaped_chunks_fit_telegram_limit(self):
+        handler = TelegramHandler('token', 42)
+        self.addCleanup(handler.close)
+
+        chunks = list(handler._chunks(['<&>' * 3000, 'a' * 100]))
+
+        self.assertTrue(all(len(chunk) <= TELEGRAM_MESSAGE_LIMIT - 100 for chunk in chunks))
+        self.assertTrue(chunks[0].endswith(';'))
+
+
+class LogViewTestCase(APITestCase):
+    def post_logs(self, data):
+        with self.assertLogs('move_on.frontend', level='DEBUG') as logs:
+            response = self.client.post(reverse('log-view'), data, format='json')
+            frontend_logs.writer.flush()
+            frontend_logs.frontend_logger.debug('flushed')
+        return response, [line for line in logs.output if 'flushed' not in line]
+
+    def test_batch_is_accepted_and_written(self):
+        response, lines = self.post_logs({
+            'user_id': 7,
+            'entries': [{'level': 'info', 'message': 'walk started'}, {'level': 'error', 'message': 'gps lost'}],
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['accepted'], 2)
+        self.assertEqual(lines, [
+            'INFO:move_on.frontend:User: 7 - walk started',
+            'ERROR:move_on.frontend:User: 7 - gps lost',
+        ])
+
+    def test_single_entry_format_is_still_supported(self):
+        response, lines = self.post_logs({'level': 'warn', 'message': 'legacy', 'user_id': 8})
+
+        self.assertEqual(response.json()['accepted'], 1)
+        self.assertEqual(lines, ['WARNING:move_on.frontend:User: 8 - legacy'])
+
+    @override_settings(FRONTEND_LOG_MAX_BATCH=2, FRONTEND_LOG_SAMPLE_RATE=0)
+    def test_batch_cap_and_sampling(self):
+        entries = [{'level': 'info', 'message': 'tick'}, {'level': 'error', 'message': 'boom'}] + \
+                  [{'level': 'error', 'message': 'overflow'}] * 3
+        response, lines = self.post_logs({'user_id': 9, 'entries': entries})
+
+        self.assertEqual(response.json(), {'status': 'log received', 'accepted': 1, 'dropped': 4})
+        self.assertEqual(lines, ['ERROR:move_on.frontend:User: 9 - boom'])
+
+    @override_settings(FRONTEND_LOG_MAX_BYTES=100)
+    def test_oversized_payload_is_rejected(self):
+        response = self.client.post(reverse('log-view'), {'user_id': 1, 'entries': [{'message': 'x' * 200}]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
+SAMPLE = {'accX': 0.1, 'accY': 9.8, 'accZ': 0.2, 'latitude': 55.7558, 'longitude': 37.6173, 'speed': 1.4}
+
+
+class WalkSessionUpdateTestCase(APITestCase):
+    def setUp(self):
+        throttling.reset()
+
+    def test_update_accumulates_gps_distance(self):
+        user = User.objects.create(telegram_id=12345)
+        session = WalkSession.objects.create(user=user)
+        url = reverse('walk-detail', args=[session.id])
+
+        self.client.put(url, {**SAMPLE, 'walk_id': session.id}, format='json')
+        response = self.client.put(url, {**SAMPLE, 'walk_id': session.id, 'latitude': 55.7559}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertAlmostEqual(response.json()['distance'], 11.13, places=1)
+        self.assertEqual(response.json()['current_speed'], 1.4)
+
+    def test_update_racing_finish_does_not_reopen_session(self):
+        user = User.objects.create(telegram_id=12345)
+        session = WalkSession.objects.create(user=user, steps=100)
+        url = reverse('walk-detail', args=[session.id])
+        claimed = {}
+
+        def finish_meanwhile(walk_session, *args, **kwargs):
+            # Завершение приходит, пока обновление держит в памяти прочитанную ранее сессию
+            claimed['session'], _ = claim_session(walk_session.id)
+            return apply_sample(walk_session, *args, **kwargs)
+
+        with mock.patch('move_on.views.apply_sample', side_effect=finish_meanwhile):
+            response = self.client.put(url, {**SAMPLE, 'walk_id': session.id}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        session.refresh_from_db()
+        self.assertEqual((session.finished_at, session.reward), (claimed['session'].finished_at, claimed['session'].reward))
+
+        with mock.patch.object(walk_pipeline, 'start'):
+            self.client.post(reverse('walk_finish', args=[session.id]))
+        walk_pipeline.run(session.id)
+        self.assertEqual(Walk.objects.filter(user=user).count(), 1)
+
+
+class AsyncWalkViewsTestCase(TestCase):
+    def setUp(self):
+        throttling.reset()
+
+    async def test_get_energy(self):
+        await User.objects.acreate(telegram_id=12345, energy=42)
+
+        response = await self.async_client.get(reverse('async_get_energy', args=[12345]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'energy': 42})
+
+    async def test_update_and_finish_walk(self):
+        user = await User.objects.acreate(telegram_id=12345)
+        session = await WalkSession.objects.acreate(user=user)
+
+        await self.async_client.post(
+            reverse('async_walk_update', args=[session.id]), SAMPLE, content_type='application/json')
+        response = await self.async_client.post(
+            reverse('async_walk_update', args=[session.id]), {**SAMPLE, 'latitude': 55.7559},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.json()['distance'], 11.13, places=1)
+        self.assertIn('flush_interval_ms', response.json()['telemetry'])
+
+        with mock.patch.object(walk_pipeline, 'start') as start:
+            response = await self.async_client.post(reverse('async_walk_finish', args=[session.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('reward', response.json())
+        start.assert_called_once_with(session.id)
+        self.assertIsNotNone((await WalkSession.objects.aget(id=session.id)).finished_at)
+
+        await sync_to_async(walk_pipeline.run)(session.id)
+
+        self.assertFalse(await WalkSession.objects.filter(id=session.id).aexists())
+        walk = await Walk.objects.aget(user=user)
+        self.assertAlmostEqual(walk.distance, 11.13, places=1)
+
+    @override_settings(REDIS_URL='')
+    async def test_walk_stream_pushes_updates_until_finish(self):
+        user = await User.objects.acreate(telegram_id=12345)
+        session = await WalkSession.objects.acreate(user=user)
+
+        response = await self.async_client.get(reverse('async_walk_stream', args=[session.id]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+
+        def state(chunk):
+            self.assertTrue(chunk.startswith(b'event: state\ndata: '))
+            return json.loads(chunk.split(b'data: ', 1)[1])
+
+        self.assertEqual(state(await anext(events))['steps'], 0)
+
+        await self.async_client.post(
+            reverse('async_walk_update', args=[session.id]), SAMPLE, content_type='application/json')
+        await self.async_client.post(
+            reverse('async_walk_update', args=[session.id]), {**SAMPLE, 'latitude': 55.7559},
+            content_type='application/json')
+        await anext(events)
+        update = state(await anext(events))
+        self.assertAlmostEqual(update['distance'], 11.13, places=1)
+        self.assertIn('energy', update)
+        self.assertFalse(update['finished'])
+
+        with mock.patch.object(walk_pipeline, 'start'):
+            await self.async_client.post(reverse('async_walk_finish', args=[session.id]))
+
+        finished = state(await anext(events))
+        self.assertTrue(finished['finished'])
+        self.assertIn('reward', finished)
+        with self.assertRaises(StopAsyncIteration):
+            await anext(events)
+
+    async def test_stepometer_reports_running_walk(self):
+        user = await User.objects.acreate(telegram_id=12345)
+        await WalkSession.objects.acreate(user=user)
+
+        response = await self.async_client.get(reverse('async_stepometer'), {'telegram_id': 12345})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_walk_running'])
+        self.assertFalse(response.json()['has_unclaimed_bonus'])
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportTestCase(TestCase):
+    async def _read(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    async def test_requires_staff(self):
+        response = await self.async_client.get(reverse('async_export', args=['walks']))
+
+        self.assertEqual(response.status_code, 403)
+
+    async def test_streams_gzipped_csv_for_date_range(self):
+        await self.async_client.aforce_login(await AuthUser.objects.acreate(username='analyst', is_staff=True))
+        user = await User.objects.acreate(telegram_id=12345)
+        for day, steps in ((1, 100), (2, 200), (3, 300), (10, 400)):
+            walk = await Walk.objects.acreate(user=user, start_time=now(), steps=steps)
+            await Walk.objects.filter(pk=walk.pk).aupdate(created_at=datetime(2024, 1, day, 12, tzinfo=dt_timezone.utc))
+
+        response = await self.async_client.get(
+            reverse('async_export', args=['walks']), {'from': '2024-01-01', 'to': '2024-01-03'},
+            headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(await self._read(response)).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'telegram_id', 'start_time'])
+        self.assertEqual(sorted(int(line.split(',')[4]) for line in lines[1:]), [100, 200, 300])
+
+    async def test_streams_ndjson(self):
+        await self.async_client.aforce_login(await AuthUser.objects.acreate(username='analyst', is_staff=True))
+        await User.objects.acreate(telegram_id=12345, points=10, first_name='Ivan')
+
+        response = await self.async_client.get(reverse('async_export', args=['users']), {'format': 'ndjson'})
+
+        rows = [json.loads(line) for line in (await self._read(response)).decode().splitlines()]
+        self.assertEqual([(row['telegram_id'], row['points']) for row in rows], [(12345, 10.0)])
+        self.assertNotIn('first_name', rows[0])
+
+
+@override_settings(TELEMETRY_NODE_RATE=0.001, TELEMETRY_NODE_BURST=4, COUNTER_BUFFER='off')
+class BackpressureTestCase(SimpleTestCase):
+    def test_token_bucket(self):
+        bucket = backpressure.TokenBucket(rate=0.001, capacity=2)
+
+        self.assertTrue(bucket.take())
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+        self.assertLess(bucket.level(), 0.01)
+
+    def test_stationary_user_samples_less_often(self):
+        stationary = backpressure.directive(new_steps=0, current_speed=0.0, avg_speed=1.2)
+        ambiguous = backpressure.directive(new_steps=2, current_speed=2.5, avg_speed=1.2)
+
+        self.assertEqual(stationary['motion'], backpressure.MOTION_STATIONARY)
+        self.assertEqual(ambiguous['motion'], backpressure.MOTION_AMBIGUOUS)
+        self.assertGreater(stationary['sample_interval_ms'], ambiguous['sample_interval_ms'])
+
+    def test_flush_interval_grows_with_node_load(self):
+        intervals = [backpressure.directive(2, 1.2, 1.2)['flush_interval_ms'] for _ in range(5)]
+
+        self.assertEqual(intervals[0], settings.TELEMETRY_FLUSH_INTERVAL_MS * 2)
+        self.assertEqual(intervals, sorted(intervals))
+        self.assertEqual(intervals[-1], settings.TELEMETRY_FLUSH_INTERVAL_MS * 2 * settings.TELEMETRY_MAX_SLOWDOWN)
+
+    @override_settings(TELEMETRY_NODE_BURST=100, TELEMETRY_NODE_MAX_IN_FLIGHT=2)
+    def test_concurrent_updates_count_as_load(self):
+        calm = backpressure.directive(2, 1.2, 1.2)
+        # Второе обновление приходит, пока первое ещё обрабатывается
+        busy = backpressure.ingestion(backpressure.ingestion(lambda: backpressure.directive(2, 1.2, 1.2)))()
+
+        self.assertEqual(calm['flush_interval_ms'], settings.TELEMETRY_FLUSH_INTERVAL_MS * 2)
+        self.assertEqual(busy['flush_interval_ms'],
+                         settings.TELEMETRY_FLUSH_INTERVAL_MS * 2 * settings.TELEMETRY_MAX_SLOWDOWN)
+        # Обновление при полной конкурентности стоит два токена
+        self.assertAlmostEqual(backpressure.node_bucket().level(), 0.97, places=3)
+        self.assertEqual(backpressure.in_flight(), 0)
+
+    def test_failed_update_leaves_flight(self):
+        async def view():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            asyncio.run(backpressure.ingestion(view)())
+        self.assertEqual(backpressure.in_flight(), 0)
+
+
+@override_settings(REDIS_URL='', REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'walk_update': '2/min'},
+})
+class ThrottlingTestCase(APITestCase):
+    def setUp(self):
+        throttling.reset()
+
+    def test_parse_rate(self):
+        self.assertEqual(throttling.parse_rate('10/min'), (10 / 60, 10))
+        self.assertEqual(throttling.parse_rate('5/s'), (5, 5))
+
+    def test_local_bucket_allows_burst_then_reports_wait(self):
+        self.assertIsNone(throttling.check('walk_update', '1'))
+        self.assertIsNone(throttling.check('walk_update', '1'))
+        wait = throttling.check('walk_update', '1')
+
+        self.assertAlmostEqual(wait, 30, delta=1)
+        self.assertIsNone(throttling.check('walk_update', '2'))
+        self.assertIsNone(throttling.check('unknown_scope', '1'))
+
+    def test_walk_update_is_throttled_per_session(self):
+        user = User.objects.create(telegram_id=12345)
+        session = WalkSession.objects.create(user=user)
+        url = reverse('walk-detail', args=[session.id])
+
+        responses = [self.client.put(url, {**SAMPLE, 'walk_id': session.id}, format='json') for _ in range(3)]
+
+        self.assertEqual([r.status_code for r in responses], [200, 200, status.HTTP_429_TOO_MANY_REQUESTS])
+        self.assertIn('Retry-After', responses[-1])
+
+
+class QueryPlanTestCase(TestCase):
+    def test_hot_queries_use_indexes(self):
+        users = User.objects.bulk_create([User(telegram_id=i, points=i) for i in range(1, 51)])
+        start = now() - timedelta(hours=1)
+        Walk.objects.bulk_create([
+            Walk(user=user, start_time=start - timedelta(days=day), is_interrupted=day == 0)
+            for user in users for day in range(3)
+        ])
+        WalkSession.objects.bulk_create([
+            WalkSession(user=user, last_step_time=start, finished_at=start if user.pk % 2 else None) for user in users
+        ])
+        Task.objects.bulk_create([Task(name=f"task {i}", is_active=i % 2 == 0) for i in range(20)])
+        AnomalyLog.objects.bulk_create([AnomalyLog(user=user, description="test") for user in users])
+
+        for name, queryset in query_plans.hot_queries(users[0].pk).items():
+            with self.subTest(query=name):
+                self.assertEqual(query_plans.full_scans(queryset), [])
+
+
+class PartitionTestCase(TestCase):
+    def test_month_helpers(self):
+        self.assertEqual(partitions.add_months(date(2024, 11, 1), 3), date(2025, 2, 1))
+        self.assertEqual(partitions.add_months(date(2024, 1, 1), -1), date(2023, 12, 1))
+        name = partitions.partition_name('move_on_walk', date(2024, 3, 1))
+        self.assertEqual(name, 'move_on_walk_p2024_03')
+        self.assertEqual(partitions.partition_month('move_on_walk', name), date(2024, 3, 1))
+        self.assertIsNone(partitions.partition_month('move_on_walk', 'move_on_walk_old'))
+        self.assertIsNone(partitions.partition_month('move_on_walk', partitions.default_partition_name('move_on_walk')))
+
+    @skipUnless(connection.vendor != 'postgresql', "без PostgreSQL обслуживание секций ничего не делает")
+    def test_maintain_is_noop_without_postgres(self):
+        self.assertEqual(partitions.maintain(), {'created': [], 'archived': []})
+
+    @skipUnless(connection.vendor == 'postgresql', "секционирование есть только в PostgreSQL")
+    def test_archive_and_restore_month(self):
+        user = User.objects.create(telegram_id=12345)
+        walk = Walk.objects.create(user=user, start_time=now(), steps=100)
+        table = Walk._meta.db_table
+        month = partitions.month_start(walk.created_at)
+
+        with tempfile.TemporaryDirectory() as archive_dir, self.settings(PARTITION_ARCHIVE_DIR=archive_dir):
+            partitions.archive_partition(table, month)
+            self.assertFalse(Walk.objects.filter(pk=walk.pk).exists())
+            self.assertNotIn(month, partitions.attached_partitions(table))
+
+            self.assertEqual(partitions.restore_partition(table, month), 1)
+
+        self.assertEqual(Walk.objects.get(pk=walk.pk).steps, 100)
+        self.assertTrue(partitions.attached_partitions(table)[month][1])
+
+    @skipUnless(connection.vendor == 'postgresql', "секционирование есть только в PostgreSQL")
+    def test_rows_outside_monthly_partitions_go_to_default(self):
+        user = User.objects.create(telegram_id=12345)
+        walk = Walk.objects.create(user=user, start_time=now(), steps=100)
+        table = Walk._meta.db_table
+        month = partitions.add_months(partitions.month_start(walk.created_at), 120)
+        Walk.objects.filter(pk=walk.pk).update(created_at=datetime(month.year, month.month, 15, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.default_rows(table), 1)
+
+        self.assertTrue(partitions.create_partition(table, month))
+        self.assertEqual(partitions.default_rows(table), 0)
+        self.assertEqual(Walk.objects.get(pk=walk.pk).steps, 100)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+class ReplicaRoutingTestCase(SimpleTestCase):
+    def setUp(self):
+        db_router.lag_monitor.reset()
+        self.addCleanup(db_router.lag_monitor.reset)
+
+    def test_only_replica_blocks_read_from_replicas(self):
+        with mock.patch.object(db_router, 'measure_lag', return_value=0.0):
+            self.assertEqual(router.db_for_read(User), 'default')
+            with db_router.read_replica():
+                self.assertIn(router.db_for_read(User), settings.DATABASE_REPLICAS)
+            self.assertEqual(router.db_for_write(User), 'default')
+
+    def test_lagging_or_unavailable_replica_drops_out(self):
+        lags = {'replica_1': 0.5, 'replica_2': 60.0}
+        with mock.patch.object(db_router, 'measure_lag', side_effect=lags.get), db_router.read_replica():
+            self.assertEqual({router.db_for_read(User) for _ in range(20)}, {'replica_1'})
+
+        db_router.lag_monitor.reset()
+        with mock.patch.object(db_router, 'measure_lag', side_effect=ConnectionError), \
+                self.assertLogs('move_on.db_router', 'WARNING'), db_router.read_replica():
+            self.assertEqual(router.db_for_read(User), 'default')
+        self.assertEqual(db_router.lag_monitor.lags(), {'replica_1': None, 'replica_2': None})
+
+    def test_replica_without_wal_receiver_drops_out(self):
+        def replica(row):
+            connection = mock.MagicMock(vendor='postgresql')
+            connection.cursor.return_value.__enter__.return_value.fetchone.return_value = row
+            return connection
+
+        # replica_2 применила всё полученное, но приёмник WAL не подключён к основной базе
+        replicas = {'replica_1': replica((True, True, 0)), 'replica_2': replica((True, False, 0))}
+        with mock.patch.object(db_router, 'connections', replicas), \
+                self.assertLogs('move_on.db_router', 'WARNING'):
+            self.assertEqual(db_router.lag_monitor.healthy(), ['replica_1'])
+        self.assertEqual(db_router.lag_monitor.lags(), {'replica_1': 0.0, 'replica_2': None})
+
+    def test_write_pins_following_reads_to_primary(self):
+        with mock.patch.object(db_router, 'measure_lag', return_value=0.0), db_router.read_replica():
+            self.assertNotEqual(router.db_for_read(User), 'default')
+            router.db_for_write(User)
+            self.assertEqual(router.db_for_read(User), 'default')
+
+    def test_pin_cookie_keeps_next_request_on_primary(self):
+        seen = []
+
+        def view(request):
+            with db_router.read_replica():
+                seen.append(router.db_for_read(User))
+                if request.method == 'POST':
+                    router.db_for_write(User)
+            return HttpResponse()
+
+        middleware = ReplicaPinMiddleware(view)
+        factory = RequestFactory()
+        with mock.patch.object(db_router, 'measure_lag', return_value=0.0):
+            response = middleware(factory.post('/'))
+            self.assertEqual(response.cookies[db_router.PIN_COOKIE].value, '1')
+
+            request = factory.get('/')
+            request.COOKIES[db_router.PIN_COOKIE] = response.cookies[db_router.PIN_COOKIE].value
+            self.assertNotIn(db_router.PIN_COOKIE, middleware(request).cookies)
+
+        self.assertIn(seen[0], settings.DATABASE_REPLICAS)
+        self.assertEqual(seen[1], 'default')
+
+
+class AdminScalingTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(AuthUser.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.user = User.objects.create(telegram_id=12345, username='walker')
+        for created_at in (datetime(2023, 5, 10, 12, tzinfo=dt_timezone.utc),
+                           datetime(2024, 3, 1, 12, tzinfo=dt_timezone.utc)):
+            walk = Walk.objects.create(user=self.user, start_time=created_at)
+            Walk.objects.filter(pk=walk.pk).update(created_at=created_at)
+
+    def test_walk_dates_come_from_rollups(self):
+        rollups.refresh(days=(date.today() - date(2023, 1, 1)).days)
+        self.assertEqual(DailyRollup.objects.filter(table='walk').count(), 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:move_on_walk_changelist'))
+
+        self.assertContains(response, '?created_at__year=2023')
+        self.assertContains(response, '?created_at__year=2024')
+        walk_queries = [query['sql'] for query in queries if 'FROM "move_on_walk"' in query['sql']]
+        self.assertFalse([sql for sql in walk_queries if 'MIN(' in sql or 'DISTINCT' in sql])
+        # Пользователь прогулки приходит в том же запросе (list_select_related), а не запросом на строку
+        self.assertFalse([query for query in queries if 'FROM "move_on_user"' in query['sql']])
+
+    def test_large_lists_use_estimated_count(self):
+        with mock.patch.object(query_plans, 'estimated_rows', return_value=5_000_000):
+            response = self.client.get(reverse('admin:move_on_walk_changelist'))
+
+        self.assertEqual(response.context['cl'].result_count, 5_000_000)
+
+    def test_numeric_search_matches_telegram_id_exactly(self):
+        User.objects.create(telegram_id=123456, username='other')
+        url = reverse('admin:move_on_user_changelist')
+
+        self.assertEqual(self.client.get(url, {'q': '12345'}).context['cl'].result_count, 1)
+        self.assertEqual(self.client.get(url, {'q': 'walk'}).context['cl'].result_count, 1)
+        self.assertEqual(
+            self.client.get(reverse('admin:move_on_walk_changelist'), {'q': 'walker'}).context['cl'].result_count, 0)
+
+
+@override_settings(MODERATION_CHUNK_SIZE=2)
+class ModerationTestCase(TestCase):
+    def setUp(self):
+        self.inviter = User.objects.create(telegram_id=1, points=100)
+        self.scammers = [User.objects.create(telegram_id=100 + i, points=50) for i in range(3)]
+        for user in self.scammers:
+            Walk.objects.create(user=user, start_time=now(), reward=20)
+            Referral.objects.create(user=user, invited_by=self.inviter, total_rewards=1)
+
+    def test_scam_job_revokes_rewards_once(self):
+        job = ModerationJob.objects.create(action=ModerationJob.ACTION_SCAM,
+                                           user_ids=[user.pk for user in self.scammers], total=3)
+
+        job = moderation.run(job.pk)
+
+        self.assertEqual((job.status, job.processed, job.walks_voided, job.referrals_revoked),
+                         (ModerationJob.STATUS_DONE, 3, 3, 3))
+        self.assertEqual(job.points_revoked, 63)
+        for user in User.objects.filter(pk__in=job.user_ids):
+            self.assertEqual((user.is_scam, user.is_active, user.points), (True, False, 30))
+        self.assertFalse(Walk.objects.filter(reward__gt=0).exists())
+        self.assertFalse(Referral.objects.filter(is_revoked=False).exists())
+        self.inviter.refresh_from_db()
+        self.assertEqual(self.inviter.points, 97)
+
+        moderation.rerun(job)
+        job = moderation.run(job.pk)
+
+        self.assertEqual(job.status, ModerationJob.STATUS_DONE)
+        self.inviter.refresh_from_db()
+        self.assertEqual(self.inviter.points, 97)
+        self.assertEqual(User.objects.get(pk=self.scammers[0].pk).points, 30)
+
+    def test_interrupted_job_resumes_from_last_chunk(self):
+        job = ModerationJob.objects.create(action=ModerationJob.ACTION_FAKE,
+                                           user_ids=[user.pk for user in self.scammers], total=3)
+
+        self.assertTrue(moderation.process_chunk(job.pk, job.user_ids))
+        self.assertEqual(User.objects.filter(is_fake=True).count(), 2)
+
+        job = moderation.run(job.pk)
+
+        self.assertEqual((job.status, job.processed), (ModerationJob.STATUS_DONE, 3))
+        self.assertEqual(User.objects.filter(is_fake=True).count(), 3)
+
+    def test_revoked_referral_earns_nothing(self):
+        moderation.run(ModerationJob.objects.create(action=ModerationJob.ACTION_SCAM,
+                                                    user_ids=[self.scammers[0].pk], total=1).pk)
+        walk = Walk.objects.create(user=self.scammers[0], start_time=now(), reward=20)
+
+        with transaction.atomic():
+            walk_pipeline.apply_referral(walk)
+
+        self.inviter.refresh_from_db()
+        self.assertEqual(self.inviter.points, 99)
+
+    def test_admin_action_enqueues_job(self):
+        self.client.force_login(AuthUser.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+        with mock.patch('move_on.tasks.run_moderation_job.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:move_on_user_changelist'), {
+                'action': 'moderate_deactivate', 'select_across': '1', 'index': '0',
+                '_selected_action': [self.inviter.pk], 'is_scam__exact': '0',
+            })
+
+        self.assertEqual(response.status_code, 302)
+        job = ModerationJob.objects.get()
+        self.assertEqual((job.action, job.total), (ModerationJob.ACTION_DEACTIVATE, 4))
+        delay.assert_called_once_with(job.pk)
+        self.assertEqual(self.client.get(reverse('admin:move_on_moderationjob_changelist')).status_code, 200)
+
+
+@override_settings(REFERRAL_CLUSTER_MIN_SIZE=5, REFERRAL_CLUSTER_MIN_FANOUT=3)
+class ReferralGraphTestCase(APITestCase):
+    def invite(self, user, inviter):
+        Referral.objects.create(user=user, invited_by=inviter)
+        referral_graph.add_edge(user.pk, inviter.pk)
+
+    def setUp(self):
+        self.users = [User.objects.create(telegram_id=i, points=10 * i) for i in range(1, 8)]
+        root, a, b, c, d, e, f = self.users
+        # root → a → c → e, root → b → d; f ни с кем не связан
+        for user, inviter in ((a, root), (b, root), (c, a), (d, b), (e, c)):
+            self.invite(user, inviter)
+
+    def closure(self):
+        return set(ReferralClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def test_closure_matches_rebuild(self):
+        incremental = self.closure()
+
+        self.assertEqual(referral_graph.rebuild(), 9)
 
-        self.assertFalse(task.is_completed)
+        self.assertEqual(self.closure(), incremental)
+        self.assertIn((self.users[0].pk, self.users[5].pk, 3), incremental)
 
-        url = reverse('tasks_complete')
-        data = {
-            'task_id': task.id,
-            'telegram_id': user.telegram_id
+    def test_top_referrals_with_levels(self):
+        response = self.client.get(reverse('user-top-referrals', args=[1]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['points'] for item in response.data['user_referrals']], [30, 20])
+        self.assertEqual(response.data['referral_count'], 2)
+        self.assertEqual(response.data['network_size'], 5)
+        self.assertEqual(response.data['levels'], [
+            {'depth': 1, 'users': 2, 'points': 50},
+            {'depth': 2, 'users': 2, 'points': 90},
+            {'depth': 3, 'users': 1, 'points': 60},
+        ])
+
+    def test_components_match_traversal(self):
+        rng = np.random.default_rng(1)
+        size = 2000
+        src, dst = rng.integers(0, size, 1500), rng.integers(0, size, 1500)
+
+        labels = referral_graph.components(src, dst, size)
+
+        neighbours = [[] for _ in range(size)]
+        for u, v in zip(src.tolist(), dst.tolist()):
+            neighbours[u].append(v)
+            neighbours[v].append(u)
+        for start in range(size):
+            seen, stack = {start}, [start]
+            while stack:
+                for v in neighbours[stack.pop()]:
+                    if v not in seen:
+                        seen.add(v)
+                        stack.append(v)
+            self.assertEqual(labels[start], min(seen))
+
+    def test_fanout_cluster_of_inactive_accounts_is_logged_once(self):
+        hub = self.users[6]
+        for i in range(6):
+            self.invite(User.objects.create(telegram_id=100 + i), hub)
+        # Активная сеть root того же размера не подозрительна
+        for user in self.users[:6]:
+            Statistics.objects.create(user=user, total_steps=50000)
+        self.invite(User.objects.create(telegram_id=200), self.users[0])
+        self.invite(User.objects.create(telegram_id=201), self.users[0])
+
+        clusters = referral_graph.find_clusters()
+        referral_graph.find_clusters()
+
+        self.assertEqual(clusters, [{'user_id': hub.pk, 'size': 7, 'fanout': 6, 'low_activity_share': 1.0}])
+        self.assertEqual(list(AnomalyLog.objects.values_list('user_id', flat=True)), [hub.pk])
+
+
+class NotificationTestCase(TestCase):
+    def setUp(self):
+        calls = Counter()
+
+        def respond(path, payload):
+            chat_id = payload['chat_id']
+            calls[chat_id] += 1
+            if chat_id == 1002 and calls[chat_id] == 1:
+                return 429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 0}}
+            if chat_id == 1003:
+                return 403, {"ok": False, "description": "Forbidden: bot was blocked by the user"}
+            if chat_id == 1004:
+                return 400, {"ok": False, "description": "Bad Request: chat not found"}
+            return 200, {"ok": True, "result": {}}
+
+        self.server = StubHTTPServer(respond)
+        self.addCleanup(self.server.stop)
+        self.calls = calls
+        settings_override = override_settings(
+            TELEGRAM_BOT_TOKEN='token', TELEGRAM_API_URL=self.server.url, NOTIFY_RATE_PER_SECOND=1000,
+            NOTIFY_CHAT_INTERVAL=0, NOTIFY_RETRY_BACKOFF=0, NOTIFY_CHUNK_SIZE=2,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for telegram_id in range(1001, 1006):
+            User.objects.create(telegram_id=telegram_id)
+        User.objects.create(telegram_id=1006, is_scam=True)
+
+    def test_campaign_counts_results_and_retries_rate_limited(self):
+        campaign = NotificationCampaign.objects.create(
+            name='Бонус', segment=NotificationCampaign.SEGMENT_ALL, text='Бонус!', status=NotificationCampaign.STATUS_PENDING)
+
+        campaign = notifications.run(campaign.pk)
+
+        self.assertEqual(campaign.status, NotificationCampaign.STATUS_DONE)
+        self.assertEqual((campaign.sent, campaign.blocked, campaign.failed, campaign.rate_limited), (3, 1, 1, 1))
+        self.assertEqual(campaign.cursor, 1005)
+        self.assertEqual(dict(self.calls), {1001: 1, 1002: 2, 1003: 1, 1004: 1, 1005: 1})
+        self.assertEqual(self.server.requests[0][0], '/bottoken/sendMessage')
+        self.assertGreater(campaign.throughput, 0)
+
+    def test_campaign_resumes_from_cursor(self):
+        campaign = NotificationCampaign.objects.create(
+            name='Бонус', segment=NotificationCampaign.SEGMENT_ALL, text='Бонус!', cursor=1003,
+            status=NotificationCampaign.STATUS_PAUSED)
+
+        self.assertIsNone(notifications.run(campaign.pk))
+        with mock.patch('move_on.tasks.run_notification_campaign.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(notifications.start([campaign.pk]), 1)
+        delay.assert_called_once_with(campaign.pk)
+        campaign = notifications.run(campaign.pk)
+
+        self.assertEqual(campaign.status, NotificationCampaign.STATUS_DONE)
+        self.assertEqual(set(self.calls), {1004, 1005})
+
+    def test_rate_limiter_spaces_messages(self):
+        limiter = notifications.RateLimiter(rate=50, chat_interval=0.2)
+
+        async def acquire_all(chat_ids):
+            started = time.monotonic()
+            for chat_id in chat_ids:
+                await limiter.acquire(chat_id)
+            return time.monotonic() - started
+
+        self.assertGreaterEqual(asyncio.run(acquire_all(range(10))), 0.17)
+        self.assertGreaterEqual(asyncio.run(acquire_all([1, 1])), 0.19)
+        limiter.pause(0.2)
+        self.assertGreaterEqual(asyncio.run(acquire_all([100])), 0.19)
+
+    def test_streak_reminder_targets_streaks_claimed_yesterday(self):
+        yesterday = now().date() - timedelta(days=1)
+        for telegram_id, streak, last_claim_date in ((1001, 3, yesterday), (1002, 2, now().date()),
+                                                     (1003, 1, yesterday - timedelta(days=2)), (1006, 5, yesterday)):
+            DailyBonus.objects.create(user=User.objects.get(telegram_id=telegram_id), streak=streak,
+                                      last_claim_date=last_claim_date)
+
+        self.assertEqual(notifications.next_chunk(NotificationCampaign.SEGMENT_STREAK_REMINDER, 0, 10), [1001])
+
+
+class TaskProgressTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(telegram_id=777)
+        yesterday = date.today() - timedelta(days=1)
+        self.steps = Task.objects.create(name='8000 шагов', metric='steps', target=8000, reward=10)
+        self.walks = Task.objects.create(name='2 прогулки', metric='walks', target=2, reward=5)
+        self.distance = Task.objects.create(name='5 км', task_type='challenge', metric='distance', target=5,
+                                            start_date=yesterday, reward=20)
+        self.streak = Task.objects.create(name='Стрик 3 дня', task_type='challenge', metric='streak', target=3)
+        self.inactive = Task.objects.create(name='Архив', metric='steps', target=1, is_active=False)
+
+    def walk(self, steps, distance, is_valid=True):
+        walk = Walk.objects.create(user=self.user, start_time=now(), end_time=now(), steps=steps, distance=distance,
+                                   is_valid=is_valid)
+        walk_pipeline.run_step(walk.pk, 'tasks', walk_pipeline.apply_tasks)
+        return walk
+
+    def claim_bonus(self, days_ago=0):
+        with mock.patch('move_on.models.now', return_value=now() - timedelta(days=days_ago)):
+            response = self.client.post(reverse('claim_daily_bonus', args=[777]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def progress(self):
+        return {
+            progress.task_id: (progress.value, progress.completed_at is not None)
+            for progress in TaskProgress.objects.filter(user=self.user)
         }
-        response = self.client.post(url, data, format='json')
 
-        print("Response status:", response.status_code)
-        print("Response data:", response.json())
+    def test_walks_advance_and_complete_tasks(self):
+        self.claim_bonus(days_ago=2)
+        self.claim_bonus(days_ago=1)
+        self.walk(steps=5000, distance=3000)
+        self.assertEqual(self.progress(), {
+            self.steps.pk: (5000, False), self.walks.pk: (1, False),
+            self.distance.pk: (3, False), self.streak.pk: (2, False),
+        })
+
+        self.claim_bonus()
+        walk = self.walk(steps=4000, distance=2500)
+        self.walk(steps=100000, distance=0, is_valid=False)
+        # Шаг выполняется для прогулки один раз
+        walk_pipeline.run_step(walk.pk, 'tasks', walk_pipeline.apply_tasks)
+
+        self.assertEqual(self.progress(), {
+            self.steps.pk: (9000, True), self.walks.pk: (2, True),
+            self.distance.pk: (5.5, True), self.streak.pk: (3, True),
+        })
+
+    def test_broken_streak_does_not_count(self):
+        self.claim_bonus(days_ago=3)
+        self.claim_bonus(days_ago=2)
+        self.walk(steps=100, distance=0)
+        self.assertNotIn(self.streak.pk, self.progress())
+
+    def test_reward_is_claimed_once_after_completion(self):
+        url = reverse('tasks_complete', args=[self.steps.pk])
+        self.walk(steps=5000, distance=0)
+
+        response = self.client.post(url, {'telegram_id': 777}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.walk(steps=5000, distance=0)
+        response = self.client.post(url, {'telegram_id': 777}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['new_points'], 10)
+
+        tasks = {item['id']: item for item in self.client.get(reverse('user_tasks', args=[777])).data['tasks']}
+        self.assertEqual((tasks[self.steps.pk]['progress'], tasks[self.steps.pk]['claimed']), (10000, True))
+        self.assertEqual((tasks[self.walks.pk]['completed'], tasks[self.walks.pk]['claimed']), (True, False))
+        self.assertNotIn(self.inactive.pk, tasks)
+
+
+@override_settings(REDIS_URL='')
+class ChallengeLeaderboardTestCase(APITestCase):
+    def setUp(self):
+        task_progress.reset_index()
+        self.users = [User.objects.create(telegram_id=900 + i, username=f"walker{i}") for i in range(4)]
+        self.challenge = Task.objects.create(
+            name='Шаги за неделю', task_type='challenge', metric='steps', target=100000,
+            start_date=date.today() - timedelta(days=1), end_date=date.today() + timedelta(days=5))
+        self.url = reverse('challenge_leaderboard', args=[self.challenge.pk])
+
+    def walk(self, user, steps, end_time=None):
+        end_time = end_time or now()
+        walk = Walk.objects.create(user=user, start_time=end_time, end_time=end_time, steps=steps, distance=0)
+        walk_pipeline.run_step(walk.pk, 'tasks', walk_pipeline.apply_tasks)
+
+    def test_scores_count_only_walks_within_challenge(self):
+        self.walk(self.users[0], 3000)
+        self.walk(self.users[0], 2000)
+        self.walk(self.users[1], 5000)
+        self.walk(self.users[2], 4000)
+        self.walk(self.users[2], 90000, end_time=now() - timedelta(days=3))
+
+        response = self.client.get(self.url, {'telegram_id': 902, 'limit': 2})
 
-        task.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['frozen'])
+        self.assertEqual([(entry['rank'], entry['username'], entry['score']) for entry in response.data['top']],
+                         [(1, 'walker0', 5000), (1, 'walker1', 5000)])
+        self.assertEqual((response.data['me']['rank'], response.data['me']['score']), (3, 4000))
+        self.assertIsNone(self.client.get(self.url, {'telegram_id': 903}).data['me'])
+
+    def test_finished_challenge_is_frozen_once(self):
+        self.walk(self.users[0], 3000)
+        self.walk(self.users[1], 7000)
+        Task.objects.filter(pk=self.challenge.pk).update(end_date=date.today() - timedelta(days=1))
+
+        self.assertEqual(challenges.maintain()['frozen'], [self.challenge.pk])
+        self.assertEqual(challenges.maintain()['frozen'], [])
+        # Прогресс после окончания на снимок не влияет
+        TaskProgress.objects.filter(user=self.users[0]).update(value=10000)
+
+        response = self.client.get(self.url, {'telegram_id': 900})
+        self.assertTrue(response.data['frozen'])
+        self.assertEqual([(entry['rank'], entry['user_id']) for entry in response.data['top']],
+                         [(1, self.users[1].pk), (2, self.users[0].pk)])
+        self.assertEqual(response.data['me']['score'], 3000)
+        self.assertEqual(ChallengeResult.objects.filter(task=self.challenge).count(), 2)
+
+    def test_moderated_users_leave_leaderboard(self):
+        for user, steps in zip(self.users, (3000, 7000, 5000)):
+            self.walk(user, steps)
+        client = mock.MagicMock()
+        job = ModerationJob.objects.create(action=ModerationJob.ACTION_SCAM, user_ids=[self.users[1].pk], total=1)
+
+        with mock.patch('move_on.challenges.get_redis', return_value=client), \
+                self.captureOnCommitCallbacks(execute=True):
+            moderation.run(job.pk)
+        User.objects.filter(pk=self.users[2].pk).update(is_active=False)
+
+        client.pipeline.return_value.zrem.assert_called_once_with(challenges.key(self.challenge.pk), self.users[1].pk)
+        response = self.client.get(self.url, {'telegram_id': 901})
+        self.assertEqual([entry['username'] for entry in response.data['top']], ['walker0'])
+        self.assertIsNone(response.data['me'])
+
+    def test_tasks_without_leaderboard_are_not_found(self):
+        daily = Task.objects.create(name='8000 шагов', metric='steps', target=8000)
+
+        response = self.client.get(reverse('challenge_leaderboard', args=[daily.pk]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(REDIS_URL='')
+class ConditionalResponseTestCase(APITestCase):
+    def setUp(self):
+        identity_cache.local_tier.clear()
+        self.user = User.objects.create(telegram_id=555)
+        Statistics.objects.create(user=self.user, total_steps=1000)
+
+    def test_shared_tasks_are_revalidated_with_one_query(self):
+        task = Task.objects.create(name='8000 шагов', reward=10)
+        url = reverse('get_tasks')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        with self.assertNumQueries(1):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+        task.name = '10000 шагов'
+        task.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, status.HTTP_200_OK)
+
+    def test_user_data_is_revalidated_by_version(self):
+        url = reverse('get_statistics', args=[555])
+        versions = {}
+        with mock.patch.object(conditional, 'version', lambda user_id, scope: versions.setdefault(scope, 'a')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('private', response['Cache-Control'])
+
+            with self.assertNumQueries(0):
+                cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            # Шаг stats завершения прогулки меняет версию
+            versions['stats'] = 'b'
+            changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual((changed.status_code, changed.json()['total_steps']), (status.HTTP_200_OK, 1000))
+
+    def test_without_redis_user_data_is_sent_in_full(self):
+        response = self.client.get(reverse('get_statistics', args=[555]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('ETag', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_energy_etag_is_taken_from_body(self):
+        url = reverse('get_energy', args=[555])
+        response = self.client.get(url)
+
+        cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class AssetPipelineTestCase(TestCase):
+    @override_settings(ASSET_BROTLI_QUALITY=5)
+    def test_build_assets_writes_manifest_and_compressed_copies(self):
+        import brotli
+        from django.core.management import call_command
+        from django.templatetags.static import static
+
+        with tempfile.TemporaryDirectory() as root, override_settings(STATIC_ROOT=root):
+            call_command('build_assets', verbosity=0, stdout=StringIO())
+
+            with open(os.path.join(root, 'staticfiles.json')) as manifest:
+                paths = json.load(manifest)['paths']
+            # Файлы Vite уже с хэшем и не переименовываются, остальные получают хэш в имени
+            self.assertEqual(paths['index-DXif8KBr.js'], 'index-DXif8KBr.js')
+            self.assertRegex(paths['admin/css/base.css'], r'^admin/css/base\.[0-9a-f]{12}\.css$')
+            self.assertEqual(static('admin/css/base.css'), f"/static/{paths['admin/css/base.css']}")
+            self.assertRegex(paths['admin/img/icon-calendar.svg'], r'^admin/img/icon-calendar\.[0-9a-f]{12}\.svg$')
+            # nginx кэширует навсегда только имена с хэшем, исходные имена переспрашиваются
+            for name, hashed in paths.items():
+                self.assertRegex(hashed, assets.HASHED_NAME)
+                if name != hashed:
+                    self.assertNotRegex(name, assets.HASHED_NAME)
+
+            script = os.path.join(root, 'index-DXif8KBr.js')
+            with open(script, 'rb') as source, open(script + '.gz', 'rb') as packed_gz, \
+                    open(script + '.br', 'rb') as packed_br:
+                data = source.read()
+                self.assertEqual(gzip.decompress(packed_gz.read()), data)
+                self.assertEqual(brotli.decompress(packed_br.read()), data)
+
+            # Повторная сборка не пересжимает неизменившиеся файлы
+            self.assertEqual(assets.compress(root), {'.gz': 0, '.br': 0})
+
+    def test_entry_page_is_rendered_once_and_revalidated(self):
+        views._entry_page.clear()
+        url = reverse('home')
+
+        with mock.patch.object(views, 'render_to_string', wraps=views.render_to_string) as render:
+            response = self.client.get(url)
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            again = self.client.get(url)
+
+        self.assertEqual(render.call_count, 1)
+        self.assertIn(b'index-DXif8KBr.js', response.content)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(again.content, response.content)
+
+
+@override_settings(REDIS_URL='')
+class DailyBonusTestCase(APITestCase):
+    def test_bonus_is_credited_once_per_day(self):
+        user = User.objects.create(telegram_id=321, points=0)
+        url = reverse('claim_daily_bonus', args=[321])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            responses = [self.client.post(url) for _ in range(3)]
+
+        self.assertEqual([response.status_code for response in responses],
+                         [status.HTTP_200_OK, status.HTTP_400_BAD_REQUEST, status.HTTP_400_BAD_REQUEST])
+        self.assertEqual(responses[0].data['totalPoints'], 10)
         user.refresh_from_db()
+        self.assertEqual(user.points, 10)
+        daily_bonus = DailyBonus.objects.get(user=user)
+        self.assertEqual((daily_bonus.streak, daily_bonus.last_claim_date), (1, now().date()))
+
+        history = self.client.get(reverse('streak_history', args=[321])).data
+        today = next(day for day in history['days'] if day['isCurrent'])
+        self.assertEqual((today['coinsEarned'], today['bonusReceived']), (10, True))
+
+
+class HealthCheckTestCase(APITestCase):
+    def test_live(self):
+        response = self.client.get(reverse('health_live'))
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue(task.is_completed)
-        self.assertEqual(user.points, 5)
 
+    @override_settings(REDIS_URL='')
+    def test_ready_checks_database(self):
+        response = self.client.get(reverse('health_ready'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()['checks']['db']['ok'])
+
+    @override_settings(REDIS_URL='redis://127.0.0.1:1/0')
+    def test_ready_fails_when_redis_is_down(self):
+        response = self.client.get(reverse('health_ready'))
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(response.json()['checks']['redis']['ok'])
+
+
+class StartupTestCase(SimpleTestCase):
+    def test_cold_start_skips_heavy_imports(self):
+        from .management.commands.profile_startup import measure_startup
+
+        result = measure_startup('web')
+
+        for package in ('numpy', 'scipy', 'geopy', 'haversine'):
+            self.assertNotIn(package, result['packages'])
+        self.assertLess(result['wall_ms'], settings.STARTUP_BUDGET_MS)
+
+
+@override_settings(REDIS_URL='')
+class IdentityCacheTestCase(TestCase):
+    def setUp(self):
+        identity_cache.local_tier.clear()
+
+    def test_lookup_hits_local_tier_after_first_query(self):
+        user = User.objects.create(telegram_id=777, username="walker")
+        identity_cache.local_tier.clear()
+
+        with self.assertNumQueries(1):
+            identity_cache.lookup(777)
+        with self.assertNumQueries(0):
+            identity = identity_cache.lookup("777")
+
+        self.assertEqual(identity['id'], user.id)
+        self.assertEqual(identity['username'], "walker")
+
+    def test_save_refreshes_and_delete_invalidates(self):
+        user = User.objects.create(telegram_id=778, username="old")
+        user.username = "new"
+        user.save()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(identity_cache.lookup(778)['username'], "new")
+
+        user.delete()
+
+        self.assertIsNone(identity_cache.lookup(778))
+
+    def test_energy_save_keeps_cached_entry(self):
+        user = User.objects.create(telegram_id=779)
+        cached = identity_cache.local_tier.get(779)
+        user.energy = 50
+        user.save()
+
+        self.assertIs(identity_cache.local_tier.get(779), cached)
+
+    def test_lru_evicts_oldest(self):
+        with self.settings(IDENTITY_CACHE_SIZE=2):
+            for key in (1, 2, 3):
+                identity_cache.local_tier.set(key, {'id': key})
+
+        self.assertIsNone(identity_cache.local_tier.get(1))
+        self.assertEqual(identity_cache.local_tier.get(3), {'id': 3})
+
+
+@override_settings(COUNTER_BUFFER='memory', REDIS_URL='')
+class CounterBufferTestCase(TestCase):
+    def setUp(self):
+        counters.memory_buffer.clear()
+        self.user = User.objects.create(telegram_id=555, points=10)
+
+    def test_deltas_are_buffered_and_overlaid(self):
+        counters.add(self.user.pk, points=5)
+        counters.add(self.user.pk, points=2.5)
+
+        stored = User.objects.get(pk=self.user.pk)
+        self.assertEqual(stored.points, 10)
+        self.assertEqual(counters.overlay(stored).points, 17.5)
+
+    def test_flush_applies_deltas_without_touching_updated_at(self):
+        updated_at = self.user.updated_at
+        counters.add(self.user.pk, points=5, energy=-30)
+
+        self.assertEqual(counters.flush(), 1)
+
+        stored = User.objects.get(pk=self.user.pk)
+        self.assertEqual((stored.points, stored.energy), (15, 70))
+        self.assertEqual(stored.updated_at, updated_at)
+        self.assertIsNone(counters.pending(self.user.pk))
+
+    def test_full_buffer_is_flushed_synchronously(self):
+        other = User.objects.create(telegram_id=556)
+        with self.settings(COUNTER_BUFFER_MAX_USERS=2):
+            counters.add(self.user.pk, points=1)
+            counters.add(other.pk, points=1)
+
+        self.assertEqual(User.objects.get(pk=other.pk).points, 1)
+        self.assertIsNone(counters.pending(self.user.pk))
+
+    def test_energy_restore_is_not_applied_twice(self):
+        User.objects.filter(pk=self.user.pk).update(energy=50, last_energy_update=now() - timedelta(minutes=25))
+
+        User.objects.get(pk=self.user.pk).update_energy()
+        user = User.objects.get(pk=self.user.pk)
+        user.update_energy()
+
+        self.assertEqual(user.energy, 52)
+        counters.flush()
+        self.assertEqual(User.objects.get(pk=self.user.pk).energy, 52)
+
+    def test_saving_overlaid_user_keeps_buffered_counters(self):
+        counters.add(self.user.pk, points=5)
+        user = counters.overlay(User.objects.get(pk=self.user.pk))
+        user.username = "renamed"
+        user.save()
+        counters.flush()
+
+        stored = User.objects.get(pk=self.user.pk)
+        self.assertEqual((stored.username, stored.points), ("renamed", 15))
+
+
+@override_settings(REDIS_URL='', COUNTER_BUFFER='off')
+class OfflineWalkTestCase(TestCase):
+    def setUp(self):
+        identity_cache.local_tier.clear()
+        throttling.reset()
+        self.user = User.objects.create(telegram_id=4242)
+        count = 600
+        self.payload = {
+            "telegram_id": 4242,
+            "idempotency_key": "walk-1",
+            "start_time": "2024-11-20T10:00:00+03:00",
+            "samples": {
+                "t": [i * 0.5 for i in range(count)],
+                "accX": [0.0] * count,
+                "accY": [0.0] * count,
+                "accZ": [9.8 + (3.0 if i % 4 == 0 else 0.0) for i in range(count)],
+                # Шаг ~2.2 м на каждый всплеск ускорения: прогулка проходит anticheat
+                "latitude": [55.75 + (i // 4) * 0.00002 for i in range(count)],
+                "longitude": [37.61] * count,
+            },
+        }
+
+    def post(self, payload):
+        body = gzip.compress(json.dumps(payload).encode())
+        with self.captureOnCommitCallbacks(execute=False):
+            return self.client.post(reverse('offline_walk'), body, content_type='application/json',
+                                    headers={'Content-Encoding': 'gzip'})
+
+    def test_duplicate_submission_is_not_stored_twice(self):
+        first = self.post(self.payload)
+        second = self.post(self.payload)
+
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(second.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(first.json()['submission_id'], second.json()['submission_id'])
+        self.assertTrue(second.json()['duplicate'])
+        self.assertEqual(OfflineWalkSubmission.objects.count(), 1)
+
+    def test_processing_creates_walk_exactly_once(self):
+        submission_id = self.post(self.payload).json()['submission_id']
+
+        walk_id = offline_walks.process(submission_id)
+        self.assertEqual(offline_walks.process(submission_id), walk_id)
+
+        walk = Walk.objects.get(user=self.user)
+        self.assertEqual(walk.pk, walk_id)
+        self.assertEqual(walk.steps, 149)
+        self.assertAlmostEqual(walk.distance, 149 * 2.22, delta=5)
+        walk_pipeline.run_steps(walk_id)
+        stats = Statistics.objects.get(user=self.user)
+        self.assertEqual(stats.total_steps, 149)
+        self.assertAlmostEqual(User.objects.get(pk=self.user.pk).points, walk.reward)
+        response = self.post(self.payload).json()
+        self.assertEqual((response['status'], response['walk_id']), ('done', walk_id))
+
+    def test_invalid_payload(self):
+        del self.payload['samples']['t']
+
+        response = self.post(self.payload)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_same_samples_with_new_key_are_not_paid_twice(self):
+        submission_id = self.post(self.payload).json()['submission_id']
+        walk_id = offline_walks.process(submission_id)
+        points = User.objects.get(pk=self.user.pk).points
+
+        response = self.post({**self.payload, 'idempotency_key': 'walk-2'}).json()
+
+        self.assertEqual((response['submission_id'], response['walk_id'], response['duplicate']),
+                         (submission_id, walk_id, True))
+        self.assertEqual(Walk.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(User.objects.get(pk=self.user.pk).points, points)
+
+    def test_overlapping_walk_is_rejected(self):
+        offline_walks.process(self.post(self.payload).json()['submission_id'])
+        self.payload['samples']['accX'][0] = 0.5
+        overlapping = {**self.payload, 'idempotency_key': 'walk-2', 'start_time': '2024-11-20T10:02:00+03:00'}
+
+        response = self.post(overlapping)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(OfflineWalkSubmission.objects.count(), 1)
+
+    def test_overlapping_pending_walks_create_one_walk(self):
+        first = self.post(self.payload).json()['submission_id']
+        self.payload['samples']['accX'][0] = 0.5
+        second = self.post({**self.payload, 'idempotency_key': 'walk-2',
+                            'start_time': '2024-11-20T10:02:00+03:00'}).json()['submission_id']
+
+        self.assertIsNotNone(offline_walks.process(first))
+        self.assertIsNone(offline_walks.process(second))
+
+        self.assertEqual(OfflineWalkSubmission.objects.get(pk=second).status, 'failed')
+        self.assertEqual(Walk.objects.filter(user=self.user).count(), 1)
+
+    def test_future_walk_is_rejected(self):
+        self.payload['start_time'] = (now() + timedelta(hours=1)).isoformat()
+
+        response = self.post(self.payload)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(OfflineWalkSubmission.objects.exists())
+
+    def test_energy_must_be_full(self):
+        User.objects.filter(pk=self.user.pk).update(energy=50, last_energy_update=now())
+
+        response = self.post(self.payload)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(OfflineWalkSubmission.objects.exists())
+
+    def test_non_numeric_samples_fail_without_retry(self):
+        self.payload['samples']['accX'][0] = "x"
+        submission_id = self.post(self.payload).json()['submission_id']
+
+        self.assertIsNone(offline_walks.process(submission_id))
+        self.assertEqual(OfflineWalkSubmission.objects.get(pk=submission_id).status, 'failed')
+        self.assertFalse(Walk.objects.exists())
+
+
+@override_settings(REDIS_URL='', COUNTER_BUFFER='off')
+class WalkFinalizationTestCase(APITestCase):
+    def setUp(self):
+        throttling.reset()
+        self.inviter = User.objects.create(telegram_id=1000)
+        self.user = User.objects.create(telegram_id=1001, daily_streak=1)
+        Referral.objects.create(user=self.user, invited_by=self.inviter, reward_percentage=10)
+        self.session = WalkSession.objects.create(user=self.user, steps=2000, distance=1500, avg_speed=1.5)
+
+    def finish(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post(reverse('walk_finish', args=[self.session.id]))
+        return response, callbacks
+
+    def test_duplicate_finish_collapses(self):
+        first, first_callbacks = self.finish()
+        second, second_callbacks = self.finish()
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.json()['reward'], second.json()['reward'])
+        self.assertFalse(first.json()['duplicate'])
+        self.assertTrue(second.json()['duplicate'])
+        self.assertEqual((len(first_callbacks), len(second_callbacks)), (1, 0))
+
+    def test_update_after_finish_is_rejected(self):
+        self.finish()
+
+        response = self.client.put(reverse('walk-detail', args=[self.session.id]),
+                                   {**SAMPLE, 'walk_id': self.session.id}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_pipeline_runs_each_step_once(self):
+        reward = self.finish()[0].json()['reward']
+
+        walk_id = walk_pipeline.run(self.session.id)
+        walk_pipeline.persist(self.session.id)
+        walk_pipeline.run_steps(walk_id)
+
+        walk = Walk.objects.get(user=self.user)
+        self.assertEqual(walk.pk, walk_id)
+        self.assertEqual(walk.reward, reward)
+        self.assertEqual(walk.finalized_steps, ['anticheat', 'stats', 'referral', 'tasks'])
+        self.assertFalse(WalkSession.objects.filter(id=self.session.id).exists())
+        self.assertEqual(Statistics.objects.get(user=self.user).total_steps, 2000)
+        self.assertAlmostEqual(User.objects.get(pk=self.user.pk).points, reward)
+        self.assertAlmostEqual(User.objects.get(pk=self.inviter.pk).points, round(reward * 0.1, 2))
+
+    def test_anticheat_flags_implausible_walk(self):
+        WalkSession.objects.filter(pk=self.session.pk).update(steps=10, avg_speed=15)
+        self.finish()
+
+        walk_pipeline.run(self.session.id)
+
+        self.assertFalse(Walk.objects.get(user=self.user).is_valid)
+        self.assertEqual(AnomalyLog.objects.filter(user=self.user).count(), 1)
+
+    @override_settings(ANTICHEAT_MAX_SPEED_KMH=15)
+    def test_over_speed_walk_earns_nothing(self):
+        WalkSession.objects.filter(pk=self.session.pk).update(avg_speed=4.5)
+        self.assertGreater(self.finish()[0].json()['reward'], 0)
+
+        walk_id = walk_pipeline.run(self.session.id)
+        walk_pipeline.run_steps(walk_id)
 
+        walk = Walk.objects.get(pk=walk_id)
+        self.assertEqual((walk.is_valid, walk.reward), (False, 0))
+        self.assertEqual(User.objects.get(pk=self.user.pk).points, 0)
+        self.assertEqual(User.objects.get(pk=self.inviter.pk).points, 0)
+        self.assertEqual(Referral.objects.get(user=self.user).total_rewards, 0)
+        self.assertFalse(Statistics.objects.filter(user=self.user, total_steps__gt=0).exists())
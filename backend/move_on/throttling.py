@@ -0,0 +1,176 @@
+"""
+Ограничение частоты запросов на запись по telegram_id.
+
+Лимиты задаются в REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] в формате DRF ('5/s', '10/min') для каждой
+группы запросов (scope). Лимит читается как token bucket: ёмкость — число запросов, пополнение —
+число запросов за период, то есть допускается всплеск до лимита, а в среднем не больше лимита.
+
+Состояние корзины хранится в Redis и обновляется одним Lua-скриптом (общий лимит для всех процессов).
+Если Redis недоступен, используются корзины в памяти процесса: лимит тогда действует на каждый процесс
+отдельно, но продолжает защищать воркеры. Время проверки — manage.py bench_throttle.
+"""
+import threading
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .backpressure import TokenBucket
+from .metrics import registry
+from .redis_client import get_redis, mark_redis_down
+
+REDIS_PREFIX = "throttle:v1:"
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# KEYS: корзина. ARGV: пополнение (токенов в секунду), ёмкость.
+# Время берётся у Redis, чтобы часы процессов не влияли на лимит. Возвращает {1, 0} или {0, ожидание в секундах}.
+BUCKET_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+registry.describe("move_on_throttled_total", "counter", "Отклонённые ограничением частоты запросы по группам.")
+
+_script = None
+_local_buckets = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """
+    '10/min' → (пополнение в секунду, ёмкость).
+    """
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity / PERIODS[period[0]], capacity
+
+
+def _check_redis(client, key, rate, capacity):
+    global _script
+    if _script is None or _script.registered_client is not client:
+        _script = client.register_script(BUCKET_SCRIPT)
+    allowed, wait = _script(keys=[key], args=[rate, capacity], client=client)
+    return None if allowed else float(wait)
+
+
+def _check_local(key, rate, capacity):
+    with _local_lock:
+        bucket = _local_buckets.get(key)
+        if bucket is None or (bucket.rate, bucket.capacity) != (rate, capacity):
+            bucket = _local_buckets[key] = TokenBucket(rate, capacity)
+        _local_buckets.move_to_end(key)
+        while len(_local_buckets) > settings.THROTTLE_LOCAL_MAX_KEYS:
+            _local_buckets.popitem(last=False)
+    if bucket.take():
+        return None
+    return bucket.wait_time()
+
+
+def check(scope, ident):
+    """
+    Списывает запрос из корзины (scope, ident).
+    :return: None, если запрос разрешён, иначе через сколько секунд повторить.
+    """
+    rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+    if rate is None or ident is None:
+        return None
+    rate, capacity = parse_rate(rate)
+    key = f"{REDIS_PREFIX}{scope}:{ident}"
+
+    wait = None
+    client = get_redis()
+    try:
+        if client is None:
+            wait = _check_local(key, rate, capacity)
+        else:
+            wait = _check_redis(client, key, rate, capacity)
+    except redis.RedisError as e:
+        mark_redis_down(e)
+        wait = _check_local(key, rate, capacity)
+    if wait is not None:
+        registry.add([(("move_on_throttled_total", (("scope", scope),)), 1)])
+    return wait
+
+
+def reset():
+    """
+    Сбрасывает все корзины (тесты, ручная разблокировка).
+    """
+    with _local_lock:
+        _local_buckets.clear()
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        keys = list(client.scan_iter(f"{REDIS_PREFIX}*", count=1000))
+        if keys:
+            client.delete(*keys)
+    except redis.RedisError as e:
+        mark_redis_down(e)
+
+
+def request_ident(data, kwargs):
+    """
+    Кого ограничивать: telegram_id из URL или тела запроса, для обновлений прогулки без него — сессию.
+    """
+    telegram_id = kwargs.get('telegram_id') or data.get('telegram_id')
+    if telegram_id:
+        return str(telegram_id)
+    walk_id = data.get('walk_id') or kwargs.get('pk')
+    return f"walk:{walk_id}" if walk_id else None
+
+
+def throttled_response(wait):
+    """
+    Ответ 429 для представлений без DRF.
+    """
+    response = JsonResponse({"error": "Too many requests"}, status=429)
+    response['Retry-After'] = str(max(1, round(wait)))
+    return response
+
+
+class TelegramIdThrottle(BaseThrottle):
+    """
+    Throttle DRF с лимитом из DEFAULT_THROTTLE_RATES[scope] на telegram_id. Без telegram_id — по IP.
+    """
+    scope = None
+
+    def allow_request(self, request, view):
+        ident = request_ident(request.data, view.kwargs) or self.get_ident(request)
+        self.wait_seconds = check(self.scope, ident)
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class WalkUpdateThrottle(TelegramIdThrottle):
+    scope = 'walk_update'
+
+
+class DailyBonusThrottle(TelegramIdThrottle):
+    scope = 'daily_bonus'
+
+
+class TaskCompleteThrottle(TelegramIdThrottle):
+    scope = 'task_complete'
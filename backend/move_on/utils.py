@@ -1,20 +1,4 @@
-import numpy as np
-from scipy.signal import find_peaks
-from geopy.distance import geodesic
-
-
-def calculate_steps(acceleration_data, threshold=1.2):
-    """
-    Расчёт количества шагов на основе данных акселерометра.
-    :param acceleration_data: Список значений ускорений [{'x': ..., 'y': ..., 'z': ...}, ...].
-    :param threshold: Порог для определения шага.
-    :return: Количество шагов.
-    """
-    magnitudes = [
-        np.sqrt(data['x']**2 + data['y']**2 + data['z']**2) for data in acceleration_data
-    ]
-    peaks, _ = find_peaks(magnitudes, height=threshold)
-    return len(peaks)
+from .motion import calculate_steps, calculate_speed, calculate_speed_from_gps  # noqa: F401
 
 
 def calculate_distance(steps, step_length=0.75):
@@ -27,36 +11,6 @@ def calculate_distance(steps, step_length=0.75):
     return steps * step_length
 
 
-def calculate_speed(acceleration_data, delta_time):
-    """
-    Расчёт скорости на основе данных акселерометра.
-    :param acceleration_data: Список значений ускорений [{'x': ..., 'y': ..., 'z': ...}, ...].
-    :param delta_time: Время между измерениями (в секундах).
-    :return: Средняя скорость (в м/с).
-    """
-    magnitudes = [
-        np.sqrt(data['x']**2 + data['y']**2 + data['z']**2) for data in acceleration_data
-    ]
-    # Убираем гравитацию (~9.81 м/с²) из ускорений
-    adjusted_magnitudes = [max(0, mag - 9.81) for mag in magnitudes]
-    # Интегрируем ускорение по времени, чтобы получить скорость
-    speed = sum(adjusted_magnitudes) * delta_time / len(acceleration_data)
-    return speed
-
-
-def calculate_speed_from_gps(prev_coords, current_coords, delta_time):
-    """
-    Расчёт скорости на основе GPS-координат.
-    :param prev_coords: Предыдущие координаты (широта, долгота) в формате (lat, lon).
-    :param current_coords: Текущие координаты (широта, долгота) в формате (lat, lon).
-    :param delta_time: Время между измерениями (в секундах).
-    :return: Скорость (в м/с).
-    """
-    distance = geodesic(prev_coords, current_coords).meters  # Дистанция в метрах
-    speed = distance / delta_time if delta_time > 0 else 0
-    return speed
-
-
 def calculate_reward(distance_km, steps, avg_speed_kmh, daily_streak, endurance_level, efficiency_level, luck_level):
     """
     Рассчитывает итоговую награду за прогулку.
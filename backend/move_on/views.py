@@ -1,33 +1,50 @@
+import hashlib
 import json
 import logging
+import random
+import time
 from datetime import datetime, timedelta
 from math import radians, sin, cos, sqrt, atan2
 
-from django.db.models import Window, F, Count, Sum
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Window, F, Count, Sum, Max
 from django.db.models.functions import Rank
-from django.http import JsonResponse, HttpResponseBadRequest
-from django.shortcuts import get_object_or_404, render
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, throttle_classes
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ViewSet
-from .models import User, Walk, Task, WalkSession, Referral, Statistics
+from .models import User, Walk, Task, WalkSession, Referral, Statistics, DailyBonus
 from .serializers import UserSerializer, WalkSerializer, TaskSerializer, CompleteTaskSerializer
+from .metrics import registry
+from . import backpressure, conditional, counters, db_router, frontend_logs, identity_cache, live_stream, offline_walks, redis_client, \
+    challenges, referral_graph, task_progress, throttling, walk_pipeline
+from .throttling import WalkUpdateThrottle, DailyBonusThrottle, TaskCompleteThrottle
+from .walk_service import apply_sample, claim_session, save_sample
 from django.utils.timezone import now
-from scipy.signal import butter, filtfilt, find_peaks
-import numpy as np
-from haversine import haversine, Unit
-from .utils import *
+from .utils import calculate_reward
 
 logger = logging.getLogger("move_on")
 
+CHALLENGE_LEADERBOARD_LIMIT = 100
+DAILY_BONUS_POINTS = 10
+
 
 class WalkViewSet(ViewSet):
+    def get_throttles(self):
+        if self.action == 'update':
+            return [WalkUpdateThrottle()]
+        return super().get_throttles()
+
     @swagger_auto_schema(
         operation_description="Запуск прогулки.",
         request_body=openapi.Schema(
@@ -60,7 +77,7 @@ class WalkViewSet(ViewSet):
         """
         Запуск прогулки.
         """
-        logger.info("Received data:", request.data)
+        logger.debug(f"Received data: {request.data}")
 
         data = request.data
         telegram_id = data.get('telegram_id')
@@ -76,7 +93,8 @@ class WalkViewSet(ViewSet):
             if user.energy < user.max_energy:
                 return Response({"error": "Энергия должна быть полной для начала прогулки"}, status=400)
 
-            WalkSession.objects.filter(user=user).delete()
+            # Завершённые сессии удаляет walk_pipeline после сохранения прогулки
+            WalkSession.objects.filter(user=user, finished_at__isnull=True).delete()
             walk_session = WalkSession.objects.create(user=user)
 
             return Response({
@@ -113,6 +131,15 @@ class WalkViewSet(ViewSet):
                         'distance': openapi.Schema(type=openapi.TYPE_NUMBER),
                         'current_speed': openapi.Schema(type=openapi.TYPE_NUMBER),
                         'average_speed': openapi.Schema(type=openapi.TYPE_NUMBER),
+                        'telemetry': openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            description="Как часто клиенту снимать и отправлять замеры (см. backpressure)",
+                            properties={
+                                'sample_interval_ms': openapi.Schema(type=openapi.TYPE_INTEGER),
+                                'flush_interval_ms': openapi.Schema(type=openapi.TYPE_INTEGER),
+                                'motion': openapi.Schema(type=openapi.TYPE_STRING),
+                            },
+                        ),
                     },
                 ),
             ),
@@ -120,11 +147,12 @@ class WalkViewSet(ViewSet):
             404: openapi.Response(description="Прогулка не найдена"),
         },
     )
+    @backpressure.ingestion
     def update(self, request, pk=None):
         """
         Обновление данных прогулки.
         """
-        logger.info("Updating walk data...")
+        logger.debug("Updating walk data...")
         data = request.data
         walk_id = data.get("walk_id")
         acc_x = data.get("accX")
@@ -133,10 +161,10 @@ class WalkViewSet(ViewSet):
         latitude = data.get("latitude")
         longitude = data.get("longitude")
         speed_from_gps = data.get("speed", 0)
-        logger.info(f"Received accX: {acc_x}, accY: {acc_y}, accZ: {acc_z}")
-        logger.info(f"Received latitude: {latitude}, longitude: {longitude}, speed: {speed_from_gps}")
+        logger.debug(f"Received accX: {acc_x}, accY: {acc_y}, accZ: {acc_z}")
+        logger.debug(f"Received latitude: {latitude}, longitude: {longitude}, speed: {speed_from_gps}")
         if latitude == 0 and longitude == 0:
-            logger.info("Default coordinates received. GPS may not be available.")
+            logger.debug("Default coordinates received. GPS may not be available.")
 
         if not walk_id:
             logger.info("walk_id is required")
@@ -147,47 +175,30 @@ class WalkViewSet(ViewSet):
             return Response({"error": "Incomplete data provided"}, status=400)
 
         try:
-            walk_session = WalkSession.objects.get(id=walk_id)
+            walk_session = WalkSession.objects.select_related('user').get(id=walk_id)
+            if walk_session.finished_at is not None:
+                return Response({"error": "Walk already finished"}, status=status.HTTP_409_CONFLICT)
             user = walk_session.user
 
             user.update_energy()
             if user.energy <= 0:
-                walk_session.is_interrupted = True
-                walk_session.save()
-                return self.finish(request, pk=walk_session.id)
-
-            if acc_x is not None and acc_y is not None and acc_z is not None:
-                acceleration_data = [{"x": acc_x, "y": acc_y, "z": acc_z}]
-                steps = calculate_steps(acceleration_data)
-                walk_session.steps += steps
-
-            if latitude is not None and longitude is not None:
-                if walk_session.last_latitude and walk_session.last_longitude:
-                    prev_coords = (walk_session.last_latitude, walk_session.last_longitude)
-                    current_coords = (latitude, longitude)
-
-                    distance = calculate_speed_from_gps(prev_coords, current_coords, 1)
-                    if 2 < distance < 50:
-                        walk_session.distance += distance
-
-                walk_session.last_latitude = latitude
-                walk_session.last_longitude = longitude
+                return self._finish(walk_session.id, interrupted=True)
 
-            delta_time = (
-                datetime.now() - walk_session.last_step_time).total_seconds() if walk_session.last_step_time else 1
-            current_speed = speed_from_gps or calculate_speed(acceleration_data, delta_time)
-            walk_session.last_step_time = datetime.now()
+            steps_before = walk_session.steps
+            current_speed = apply_sample(walk_session, acc_x, acc_y, acc_z, latitude, longitude, speed_from_gps)
 
-            elapsed_time = (datetime.now() - walk_session.start_time).total_seconds()
-            walk_session.avg_speed = walk_session.distance / elapsed_time if elapsed_time > 0 else 0
-
-            walk_session.save()
+            if not save_sample(walk_session):
+                return Response({"error": "Walk already finished"}, status=status.HTTP_409_CONFLICT)
+            live_stream.publish(walk_session.id, live_stream.session_state(
+                walk_session, energy=user.energy, current_speed=current_speed))
 
             return Response({
                 "steps": walk_session.steps,
                 "distance": round(walk_session.distance, 2),
                 "current_speed": round(current_speed, 2),
-                "average_speed": round(walk_session.avg_speed, 2)
+                "average_speed": round(walk_session.avg_speed, 2),
+                "telemetry": backpressure.directive(
+                    walk_session.steps - steps_before, current_speed, walk_session.avg_speed),
             })
 
         except WalkSession.DoesNotExist:
@@ -215,53 +226,46 @@ class WalkViewSet(ViewSet):
     def finish(self, request, pk=None):
         """
         Завершение прогулки.
+        Награда в ответе предварительная: прогулка сохраняется и обрабатывается в фоне (см. walk_pipeline).
+        Повторный запрос для той же сессии возвращает ту же награду.
         """
         try:
-            walk_session = WalkSession.objects.get(id=pk)
-            reward = calculate_reward(
-                distance_km=walk_session.distance / 1000,
-                steps=walk_session.steps,
-                avg_speed_kmh=walk_session.avg_speed * 3.6,
-                daily_streak=walk_session.user.daily_streak,
-                endurance_level=walk_session.user.endurance_level,
-                efficiency_level=walk_session.user.efficiency_level,
-                luck_level=walk_session.user.luck_level,
-            )
-
-            Walk.objects.create(
-                user=walk_session.user,
-                start_time=walk_session.start_time,
-                end_time=now(),
-                steps=walk_session.steps,
-                distance=walk_session.distance,
-                avg_speed=walk_session.avg_speed,
-                reward=reward,
-            )
-
-            walk_session.delete()
-
-            return Response({
-                "message": "Прогулка завершена",
-                "reward": reward
-            })
-
+            return self._finish(pk)
         except WalkSession.DoesNotExist:
             return Response({"error": "Walk session not found"}, status=404)
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
+    def _finish(self, session_id, interrupted=False):
+        walk_session, claimed = claim_session(session_id, interrupted=interrupted)
+        if claimed:
+            transaction.on_commit(lambda: walk_pipeline.start(walk_session.id))
+            live_stream.publish(walk_session.id, live_stream.session_state(walk_session))
+        return Response({
+            "message": "Прогулка завершена",
+            "reward": walk_session.reward,
+            "duplicate": not claimed,
+        })
+
 
 class LogView(APIView):
     """
-    Получает логи с фронтенда и выводит их в консоль.
+    Принимает логи с фронтенда пачками и передаёт их в буферизованную запись (см. frontend_logs).
+
+    Тело запроса: одиночная запись {"level", "message", "user_id"}, список записей
+    или {"user_id": ..., "entries": [...]}. Слишком большие тела отклоняются до разбора JSON.
     """
     def post(self, request, *args, **kwargs):
-        level = request.data.get("level", "info")
-        message = request.data.get("message", "No message provided")
-        user_id = request.data.get("user_id", "Unknown User")
+        try:
+            content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > settings.FRONTEND_LOG_MAX_BYTES:
+            return Response({"error": "Payload too large"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
 
-        print(f"[{level.upper()}] User: {user_id} - {message}")
-        return Response({"status": "log received"}, status=status.HTTP_200_OK)
+        accepted, dropped = frontend_logs.ingest(request.data)
+        return Response({"status": "log received", "accepted": accepted, "dropped": dropped},
+                        status=status.HTTP_202_ACCEPTED)
 
 
 def update_data(request):
@@ -328,13 +332,14 @@ def update_data(request):
         500: "Ошибка сервера",
     }
 )
+@conditional.conditional()
 @api_view(['GET'])
 def get_energy(request, telegram_id):
     """
     Возвращает текущую энергию пользователя по его Telegram ID.
     """
     try:
-        user = User.objects.get(telegram_id=telegram_id)
+        user = counters.overlay(User.objects.get(telegram_id=telegram_id))
         return JsonResponse({'energy': user.energy}, status=200)
     except User.DoesNotExist:
         return JsonResponse({'error': 'User not found'}, status=404)
@@ -401,10 +406,10 @@ def walk_history(request, telegram_id):
     Поддерживает пагинацию для большого количества прогулок.
     """
     try:
-        user = get_object_or_404(User, telegram_id=telegram_id)
+        user_id = identity_cache.get_user_id_or_404(telegram_id)
         paginator = PageNumberPagination()
         paginator.page_size = 10
-        walks = Walk.objects.filter(user=user).order_by('-start_time').select_related('user')
+        walks = Walk.objects.filter(user_id=user_id).order_by('-start_time').select_related('user')
         paginated_walks = paginator.paginate_queryset(walks, request)
 
         serializer = WalkSerializer(paginated_walks, many=True)
@@ -413,23 +418,56 @@ def walk_history(request, telegram_id):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@swagger_auto_schema(
+    methods=['get'],
+    operation_description="Возвращает доступные задания с прогрессом пользователя за текущий период.",
+    responses={
+        200: openapi.Response(
+            description="Задания с прогрессом.",
+            schema=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'tasks': openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                'id': openapi.Schema(type=openapi.TYPE_INTEGER, description="ID задания."),
+                                'progress': openapi.Schema(type=openapi.TYPE_NUMBER, description="Накопленное значение показателя."),
+                                'completed': openapi.Schema(type=openapi.TYPE_BOOLEAN, description="Задание выполнено."),
+                                'claimed': openapi.Schema(type=openapi.TYPE_BOOLEAN, description="Награда получена."),
+                            }
+                        )
+                    ),
+                }
+            )
+        ),
+        404: openapi.Response(description="Пользователь не найден."),
+    }
+)
 @api_view(['GET'])
-def get_tasks(request, telegram_id):
+def user_tasks(request, telegram_id):
     """
-    Возвращает список заданий пользователя по его Telegram ID.
+    Возвращает доступные задания с прогрессом пользователя по ним за текущий период.
     """
-    try:
-        user = get_object_or_404(User, telegram_id=telegram_id)
-        tasks = Task.objects.filter(user=user).select_related('user')
-        serializer = TaskSerializer(tasks, many=True)
-        return JsonResponse({'tasks': serializer.data}, status=200)
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+    user_id = identity_cache.get_user_id_or_404(telegram_id)
+    tasks = [task for task in Task.objects.filter(is_active=True) if task.is_available]
+    progress = task_progress.user_progress(user_id, tasks)
+    data = TaskSerializer(tasks, many=True).data
+    for item, task in zip(data, tasks):
+        task_state = progress.get(task.pk)
+        item.update({
+            'progress': task_state.value if task_state else 0,
+            'completed': bool(task_state and task_state.completed_at),
+            'claimed': bool(task_state and task_state.claimed_at),
+        })
+    return Response({'tasks': data})
 
 
 @swagger_auto_schema(
     methods=['post'],
-    operation_description="Отмечает задачу как выполненную и начисляет награду.",
+    operation_description="Начисляет награду за выполненное задание (один раз за период: день для ежедневных заданий). "
+                          "Задание без показателя считается выполненным в момент запроса.",
     request_body=CompleteTaskSerializer,
     responses={
         200: openapi.Response(
@@ -442,52 +480,40 @@ def get_tasks(request, telegram_id):
                 },
             ),
         ),
-        400: "Ошибка: Неверные данные",
-        500: "Ошибка: Системная ошибка",
+        400: "Ошибка: задание не выполнено или награда уже получена",
+        404: "Пользователь или задание не найдены",
     }
 )
 @api_view(['POST'])
-def tasks_complete(request):
+@throttle_classes([TaskCompleteThrottle])
+def tasks_complete(request, task_id):
     """
-    Отмечает задачу как выполненную и начисляет награду.
+    Начисляет награду за выполненное задание.
     """
-    try:
-        task_id = request.data.get('task_id')
-        telegram_id = request.data.get('telegram_id')
-
-        logger.info(f"Received task_id: {task_id}, telegram_id: {telegram_id}")
-
-        if not task_id or not telegram_id:
-            return Response({"error": "task_id and telegram_id are required"}, status=status.HTTP_400_BAD_REQUEST)
-
-        user = get_object_or_404(User, telegram_id=telegram_id)
-        task = get_object_or_404(Task, id=task_id, user=user)
-
-        if task.is_completed:
-            return Response({'error': 'Task already completed'}, status=status.HTTP_400_BAD_REQUEST)
-
-        logger.info(f"Task reward: {task.reward}")
-        task.is_completed = True
-        task.save()
-
-        user.points += task.reward
-        user.save()
+    telegram_id = request.data.get('telegram_id')
+    if not telegram_id:
+        return Response({"error": "telegram_id is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        logger.info(f"Task completed: {task.is_completed}, User points: {user.points}")
+    user_id = identity_cache.get_user_id_or_404(telegram_id)
+    task = get_object_or_404(Task, id=task_id)
+    if not task.is_available:
+        return Response({'error': 'Task is not available'}, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response({'task_id': task.id, 'new_points': user.points}, status=status.HTTP_200_OK)
+    if not task_progress.claim(user_id, task):
+        return Response({'error': 'Task is not completed or already claimed'}, status=status.HTTP_400_BAD_REQUEST)
 
-    except Exception as e:
-        logger.error(f"Error: {str(e)}")
-        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    user = counters.overlay(User.objects.get(pk=user_id))
+    logger.info(f"Task {task.id} reward {task.reward} claimed by user {user_id}")
+    return Response({'task_id': task.id, 'new_points': user.points}, status=status.HTTP_200_OK)
 
 
+@conditional.conditional(conditional.user_etag(conditional.SCOPE_STATS))
+@api_view(['GET'])
 def get_statistics(request, telegram_id):
-    try:
-        user = User.objects.get(telegram_id=telegram_id)
-    except User.DoesNotExist:
+    identity = identity_cache.lookup(telegram_id)
+    if identity is None:
         return Response({"error": "Пользователь не найден"}, status=status.HTTP_404_NOT_FOUND)
-    statistics = user.statistics
+    statistics = Statistics.objects.get(user_id=identity['id'])
 
     return JsonResponse({
         'total_steps': statistics.total_steps,
@@ -526,6 +552,7 @@ def get_statistics(request, telegram_id):
         500: openapi.Response(description="Ошибка сервера."),
     }
 )
+@conditional.conditional(conditional.user_etag(conditional.SCOPE_BONUS, lambda: now().date()))
 @api_view(['GET'])
 def streak_history(request, telegram_id):
     """
@@ -536,8 +563,7 @@ def streak_history(request, telegram_id):
     - Текущий стрик.
     - Статус бонусов за каждые 5 дней.
     """
-    user = get_object_or_404(User, telegram_id=telegram_id)
-    daily_bonus = user.daily_bonus
+    daily_bonus = DailyBonus.objects.get(user_id=identity_cache.get_user_id_or_404(telegram_id))
 
     today = now().date()
     days = []
@@ -590,24 +616,21 @@ def streak_history(request, telegram_id):
     }
 )
 @api_view(['POST'])
+@throttle_classes([DailyBonusThrottle])
 def claim_daily_bonus(request, telegram_id):
     """
     Пользователь получает ежедневный бонус за текущий день.
     """
-    user = get_object_or_404(User, telegram_id=telegram_id)
-    daily_bonus = user.daily_bonus
-
-    today = now().date()
-    if str(today) in daily_bonus.claimed_days:
+    user = counters.overlay(get_object_or_404(User, telegram_id=telegram_id))
+
+    with transaction.atomic():
+        daily_bonus, _ = DailyBonus.objects.select_for_update().get_or_create(user=user)
+        bonus = daily_bonus.process_daily_bonus(DAILY_BONUS_POINTS)
+        if bonus is not None:
+            conditional.bump([user.pk], conditional.SCOPE_BONUS)
+    if bonus is None:
         return Response({'error': 'Бонус уже получен за сегодня'}, status=status.HTTP_400_BAD_REQUEST)
-
-    bonus = 10
     user.points += bonus
-    daily_bonus.claimed_days[str(today)] = bonus
-    daily_bonus.update_streak()
-
-    user.save()
-    daily_bonus.save()
 
     return Response({'message': 'Бонус успешно получен', 'bonus': bonus, 'totalPoints': user.points})
 
@@ -687,6 +710,50 @@ def check_unfinished(request):
     })
 
 
+@csrf_exempt
+@require_POST
+def offline_walk(request):
+    """
+    Приём прогулки, записанной без связи, одним запросом (формат см. в offline_walks).
+    Ключ идемпотентности передаётся в теле (idempotency_key) или в заголовке Idempotency-Key.
+    Отвечает 202 сразу после сохранения; повторная отправка с тем же ключом или теми же замерами
+    возвращает состояние обработки. Как и для прогулки онлайн, энергия должна быть полной.
+    """
+    body = request.body
+    if len(body) > settings.OFFLINE_WALK_MAX_BYTES:
+        return JsonResponse({"error": "Payload too large"}, status=413)
+
+    try:
+        if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+            payload, raw = body, offline_walks.decompress(body)
+        else:
+            payload, raw = offline_walks.encode(body), body
+        data = offline_walks.parse(raw)
+    except offline_walks.InvalidPayload as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    idempotency_key = str(data.get('idempotency_key') or request.headers.get('Idempotency-Key') or '')
+    if not idempotency_key or len(idempotency_key) > 64:
+        return JsonResponse({"error": "idempotency_key is required (up to 64 characters)"}, status=400)
+    telegram_id = data.get('telegram_id')
+    wait = throttling.check('offline_walk', telegram_id)
+    if wait is not None:
+        return throttling.throttled_response(wait)
+    user = get_object_or_404(User, pk=identity_cache.get_user_id_or_404(telegram_id))
+    user.update_energy()
+    if user.energy < user.max_energy:
+        return JsonResponse({"error": "Энергия должна быть полной для начала прогулки"}, status=400)
+
+    try:
+        submission, created = offline_walks.submit(user.pk, idempotency_key, payload, data)
+    except offline_walks.OverlappingWalk as e:
+        return JsonResponse({"error": str(e)}, status=409)
+    response = {"submission_id": submission.id, "status": submission.status, "duplicate": not created}
+    if submission.walk_id:
+        response.update(walk_id=submission.walk_id, reward=submission.walk.reward)
+    return JsonResponse(response, status=202)
+
+
 @csrf_exempt
 def lucky_throw(request):
     if request.method == 'POST':
@@ -694,14 +761,17 @@ def lucky_throw(request):
             data = json.loads(request.body)
             walk_id = data.get('walk_id')
             telegram_id = data.get('telegram_id')
+            wait = throttling.check('lucky_throw', telegram_id)
+            if wait is not None:
+                return throttling.throttled_response(wait)
 
-            user = get_object_or_404(User, telegram_id=telegram_id)
+            user = counters.overlay(get_object_or_404(User, telegram_id=telegram_id))
             walk = get_object_or_404(Walk, id=walk_id, user=user)
 
-            multiplier = 2.0 if np.random.random() < 0.5 else 1.0
+            multiplier = 2.0 if random.random() < 0.5 else 1.0
             coins_earned = walk.reward * multiplier
+            counters.add(user.pk, points=coins_earned - walk.reward)
             user.points += coins_earned - walk.reward
-            user.save()
 
             return JsonResponse({
                 "bonus_multiplier": multiplier,
@@ -740,10 +810,10 @@ def stepometer(request):
     if not telegram_id:
         return Response({"error": "telegram_id is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-    user = get_object_or_404(User, telegram_id=telegram_id)
+    user = counters.overlay(get_object_or_404(User, telegram_id=telegram_id))
     user.update_energy()
 
-    walk_session = WalkSession.objects.filter(user=user).first()
+    walk_session = WalkSession.objects.filter(user=user, finished_at__isnull=True).first()
     is_walk_running = walk_session is not None
     walk_duration = None
 
@@ -780,6 +850,14 @@ def main_page(request):
     if not telegram_id:
         return JsonResponse({"error": "Telegram ID is required"}, status=400)
 
+    # Уже известный пользователь: get_or_create не нужен, реферальная ссылка учитывается только для новых
+    if identity_cache.lookup(telegram_id) is not None:
+        return JsonResponse({
+            "message": "User processed successfully",
+            "is_new_user": False,
+            "referral_set": False
+        })
+
     user, created = User.objects.get_or_create(
         telegram_id=telegram_id,
         defaults={
@@ -794,6 +872,8 @@ def main_page(request):
         referrer = User.objects.filter(referral_uuid=refid).first()
         if referrer and referrer != user:
             Referral.objects.create(user=user, invited_by=referrer)
+            # Сеть изменилась у пригласившего и всех его предков
+            conditional.bump(referral_graph.add_edge(user.pk, referrer.pk), conditional.SCOPE_REFERRALS)
             referrer.referral.total_invited += 1
             referrer.save()
         elif referrer == user:
@@ -808,6 +888,15 @@ def main_page(request):
     })
 
 
+def _tasks_etag(request):
+    """
+    ETag списка заданий: любое сохранение задания меняет последний updated_at, удаление — число заданий.
+    """
+    tasks = Task.objects.aggregate(updated_at=Max('updated_at'), count=Count('id'))
+    updated_at = tasks['updated_at'].timestamp() if tasks['updated_at'] else 0
+    return f"tasks-{tasks['count']}-{updated_at}-{request.GET.get('task_type', '')}"
+
+
 @swagger_auto_schema(
     methods=['get'],
     operation_description="Возвращает список всех активных заданий с возможностью фильтрации по типу задачи.",
@@ -843,6 +932,7 @@ def main_page(request):
         500: openapi.Response(description="Ошибка сервера."),
     }
 )
+@conditional.conditional(_tasks_etag, max_age=settings.TASKS_CACHE_SECONDS, public=True)
 @api_view(['GET'])
 def get_tasks(request):
     """
@@ -902,8 +992,9 @@ def get_tasks(request):
     }
 )
 @api_view(['GET'])
+@db_router.replica_reads
 def global_statistics(request, telegram_id):
-    user = get_object_or_404(User, telegram_id=telegram_id)
+    identity_cache.get_user_id_or_404(telegram_id)
 
     ranked_users = User.objects.annotate(
         rank=Window(
@@ -922,7 +1013,7 @@ def global_statistics(request, telegram_id):
 
 @swagger_auto_schema(
     methods=['get'],
-    operation_description="Возвращает топ рефералов текущего пользователя, отсортированных по очкам.",
+    operation_description="Возвращает топ-100 рефералов текущего пользователя, отсортированных по очкам, и его сеть по уровням.",
     responses={
         200: openapi.Response(
             description="Топ рефералов текущего пользователя.",
@@ -942,6 +1033,19 @@ def global_statistics(request, telegram_id):
                     ),
                     'referral_count': openapi.Schema(type=openapi.TYPE_INTEGER, description="Количество рефералов пользователя."),
                     'total_referral_points': openapi.Schema(type=openapi.TYPE_INTEGER, description="Сумма очков всех рефералов."),
+                    'network_size': openapi.Schema(type=openapi.TYPE_INTEGER, description="Пользователей в сети на всех уровнях."),
+                    'levels': openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        description="Сеть по уровням приглашений.",
+                        items=openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                'depth': openapi.Schema(type=openapi.TYPE_INTEGER, description="Уровень: 1 — приглашённые напрямую."),
+                                'users': openapi.Schema(type=openapi.TYPE_INTEGER, description="Пользователей на уровне."),
+                                'points': openapi.Schema(type=openapi.TYPE_NUMBER, description="Сумма их очков."),
+                            }
+                        )
+                    ),
                 }
             )
         ),
@@ -949,31 +1053,164 @@ def global_statistics(request, telegram_id):
         500: openapi.Response(description="Ошибка сервера.")
     }
 )
+@conditional.conditional(
+    conditional.user_etag(conditional.SCOPE_REFERRALS, lambda: int(time.time() // settings.REFERRALS_CACHE_SECONDS)),
+    max_age=settings.REFERRALS_CACHE_SECONDS,
+)
 @api_view(['GET'])
+@db_router.replica_reads
 def user_top_referrals(request, telegram_id):
     """
     Возвращает топ рефералов текущего пользователя, отсортированных по очкам.
     """
     user = get_object_or_404(User, telegram_id=telegram_id)
-    user_referrals = user.referrals.all().order_by('-points')
+    user_referrals = User.objects.filter(referral__invited_by=user)
 
     referral_stats = user_referrals.aggregate(
         referral_count=Count('id'),
         total_points=Sum('points')
     )
+    # Сеть по уровням — из таблицы замыкания (см. referral_graph.py)
+    levels = referral_graph.levels(user.pk)
 
     return Response({
-        "user_referrals": [
-            {
-                "username": referral.username,
-                "points": referral.points
-            }
-            for referral in user_referrals
-        ],
+        "user_referrals": list(user_referrals.order_by('-points').values('username', 'points')[:100]),
         "referral_count": referral_stats['referral_count'] or 0,
         "total_referral_points": referral_stats['total_points'] or 0,
+        "network_size": sum(level['users'] for level in levels),
+        "levels": levels,
     })
 
 
+_leaderboard_entry = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'rank': openapi.Schema(type=openapi.TYPE_INTEGER, description="Место (равные очки делят место)."),
+        'user_id': openapi.Schema(type=openapi.TYPE_INTEGER, description="ID пользователя."),
+        'username': openapi.Schema(type=openapi.TYPE_STRING, description="Имя пользователя."),
+        'score': openapi.Schema(type=openapi.TYPE_NUMBER, description="Прогресс по показателю челленджа."),
+    }
+)
+
+
+@swagger_auto_schema(
+    methods=['get'],
+    operation_description="Рейтинг челленджа: топ участников и место пользователя. "
+                          "После окончания челленджа возвращается зафиксированный итог.",
+    manual_parameters=[
+        openapi.Parameter('telegram_id', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                          description="Telegram ID пользователя, чьё место нужно вернуть."),
+        openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                          description=f"Размер топа, не больше {CHALLENGE_LEADERBOARD_LIMIT}."),
+    ],
+    responses={
+        200: openapi.Response(
+            description="Рейтинг челленджа.",
+            schema=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'task_id': openapi.Schema(type=openapi.TYPE_INTEGER, description="ID челленджа."),
+                    'frozen': openapi.Schema(type=openapi.TYPE_BOOLEAN, description="Челлендж завершён, итог зафиксирован."),
+                    'top': openapi.Schema(type=openapi.TYPE_ARRAY, items=_leaderboard_entry),
+                    'me': _leaderboard_entry,
+                }
+            )
+        ),
+        404: openapi.Response(description="Челлендж или пользователь не найден."),
+    }
+)
+@api_view(['GET'])
+@db_router.replica_reads
+def challenge_leaderboard(request, task_id):
+    """
+    Возвращает рейтинг челленджа (см. challenges.py).
+    """
+    task = get_object_or_404(Task, pk=task_id)
+    if not challenges.is_ranked(task):
+        return Response({'error': 'У задания нет рейтинга'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        limit = min(max(int(request.query_params.get('limit', CHALLENGE_LEADERBOARD_LIMIT)), 1),
+                    CHALLENGE_LEADERBOARD_LIMIT)
+    except ValueError:
+        return Response({'error': 'limit должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+    telegram_id = request.query_params.get('telegram_id')
+    user_id = identity_cache.get_user_id_or_404(int(telegram_id)) if telegram_id and telegram_id.isdigit() else None
+
+    result = challenges.leaderboard(task, user_id, limit)
+    entries = result['top'] + ([result['me']] if result['me'] else [])
+    usernames = dict(User.objects.filter(pk__in={entry['user_id'] for entry in entries}).values_list('pk', 'username'))
+    for entry in entries:
+        entry['username'] = usernames.get(entry['user_id'])
+    return Response({'task_id': task.pk, **result})
+
+
+_entry_page = {}
+
+
+def _entry_page_etag(request):
+    """
+    Страница входа зависит только от шаблона и манифеста статики, которые меняются с выкладкой,
+    поэтому рендерится один раз на процесс (в DEBUG — на каждый запрос, чтобы видеть правки шаблона).
+    """
+    if settings.DEBUG or 'content' not in _entry_page:
+        content = render_to_string('index.html').encode()
+        _entry_page.update(content=content, etag=hashlib.md5(content, usedforsecurity=False).hexdigest())
+    return _entry_page['etag']
+
+
+@conditional.conditional(_entry_page_etag)
 def home(request):
-    return render(request, 'index.html')
\ No newline at end of file
+    """
+    Страница входа мини-приложения. Ссылается на статику с хэшем в имени, поэтому сама всегда
+    переспрашивается по ETag, а статика кэшируется навсегда.
+    """
+    return HttpResponse(_entry_page['content'])
+
+
+def metrics(request):
+    """
+    Отдаёт метрики всех процессов приложения в текстовом формате Prometheus.
+    """
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def health_live(request):
+    """
+    Проверка живости процесса (без обращения к внешним сервисам).
+    """
+    return JsonResponse({"status": "ok"})
+
+
+def health_ready(request):
+    """
+    Проверка готовности: доступность и время ответа базы данных и Redis, отставание реплик.
+    Возвращает 503, если сервис недоступен или отвечает дольше заданного порога.
+    """
+    checks = {}
+    ready = True
+
+    start = time.perf_counter()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        db_ms = (time.perf_counter() - start) * 1000
+        checks["db"] = {"ok": db_ms <= settings.READINESS_MAX_DB_MS, "latency_ms": round(db_ms, 2)}
+    except Exception as e:
+        checks["db"] = {"ok": False, "error": str(e)}
+    ready &= checks["db"]["ok"]
+
+    if settings.REDIS_URL:
+        try:
+            redis_ms = redis_client.ping() * 1000
+            checks["redis"] = {"ok": redis_ms <= settings.READINESS_MAX_REDIS_MS, "latency_ms": round(redis_ms, 2)}
+        except Exception as e:
+            checks["redis"] = {"ok": False, "error": str(e)}
+        if settings.READINESS_REQUIRE_REDIS:
+            ready &= checks["redis"]["ok"]
+
+    # Отстающие реплики не делают сервис неготовым: чтения с них уходят в основную базу
+    for alias, lag in db_router.lag_monitor.lags().items():
+        checks[alias] = {"ok": lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS, "lag_seconds": lag}
+
+    return JsonResponse({"status": "ok" if ready else "unavailable", "checks": checks},
+                        status=200 if ready else 503)
@@ -0,0 +1,199 @@
+"""
+Завершение прогулки в фоне.
+
+Запрос на завершение только «замораживает» сессию (walk_service.claim_session): ставит finished_at
+и предварительную награду. Остальное делает цепочка задач Celery (см. start):
+
+    persist_walk → walk_anticheat → walk_stats → walk_referral → walk_tasks → cleanup_walk_session
+
+anticheat идёт первым: у недостоверной прогулки он отзывает награду, начисленную в persist
+(или в offline_walks.process), а статистика, реферальный бонус и задания её пропускают.
+
+Каждый шаг идемпотентен: persist_walk запоминает созданную прогулку в сессии, остальные шаги
+отмечают себя в Walk.finalized_steps в той же транзакции, что и свои изменения.
+Поэтому повторы задач и повторный запуск всей цепочки (resume_walk_finalization) безопасны.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from . import challenges, conditional, counters, task_progress
+from .models import Walk, WalkSession, Statistics, GlobalStatistics, Referral, AnomalyLog
+from .walk_service import walk_from_session
+
+logger = logging.getLogger(__name__)
+
+
+def start(session_id):
+    """
+    Запускает цепочку задач завершения прогулки.
+    Если брокер недоступен, сессию позже подберёт resume_walk_finalization.
+    """
+    from celery import chain
+    from . import tasks
+
+    try:
+        chain(
+            tasks.persist_walk.si(session_id),
+            *_step_tasks(),
+            tasks.cleanup_walk_session.si(session_id),
+        ).apply_async(retry=False)
+    except Exception as e:
+        logger.warning(f"Не удалось запустить завершение прогулки для сессии {session_id}: {e}")
+
+
+def start_for_walk(walk_id):
+    """
+    Запускает шаги после сохранения для прогулки, созданной без сессии (офлайн-прогулки).
+    """
+    from celery import chain
+    from . import tasks
+
+    try:
+        chain(tasks.walk_anticheat.si(walk_id), *_step_tasks()[1:]).apply_async(retry=False)
+    except Exception as e:
+        logger.warning(f"Не удалось запустить обработку прогулки {walk_id}: {e}")
+
+
+def _step_tasks():
+    from . import tasks
+
+    return [tasks.walk_anticheat.s(), tasks.walk_stats.s(), tasks.walk_referral.s(), tasks.walk_tasks.s()]
+
+
+def persist(session_id):
+    """
+    Создаёт прогулку из замороженной сессии и начисляет награду.
+    :return: ID прогулки или None, если сессии уже нет.
+    """
+    with transaction.atomic():
+        walk_session = WalkSession.objects.select_for_update(of=('self',)).select_related('user').filter(
+            id=session_id, finished_at__isnull=False).first()
+        if walk_session is None:
+            return None
+        if walk_session.walk_id is not None:
+            return walk_session.walk_id
+
+        walk = walk_from_session(walk_session, walk_session.user, walk_session.reward,
+                                 end_time=walk_session.finished_at, is_interrupted=walk_session.is_interrupted)
+        walk.save()
+        # Награда пишется в базу в этой же транзакции, а не через буфер: так она начисляется ровно один раз.
+        counters.write({walk.user_id: {'points': walk.reward, 'energy': 0, 'last_energy_update': None}})
+        walk_session.walk = walk
+        walk_session.save(update_fields=['walk'])
+    counters.flush([walk.user_id])
+    return walk.pk
+
+
+def run_step(walk_id, step, apply):
+    """
+    Выполняет шаг apply(walk) один раз для прогулки: под блокировкой строки прогулки
+    и с отметкой в finalized_steps в той же транзакции.
+    """
+    if walk_id is None:
+        return None
+    with transaction.atomic():
+        walk = Walk.objects.select_for_update().filter(pk=walk_id).first()
+        if walk is None or step in walk.finalized_steps:
+            return walk_id
+        apply(walk)
+        walk.finalized_steps = walk.finalized_steps + [step]
+        walk.save(update_fields=['finalized_steps', 'is_valid', 'reward'])
+    return walk_id
+
+
+def apply_stats(walk):
+    """
+    Добавляет прогулку в статистику пользователя и в общую статистику. Недостоверные прогулки не учитываются.
+    """
+    if not walk.is_valid:
+        return
+    Statistics.objects.get_or_create(user_id=walk.user_id)
+    Statistics.objects.filter(user_id=walk.user_id).update(
+        total_steps=F('total_steps') + walk.steps,
+        total_distance=F('total_distance') + walk.distance / 1000,
+        total_rewards=F('total_rewards') + walk.reward,
+    )
+    conditional.bump([walk.user_id], conditional.SCOPE_STATS)
+    GlobalStatistics.objects.get_or_create(pk=1)
+    GlobalStatistics.objects.filter(pk=1).update(
+        total_steps=F('total_steps') + walk.steps,
+        total_distance=F('total_distance') + walk.distance / 1000,
+        total_rewards=F('total_rewards') + walk.reward,
+    )
+
+
+def apply_referral(walk):
+    """
+    Начисляет пригласившему пользователю процент от награды за прогулку. За недостоверные прогулки не начисляет.
+    """
+    if not walk.is_valid:
+        return
+    # Блокировка строки реферала — на случай одновременного отзыва (moderation.revoke_rewards)
+    referral = Referral.objects.select_for_update().filter(
+        user_id=walk.user_id, invited_by__isnull=False, is_revoked=False).first()
+    if referral is None or walk.reward <= 0:
+        return
+    bonus = round(walk.reward * referral.reward_percentage / 100, 2)
+    counters.write({referral.invited_by_id: {'points': bonus, 'energy': 0, 'last_energy_update': None}})
+    Referral.objects.filter(pk=referral.pk).update(total_rewards=F('total_rewards') + bonus)
+
+
+def apply_anticheat(walk):
+    """
+    Отмечает недостоверные прогулки: слишком высокая средняя скорость или слишком длинный шаг.
+    Награда за такую прогулку обнуляется и вычитается из очков пользователя, как при модерации.
+    """
+    problems = []
+    if walk.avg_speed * 3.6 > settings.ANTICHEAT_MAX_SPEED_KMH:
+        problems.append(f"средняя скорость {walk.avg_speed * 3.6:.1f} км/ч")
+    if walk.distance > 100 and walk.distance / max(walk.steps, 1) > settings.ANTICHEAT_MAX_STEP_LENGTH_M:
+        problems.append(f"{walk.distance:.0f} м при {walk.steps} шагах")
+    if problems:
+        walk.is_valid = False
+        AnomalyLog.objects.create(user_id=walk.user_id, description=f"Прогулка {walk.pk}: " + ", ".join(problems))
+        if walk.reward > 0:
+            counters.write({walk.user_id: {'points': -walk.reward, 'energy': 0, 'last_energy_update': None}})
+            walk.reward = 0
+
+
+def apply_tasks(walk):
+    """
+    Учитывает прогулку в прогрессе по заданиям и в рейтингах челленджей.
+    Идёт после anticheat: недостоверные прогулки не учитываются.
+    """
+    touched = task_progress.apply_walk(walk)
+    if touched:
+        challenges.update_scores(walk.user_id, touched)
+
+
+def cleanup(session_id):
+    """
+    Удаляет сессию, прогулка из которой уже сохранена.
+    """
+    WalkSession.objects.filter(id=session_id, walk__isnull=False).delete()
+
+
+def run(session_id):
+    """
+    Выполняет все шаги синхронно, в том же порядке, что и цепочка задач.
+    """
+    walk_id = persist(session_id)
+    run_steps(walk_id)
+    cleanup(session_id)
+    return walk_id
+
+
+def run_steps(walk_id):
+    for step, apply in STEPS:
+        run_step(walk_id, step, apply)
+
+
+STEPS = (
+    ('anticheat', apply_anticheat),
+    ('stats', apply_stats),
+    ('referral', apply_referral),
+    ('tasks', apply_tasks),
+)
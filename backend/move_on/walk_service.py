@@ -0,0 +1,115 @@
+from django.db import transaction
+from django.utils.timezone import now
+
+from .models import Walk, WalkSession
+from .motion import calculate_steps, calculate_speed, calculate_speed_from_gps
+from .utils import calculate_reward
+
+
+def apply_sample(walk_session, acc_x, acc_y, acc_z, latitude, longitude, speed_from_gps=0, current_time=None):
+    """
+    Обновляет состояние сессии прогулки по одному замеру акселерометра и GPS.
+    Общая логика для синхронного WalkViewSet.update и асинхронных представлений.
+
+    :return: Текущая скорость (в м/с).
+    """
+    current_time = current_time or now()
+    acceleration_data = [{"x": acc_x, "y": acc_y, "z": acc_z}]
+    walk_session.steps += calculate_steps(acceleration_data)
+
+    if walk_session.last_latitude and walk_session.last_longitude:
+        prev_coords = (walk_session.last_latitude, walk_session.last_longitude)
+        distance = calculate_speed_from_gps(prev_coords, (latitude, longitude), 1)
+        if 2 < distance < 50:
+            walk_session.distance += distance
+
+    walk_session.last_latitude = latitude
+    walk_session.last_longitude = longitude
+
+    delta_time = (
+        current_time - walk_session.last_step_time).total_seconds() if walk_session.last_step_time else 1
+    current_speed = speed_from_gps or calculate_speed(acceleration_data, delta_time)
+    walk_session.last_step_time = current_time
+
+    elapsed_time = (current_time - walk_session.start_time).total_seconds()
+    walk_session.avg_speed = walk_session.distance / elapsed_time if elapsed_time > 0 else 0
+    return current_speed
+
+
+# Поля сессии, которые меняет замер (apply_sample)
+SAMPLE_FIELDS = ('steps', 'distance', 'avg_speed', 'last_step_time', 'last_latitude', 'last_longitude')
+
+
+def _sample_update(walk_session):
+    # Завершение (claim_session) меняет другие поля, но и замер после него записывать нельзя
+    return WalkSession.objects.filter(pk=walk_session.pk, finished_at__isnull=True), {
+        field: getattr(walk_session, field) for field in SAMPLE_FIELDS
+    }
+
+
+def save_sample(walk_session):
+    """
+    Записывает поля замера, если сессия ещё не завершена. Вся строка не сохраняется, чтобы
+    параллельное завершение не откатилось.
+    :return: False, если сессию уже завершили.
+    """
+    sessions, fields = _sample_update(walk_session)
+    return sessions.update(**fields) == 1
+
+
+async def asave_sample(walk_session):
+    """
+    Асинхронный вариант save_sample.
+    """
+    sessions, fields = _sample_update(walk_session)
+    return await sessions.aupdate(**fields) == 1
+
+
+def session_reward(walk_session, user):
+    """
+    Рассчитывает награду за прогулку по накопленным данным сессии.
+    """
+    return calculate_reward(
+        distance_km=walk_session.distance / 1000,
+        steps=walk_session.steps,
+        avg_speed_kmh=walk_session.avg_speed * 3.6,
+        daily_streak=user.daily_streak,
+        endurance_level=user.endurance_level,
+        efficiency_level=user.efficiency_level,
+        luck_level=user.luck_level,
+    )
+
+
+def walk_from_session(walk_session, user, reward, end_time=None, **extra):
+    """
+    Возвращает несохранённую прогулку, собранную из данных сессии.
+    """
+    return Walk(
+        user=user,
+        start_time=walk_session.start_time,
+        end_time=end_time or now(),
+        steps=walk_session.steps,
+        distance=walk_session.distance,
+        avg_speed=walk_session.avg_speed,
+        reward=reward,
+        **extra,
+    )
+
+
+def claim_session(session_id, interrupted=False):
+    """
+    Завершает сессию прогулки: фиксирует время окончания и предварительную награду.
+    Сессия блокируется на время проверки, поэтому из параллельных запросов на завершение
+    сессию завершает только один, остальные получают уже зафиксированную награду.
+
+    :return: (сессия, завершена ли она этим вызовом).
+    """
+    with transaction.atomic():
+        walk_session = WalkSession.objects.select_for_update(of=('self',)).select_related('user').get(id=session_id)
+        if walk_session.finished_at is not None:
+            return walk_session, False
+        walk_session.reward = session_reward(walk_session, walk_session.user)
+        walk_session.finished_at = now()
+        walk_session.is_interrupted = interrupted
+        walk_session.save(update_fields=['reward', 'finished_at', 'is_interrupted'])
+    return walk_session, True